@@ -0,0 +1,94 @@
+"""
+Museum live aggregation
+Rolling per-exhibition kiosk metrics kept in memory by the consumer,
+using ring buffers of per-second counters indexed by site and value
+"""
+
+from datetime import datetime, timezone
+import json
+from threading import Lock
+from time import time
+
+import numpy as np
+
+from cleaning import VALID_SITES, VALID_TYPES, VALID_VALS, KioskEvent
+
+WINDOW_SECONDS = 3600
+SNAPSHOT_WINDOWS = {'5m': 300, '60m': 3600}
+RATING_VALUES = np.array([val for val in VALID_VALS if val >= 0])
+NUM_SITES = len(VALID_SITES)
+EMERGENCY_TYPE = 1
+
+
+class RollingAggregator:
+    """
+    Counts ratings by site and value and support requests by site and type
+    in one slot per second of event time, over the last window_seconds.
+    Slots are reused as time moves on, so memory stays fixed however many
+    messages arrive, and a snapshot only sums the slots inside each window.
+    """
+
+    def __init__(self, window_seconds: int = WINDOW_SECONDS, clock=time):
+        self.window_seconds = window_seconds
+        self.clock = clock
+        self.slot_seconds = np.full(window_seconds, -1, dtype=np.int64)
+        self.ratings = np.zeros((window_seconds, NUM_SITES, len(RATING_VALUES)),
+                                dtype=np.int32)
+        self.support = np.zeros((window_seconds, NUM_SITES, len(VALID_TYPES)),
+                                dtype=np.int32)
+        self.lock = Lock()
+
+    def get_slot(self, second: int) -> int:
+        """Get the slot counting a second, clearing it if it held an older second"""
+        slot = second % self.window_seconds
+        if self.slot_seconds[slot] != second:
+            self.slot_seconds[slot] = second
+            self.ratings[slot] = 0
+            self.support[slot] = 0
+        return slot
+
+    def add(self, event: KioskEvent):
+        """Count a validated kiosk event at the second it happened"""
+        now = int(self.clock())
+        second = min(int(datetime.fromisoformat(event.at).timestamp()), now)
+        if second <= now - self.window_seconds:
+            return
+        with self.lock:
+            slot = self.get_slot(second)
+            if event.val >= 0:
+                self.ratings[slot, event.site, event.val] += 1
+            else:
+                self.support[slot, event.site, event.type] += 1
+
+    def snapshot(self) -> dict:
+        """Get each exhibition's rating counts, average rating and support counts per window"""
+        now = int(self.clock())
+        with self.lock:
+            slot_seconds = self.slot_seconds.copy()
+            ratings = self.ratings.copy()
+            support = self.support.copy()
+
+        sites = [{'site': site, 'windows': {}} for site in range(NUM_SITES)]
+        for label, seconds in SNAPSHOT_WINDOWS.items():
+            in_window = (slot_seconds > now - seconds) & (slot_seconds <= now)
+            site_ratings = ratings[in_window].sum(axis=0)
+            site_support = support[in_window].sum(axis=0)
+            rating_counts = site_ratings.sum(axis=1)
+            rating_totals = site_ratings @ RATING_VALUES
+            for site in range(NUM_SITES):
+                count = int(rating_counts[site])
+                sites[site]['windows'][label] = {
+                    'ratings': count,
+                    'average_rating': (round(float(rating_totals[site]) / count, 2)
+                                       if count else None),
+                    'rating_counts': site_ratings[site].tolist(),
+                    'assistance': int(site_support[site].sum()
+                                      - site_support[site, EMERGENCY_TYPE]),
+                    'emergencies': int(site_support[site, EMERGENCY_TYPE])}
+
+        return {'generated_at': datetime.fromtimestamp(now, timezone.utc).isoformat(),
+                'exhibitions': sites}
+
+    def snapshot_route(self) -> tuple[str, str]:
+        """Get the snapshot as a JSON endpoint response"""
+        return 'application/json', json.dumps(self.snapshot())
@@ -0,0 +1,222 @@
+"""
+Museum asyncio consume mode
+Poll, validate and write Kafka kiosk messages as concurrent asyncio stages joined by
+bounded queues, so Kafka fetches overlap database round-trips. Blocking consumer and
+database calls run in worker threads, and a full queue stops polling until the writer
+catches up.
+"""
+
+import asyncio
+import logging
+import signal
+from threading import Event
+from time import monotonic
+from typing import TYPE_CHECKING
+
+from confluent_kafka import Consumer
+
+from consume import (LAG_INTERVAL,
+                     QUEUE_SIZE,
+                     MessageSummary,
+                     add_events,
+                     format_instance_row,
+                     get_message_source_id,
+                     get_offsets,
+                     get_topic_partitions,
+                     record_consumer_lag,
+                     reject_message,
+                     upload_batches,
+                     validate_timed)
+from database import RATING_TABLE, SUPPORT_TABLE, ConnectionPool
+from dimensions import DimensionCache
+from metrics import set_gauge, tagged, timed_untagged
+
+if TYPE_CHECKING:
+    from aggregation import RollingAggregator
+
+
+def run_tagged(stage: str, func, *args, **kwargs):
+    """Call func with the current thread tagged with a stage for any profiler"""
+    with tagged(stage):
+        return func(*args, **kwargs)
+
+
+async def run_stage(stage: str, func, *args, **kwargs):
+    """
+    Run a blocking stage in a worker thread, timing it across the await. Only the
+    worker thread is tagged for the profiler, which tags stages by thread, as the
+    event loop thread runs the other tasks while this one waits
+    """
+    with timed_untagged(stage):
+        return await asyncio.to_thread(run_tagged, stage, func, *args, **kwargs)
+
+
+async def poll_stage(consumer: Consumer, raw_queue: asyncio.Queue, batch_size: int,
+                     max_delay: float, stop_event: Event):
+    """
+    Fetch up to batch_size messages at a time in a worker thread until stop_event is set,
+    waiting for space in the bounded raw queue before fetching again
+    """
+    last_lag_check = monotonic()
+    while not stop_event.is_set():
+        messages = await run_stage('poll', consumer.consume, batch_size, max_delay)
+        if messages:
+            await raw_queue.put(messages)
+            set_gauge('queue_depth', raw_queue.qsize(), queue='raw')
+        if monotonic() - last_lag_check >= LAG_INTERVAL:
+            record_consumer_lag(consumer)
+            last_lag_check = monotonic()
+    await raw_queue.put(None)
+
+
+async def validate_stage(pool: ConnectionPool, raw_queue: asyncio.Queue,
+                         write_queue: asyncio.Queue, summary: MessageSummary,
+                         dimensions: DimensionCache, dead_letters=None):
+    """
+    Validate each fetched batch into per-table rows, resolving kiosk codes through
+    the dimension cache and sending rejected messages to the optional dead letter
+    sink, and pass the rows on with their offsets and accepted events
+    """
+    while (messages := await raw_queue.get()) is not None:
+        if dimensions.is_stale():
+            await asyncio.to_thread(dimensions.refresh, pool)
+        batches = {RATING_TABLE: [], SUPPORT_TABLE: []}
+        events = []
+        for msg in messages:
+            if msg.error():
+                logging.error("ERROR: %s", msg.error())
+                summary.add('error')
+                continue
+            event, reason = validate_timed(msg.value())
+            instance = None
+            if event is not None:
+                instance, reason = format_instance_row(event, dimensions,
+                                                       get_message_source_id(msg))
+            if instance is None:
+                reject_message(msg, reason, dead_letters)
+                summary.add(reason)
+                continue
+            summary.add('accepted')
+            table, row = instance
+            batches[table].append(row)
+            events.append(event)
+        await write_queue.put((batches, get_offsets(messages), len(messages), events))
+        set_gauge('queue_depth', write_queue.qsize(), queue='write')
+    await write_queue.put(None)
+
+
+def merge_batches(pending: list[tuple]) -> tuple[dict, dict, int, list]:
+    """Merge validated batches waiting in the write queue into one upload"""
+    batches = {RATING_TABLE: [], SUPPORT_TABLE: []}
+    offsets = {}
+    consumed = 0
+    events = []
+    for item_batches, item_offsets, item_consumed, item_events in pending:
+        for table, rows in item_batches.items():
+            batches[table].extend(rows)
+        offsets.update(item_offsets)
+        consumed += item_consumed
+        events.extend(item_events)
+    return batches, offsets, consumed, events
+
+
+async def write_stage(pool: ConnectionPool, consumer: Consumer, write_queue: asyncio.Queue,
+                      batch_size: int, stop_event: Event, dead_letters=None,
+                      report=None, aggregator: 'RollingAggregator | None' = None) -> bool:
+    """
+    Upload validated rows in a worker thread, merging batches that queued up while
+    the previous upload ran, then commit their offsets once the upload is committed.
+    Events are only counted by the optional live aggregator once their rows are uploaded.
+    A failed upload sets stop_event and drains the queue without committing, so the
+    other stages can finish. Returns False if an upload failed.
+    """
+    uploaded = True
+    finished = False
+    while not finished:
+        pending = []
+        num_rows = 0
+        item = await write_queue.get()
+        while item is not None:
+            pending.append(item)
+            num_rows += sum(len(rows) for rows in item[0].values())
+            if num_rows >= batch_size or write_queue.empty():
+                break
+            item = write_queue.get_nowait()
+        finished = item is None
+        if not pending or not uploaded:
+            continue
+
+        batches, offsets, consumed, events = merge_batches(pending)
+        if any(batches.values()):
+            uploaded = await run_stage('upload', pool.run, upload_batches, batches)
+            if not uploaded:
+                logging.error('Stopping consumer, offsets not committed.')
+                stop_event.set()
+                continue
+        add_events(aggregator, events)
+        if dead_letters is not None:
+            dead_letters.flush()
+        if offsets:
+            await run_stage('offset_commit', consumer.commit, asynchronous=False,
+                            offsets=get_topic_partitions(offsets))
+        if report:
+            report(consumer, consumed)
+    return uploaded
+
+
+async def run_stages(pool: ConnectionPool, consumer: Consumer, batch_size: int,
+                     max_delay: float, stop_event: Event, queue_size: int,
+                     summary: MessageSummary, aggregator: 'RollingAggregator | None' = None,
+                     dead_letters=None, report=None,
+                     dimensions: DimensionCache | None = None) -> bool:
+    """Run the poll, validate and write stages until polling stops and the queues drain"""
+    raw_queue = asyncio.Queue(maxsize=queue_size)
+    write_queue = asyncio.Queue(maxsize=queue_size)
+    _, _, uploaded = await asyncio.gather(
+        poll_stage(consumer, raw_queue, batch_size, max_delay, stop_event),
+        validate_stage(pool, raw_queue, write_queue, summary, dimensions or DimensionCache(),
+                       dead_letters),
+        write_stage(pool, consumer, write_queue, batch_size, stop_event,
+                    dead_letters, report, aggregator))
+    return uploaded
+
+
+def stop_on_signals(stop_event: Event):
+    """Set stop_event on SIGINT or SIGTERM, so the stages drain before the loop ends"""
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signum, stop_event.set)
+        except (NotImplementedError, RuntimeError):
+            # not supported outside the main thread or on Windows
+            pass
+
+
+def consume_async(pool: ConnectionPool, consumer: Consumer, batch_size: int = 500,
+                  max_delay: float = 1.0, stop_event: Event | None = None,
+                  queue_size: int = QUEUE_SIZE, report=None,
+                  aggregator: 'RollingAggregator | None' = None, dead_letters=None,
+                  summary: MessageSummary | None = None,
+                  dimensions: DimensionCache | None = None) -> bool:
+    """
+    Intake messages from a Kafka cluster with overlapping poll, validate and write stages.
+    At most queue_size fetched and queue_size validated batches wait between stages,
+    and offsets are only committed after their rows are committed to the database.
+    Messages with kiosk codes unknown to the dimension cache are rejected before upload.
+    Consuming stops once stop_event is set, on SIGINT or SIGTERM, or after a failed upload.
+    Returns False if consuming stopped because of a failed upload.
+    """
+    stop_event = stop_event or Event()
+    summary = summary or MessageSummary()
+
+    async def run() -> bool:
+        stop_on_signals(stop_event)
+        return await run_stages(pool, consumer, batch_size, max_delay, stop_event,
+                                queue_size, summary, aggregator, dead_letters, report,
+                                dimensions)
+
+    try:
+        return asyncio.run(run())
+    finally:
+        summary.log()
+        consumer.close()
@@ -0,0 +1,268 @@
+"""
+Museum benchmarks
+Measure the throughput and peak memory of cleaning, csv loading and formatting,
+and the database insert paths on synthetic kiosk data, saving the results as JSON
+so runs from different releases can be compared
+"""
+
+import argparse
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import json
+import logging
+from os import environ
+import platform
+import subprocess
+import sys
+import tracemalloc
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from dotenv import load_dotenv
+
+from cleaning import VALID_SITES, clean_data, validate_message
+from dimensions import DimensionCache
+from generator import (RATING_WEIGHTS, SUPPORT_WEIGHTS, generate_csv_rows,
+                       generate_messages, write_csv_rows)
+
+BENCHMARK_FILE = "benchmark_results.json"
+NUM_ITEMS = 100000
+REPEATS = 3
+BENCHMARK_TABLES = ('rating_instance', 'support_instance',
+                    'rating_hourly_rollup', 'support_hourly_rollup')
+LOCAL_HOSTS = ('localhost', '127.0.0.1', '::1')
+
+
+def argparse_is_my_friend():
+    """Set up argparse to pass arguments automatically in command line"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_items", "-n", type=int, default=NUM_ITEMS,
+                        help="number of synthetic messages or rows per benchmark")
+    parser.add_argument("--repeats", "-r", type=int, default=REPEATS,
+                        help="number of timed runs per benchmark, the fastest is kept")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="seed of the synthetic data generator")
+    parser.add_argument("--output", "-o", default=BENCHMARK_FILE,
+                        help="JSON file the results are written to")
+    parser.add_argument("--compare", "-c",
+                        help="JSON results of an earlier run to compare against")
+    parser.add_argument("--database", "-db", default=False, action='store_true',
+                        help="also benchmark inserts into the database in .env, "
+                        "which must be on localhost as its instance tables are truncated")
+
+    args = vars(parser.parse_args())
+    return (args.get('num_items'), args.get('repeats'), args.get('seed'),
+            args.get('output'), args.get('compare'), args.get('database'))
+
+
+class SyntheticMessage:
+    """A stand-in for a Kafka message holding a raw kiosk payload"""
+
+    def __init__(self, raw: bytes):
+        self.raw = raw
+
+    def value(self) -> bytes:
+        """Get the raw payload"""
+        return self.raw
+
+
+@contextmanager
+def quiet_logs():
+    """Silence logging in the enclosed block, so rejections are not timed as log writes"""
+    logging.disable(logging.CRITICAL)
+    try:
+        yield
+    finally:
+        logging.disable(logging.NOTSET)
+
+
+def get_seeded_dimensions() -> DimensionCache:
+    """Build a dimension cache with the ids 'schema.sql' seeds, for benchmarks without a database"""
+    dimensions = DimensionCache(ttl=float('inf'))
+    dimensions.set_mappings({int(site): int(site) + 1 for site in VALID_SITES},
+                            {val: val + 1 for val in RATING_WEIGHTS},
+                            {type: type + 1 for type in SUPPORT_WEIGHTS})
+    return dimensions
+
+
+def run_benchmark(name: str, func, num_items: int, repeats: int = REPEATS,
+                  setup=None) -> dict:
+    """
+    Time func over num_items items, keeping the fastest of repeats runs,
+    then run it once more under tracemalloc to measure its peak memory
+    """
+    timings = []
+    with quiet_logs():
+        for _ in range(repeats):
+            if setup:
+                setup()
+            start = perf_counter()
+            func()
+            timings.append(perf_counter() - start)
+        if setup:
+            setup()
+        tracemalloc.start()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    seconds = min(timings)
+    result = {'name': name, 'items': num_items, 'seconds': round(seconds, 6),
+              'items_per_second': round(num_items / seconds, 1) if seconds else None,
+              'peak_memory_mb': round(peak / 2 ** 20, 3)}
+    logging.info('%s: %s items/s, %.3f MB peak.', name,
+                 result['items_per_second'], result['peak_memory_mb'])
+    return result
+
+
+def benchmark_cleaning(num_items: int, repeats: int, seed: int) -> list[dict]:
+    """Benchmark per-message cleaning and validation of Kafka kiosk messages"""
+    messages = [SyntheticMessage(raw) for raw in generate_messages(num_items, seed)]
+    raw_messages = [message.value() for message in messages]
+    return [
+        run_benchmark('clean_data', lambda: [clean_data(m) for m in messages],
+                      num_items, repeats),
+        run_benchmark('validate_message', lambda: [validate_message(r) for r in raw_messages],
+                      num_items, repeats)]
+
+
+def benchmark_csv(num_items: int, repeats: int, seed: int) -> list[dict]:
+    """Benchmark loading, validating and formatting historical kiosk csv rows"""
+    from load import format_instance, validate_kiosk_data  # pylint: disable=import-outside-toplevel
+    from pipeline import (  # pylint: disable=import-outside-toplevel
+        load_kiosk_data, stream_kiosk_data)
+
+    rows = generate_csv_rows(num_items, seed)
+    valid_rows = validate_kiosk_data(rows)
+    dimensions = get_seeded_dimensions()
+    with TemporaryDirectory() as folder:
+        write_csv_rows(f'{folder}/lmnh_merged_hist_data.csv', rows)
+        return [
+            run_benchmark('load_kiosk_data', lambda: load_kiosk_data(folder),
+                          num_items, repeats),
+            run_benchmark('stream_kiosk_data',
+                          lambda: sum(len(chunk) for chunk in stream_kiosk_data(folder)),
+                          num_items, repeats),
+            run_benchmark('validate_kiosk_data', lambda: validate_kiosk_data(rows),
+                          num_items, repeats),
+            run_benchmark('format_instance',
+                          lambda: [format_instance(row, dimensions) for row in valid_rows],
+                          num_items, repeats)]
+
+
+def benchmark_database(num_items: int, repeats: int, seed: int) -> list[dict]:
+    """
+    Benchmark the multi-row insert, COPY and prepared single-row insert paths
+    against the database in .env, truncating the instance and rollup tables before each run
+    """
+    from database import (  # pylint: disable=import-outside-toplevel
+        RATING_TABLE, ConnectionPool, commit, insert_instance, insert_instances)
+    from load import (  # pylint: disable=import-outside-toplevel
+        copy_instances, format_instance, validate_kiosk_data)
+
+    pool = ConnectionPool(size=1)
+    dimensions = DimensionCache()
+    dimensions.refresh(pool)
+    formatted = [format_instance(row, dimensions)
+                 for row in validate_kiosk_data(generate_csv_rows(num_items, seed))]
+    ratings = [instance[1] for instance in formatted
+               if instance is not None and instance[0] == RATING_TABLE]
+    conn = pool.acquire()
+
+    def truncate():
+        with conn.cursor() as curr:
+            curr.execute(f"TRUNCATE {', '.join(BENCHMARK_TABLES)};")
+        conn.commit()
+
+    def insert_rows():
+        insert_instances(conn, RATING_TABLE, ratings)
+        commit(conn)
+
+    def insert_rows_singly():
+        for row in ratings:
+            insert_instance(conn, RATING_TABLE, row)
+        commit(conn)
+
+    try:
+        return [
+            run_benchmark('insert_instances', insert_rows, len(ratings), repeats, truncate),
+            run_benchmark('copy_instances',
+                          lambda: copy_instances(conn, RATING_TABLE, ratings, None),
+                          len(ratings), repeats, truncate),
+            run_benchmark('insert_instance', insert_rows_singly, len(ratings), repeats,
+                          truncate)]
+    finally:
+        truncate()
+        pool.release(conn)
+        pool.close()
+
+
+def is_local_database() -> bool:
+    """Check the database in .env is on this machine, so truncating its tables is safe"""
+    load_dotenv()
+    return environ.get("DATABASE_IP", "").strip().lower() in LOCAL_HOSTS
+
+
+def get_git_commit() -> str | None:
+    """Get the commit the benchmarks ran on, if this is a git checkout"""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], check=True,
+                              capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(results: list[dict], file_path: str, num_items: int, seed: int) -> dict:
+    """Save benchmark results with the details needed to compare runs"""
+    report = {'created_at': datetime.now(timezone.utc).isoformat(),
+              'git_commit': get_git_commit(),
+              'python': platform.python_version(),
+              'platform': platform.platform(),
+              'num_items': num_items,
+              'seed': seed,
+              'results': results}
+    with open(file_path, 'w', encoding='utf-8') as file:
+        json.dump(report, file, indent=2)
+    logging.info('Benchmark results saved to %s.', file_path)
+    return report
+
+
+def compare_results(previous: dict, current: dict) -> dict[str, float]:
+    """Get the throughput of each benchmark relative to an earlier run"""
+    previous_rates = {result['name']: result['items_per_second']
+                      for result in previous['results']}
+    return {result['name']: round(result['items_per_second'] / previous_rates[result['name']], 3)
+            for result in current['results']
+            if previous_rates.get(result['name']) and result['items_per_second']}
+
+
+def main():
+    """Run the benchmarks using the associated functions"""
+
+    (num_items, repeats, seed, output,
+     compare, database) = argparse_is_my_friend()
+
+    if database and not is_local_database():
+        logging.error('Not benchmarking the database, DATABASE_IP must be one of %s '
+                      'as the benchmark truncates its instance and rollup tables.',
+                      ', '.join(LOCAL_HOSTS))
+        sys.exit(1)
+
+    results = benchmark_cleaning(num_items, repeats, seed)
+    results += benchmark_csv(num_items, repeats, seed)
+    if database:
+        results += benchmark_database(num_items, repeats, seed)
+
+    report = save_results(results, output, num_items, seed)
+
+    if compare:
+        with open(compare, 'r', encoding='utf-8') as file:
+            previous = json.load(file)
+        for name, ratio in compare_results(previous, report).items():
+            logging.info('%s: %.2fx the throughput of %s.', name, ratio,
+                         previous.get('git_commit') or compare)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    main()
@@ -0,0 +1,105 @@
+"""
+Museum kiosk parquet cache
+Write validated kiosk history to a typed Parquet dataset partitioned by date and site,
+and read it back with column projection and predicate pushdown
+"""
+
+from datetime import date
+import logging
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+from cleaning import BATCH_COLUMNS, validate_batch
+
+CACHE_DIR = "museum_files/kiosk_cache"
+CACHE_SCHEMA = pa.schema([("at", pa.timestamp("us", tz="UTC")),
+                          ("val", pa.int8()),
+                          ("type", pa.int8()),
+                          ("source_id", pa.string()),
+                          ("date", pa.date32()),
+                          ("site", pa.int8())])
+CACHE_PARTITIONING = ds.partitioning(
+    pa.schema([("date", pa.date32()), ("site", pa.int8())]), flavor="hive")
+
+
+def rows_to_batch(rows: list[list]) -> pa.RecordBatch:
+    """
+    Validate a chunk of kiosk csv rows and convert the valid rows to typed columns,
+    keeping the source_id that rows read from csv files end with.
+    """
+
+    num_columns = len(BATCH_COLUMNS)
+    frame = pd.DataFrame([row[:num_columns] for row in rows], columns=list(BATCH_COLUMNS))
+    frame["source_id"] = [row[num_columns] if len(row) > num_columns else None for row in rows]
+    accepted, _ = validate_batch(frame)
+    frame = frame[accepted]
+
+    at = pd.to_datetime(frame["at"], format="ISO8601", utc=True)
+    typed = pd.DataFrame({
+        "at": at,
+        "val": pd.to_numeric(frame["val"]).astype("int8"),
+        "type": pd.to_numeric(frame["type"].replace("", None)).astype("Int8"),
+        "source_id": frame["source_id"],
+        "date": at.dt.date,
+        "site": pd.to_numeric(frame["site"]).astype("int8")})
+    return pa.RecordBatch.from_pandas(typed, schema=CACHE_SCHEMA, preserve_index=False)
+
+
+def write_kiosk_cache(chunks, cache_dir: str = CACHE_DIR) -> None:
+    """
+    Write chunks of kiosk csv rows to the parquet cache, replacing
+    any cached partitions for the same dates and sites.
+    """
+
+    ds.write_dataset((rows_to_batch(chunk) for chunk in chunks), cache_dir,
+                     schema=CACHE_SCHEMA, format="parquet",
+                     partitioning=CACHE_PARTITIONING,
+                     existing_data_behavior="delete_matching")
+
+    logging.info('Kiosk data cached as parquet in %s.', cache_dir)
+
+
+def cache_filter(start_date: date | None = None, end_date: date | None = None,
+                 sites: list[int] | None = None):
+    """Build a predicate on the partition columns for reading the cache."""
+
+    predicate = None
+    conditions = []
+    if start_date:
+        conditions.append(ds.field("date") >= start_date)
+    if end_date:
+        conditions.append(ds.field("date") <= end_date)
+    if sites is not None:
+        conditions.append(ds.field("site").isin(sites))
+    for condition in conditions:
+        predicate = condition if predicate is None else predicate & condition
+    return predicate
+
+
+def read_kiosk_cache(cache_dir: str = CACHE_DIR, columns: list[str] | None = None,
+                     predicate=None) -> pa.Table:
+    """Read the parquet cache, loading only the given columns and matching rows."""
+
+    dataset = ds.dataset(cache_dir, format="parquet",
+                         partitioning=CACHE_PARTITIONING)
+    return dataset.to_table(columns=columns, filter=predicate)
+
+
+def stream_kiosk_cache(cache_dir: str = CACHE_DIR, predicate=None):
+    """
+    Yield cached kiosk data in chunks of rows shaped like the kiosk csv files and
+    ending with their source_id, which is None in caches written before it was kept.
+    """
+
+    # the schema is given so caches written without source_id read it as null
+    dataset = ds.dataset(cache_dir, format="parquet", schema=CACHE_SCHEMA,
+                         partitioning=CACHE_PARTITIONING)
+    for batch in dataset.to_batches(columns=list(BATCH_COLUMNS) + ["source_id"],
+                                    filter=predicate):
+        columns = batch.to_pydict()
+        yield [[at.isoformat(), str(site), str(val), "" if type is None else str(type), source_id]
+               for at, site, val, type, source_id in zip(
+                   columns["at"], columns["site"], columns["val"], columns["type"],
+                   columns["source_id"])]
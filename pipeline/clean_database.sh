@@ -1,4 +1,7 @@
 source db.env
-psql -h $DATABASE_IP -U $DATABASE_USERNAME -d $DATABASE_NAME -p $DATABASE_PORT -c "DELETE FROM rating_instance"
-psql -h $DATABASE_IP -U $DATABASE_USERNAME -d $DATABASE_NAME -p $DATABASE_PORT -c "DELETE FROM support_instance"
-echo 'Instance tables reset'
\ No newline at end of file
+psql -h $DATABASE_IP -U $DATABASE_USERNAME -d $DATABASE_NAME -p $DATABASE_PORT -v ON_ERROR_STOP=1 -1 \
+    -c "DELETE FROM rating_instance" \
+    -c "DELETE FROM support_instance" \
+    -c "DELETE FROM rating_hourly_rollup" \
+    -c "DELETE FROM support_hourly_rollup"
+echo 'Instance and rollup tables reset'
@@ -5,6 +5,10 @@ Script to take in raw data and filter for invalid messages
 import logging
 from datetime import datetime, time
 import json
+from typing import TYPE_CHECKING, NamedTuple
+
+if TYPE_CHECKING:
+    import numpy as np
 
 VALID_TYPES = [0, 1]
 VALID_VALS = [-1, 0, 1, 2, 3, 4]
@@ -13,84 +17,176 @@ VALID_AT_LEN = 32
 OPENING_HOUR = time(8, 45)
 CLOSING_HOUR = time(18, 15)
 
+VALID_TYPE_SET = frozenset(VALID_TYPES)
+VALID_VAL_SET = frozenset(VALID_VALS)
+VALID_SITE_SET = frozenset(VALID_SITES)
+VALID_SITE_CODES = [int(site) for site in VALID_SITES]
+AT_SEPARATORS = ((4, '-'), (7, '-'), (10, 'T'), (13, ':'), (16, ':'), (19, '.'))
+AT_SUFFIX = '+00:00'
+# fixed-layout times of day compare correctly as strings
+OPENING_AT = OPENING_HOUR.isoformat(timespec='microseconds')
+CLOSING_AT = CLOSING_HOUR.isoformat(timespec='microseconds')
+
+REJECTION_REASONS = ('invalid_json', 'missing_at', 'missing_val', 'missing_type',
+                     'missing_site', 'missing_val_value', 'missing_site_value',
+                     'invalid_val', 'invalid_site', 'invalid_type', 'invalid_at',
+                     'invalid_at_format', 'invalid_at_time')
+
+KIOSK_AT_FORMAT = '%Y-%m-%dT%H:%M:%S.%f+00:00'
+BATCH_COLUMNS = ('at', 'site', 'val', 'type')
+BATCH_REJECTION_REASONS = ('missing_at', 'missing_val', 'missing_type', 'missing_site',
+                           'invalid_val', 'invalid_site', 'invalid_type',
+                           'invalid_at_format', 'invalid_at_time')
+OPENING_SECOND = OPENING_HOUR.hour * 3600 + OPENING_HOUR.minute * 60
+CLOSING_SECOND = CLOSING_HOUR.hour * 3600 + CLOSING_HOUR.minute * 60
+
+
+class KioskEvent(NamedTuple):
+    """A validated kiosk message, typed and ready to be inserted"""
+    at: str
+    site: int
+    val: int
+    type: int | None
+
 
 def clean_data(message):
     """Cleans the Kiosk data from the museum"""
 
-    data = message.value().decode()
-    json_data = json.loads(message.value().decode())
-
-    miss_check = missing_values(data, json_data)
-    if miss_check:
-        inv_check = invalid_values(data, json_data)
-        if inv_check:
-            return True
-    return False
-
-
-def invalid_values(data, json_data):
-    """Check for invalid values in message"""
-
-    if json_data['val'] not in VALID_VALS:
-        logging.error(
-            f"Invalid 'val' key value: {data}. 'val' must be one of {VALID_VALS}")
-        return False
-
-    if json_data['site'] not in VALID_SITES:
-        logging.error(
-            f"Invalid 'site' key value: {data}. 'site' must be one of {VALID_SITES}")
-        return False
-
-    if 'type' in json_data and json_data['type'] not in VALID_TYPES:
-        logging.error(
-            f"Invalid 'type' key value: {data}. 'type' must be one of {VALID_TYPES}")
-        return False
-
-    if not json_data['at'] or len(json_data['at']) != VALID_AT_LEN:
-        logging.error(f"Invalid 'at' key value: {data}")
-        return False
-
-    try:
-        datetime.strptime(json_data['at'], '%Y-%m-%dT%H:%M:%S.%f+00:00')
-    except:
-        logging.error(f"Invalid 'at' date format: {data}")
-        return False
-
-    at_value = datetime.strptime(
-        json_data['at'], '%Y-%m-%dT%H:%M:%S.%f+00:00').time()
-    if not OPENING_HOUR <= at_value <= CLOSING_HOUR:
-        logging.error(
-            f"Invalid 'at' time value: {data}. Time can only be between 08:45 and 18:15")
+    event, reason = validate_message(message.value())
+    if event is None:
+        logging.error("Rejected kiosk message (%s): %s",
+                      reason, message.value())
         return False
-
     return True
 
 
-def missing_values(data, json_data):
-    """Check for missing values in message"""
-
-    if "at" not in json_data:
-        logging.error(f"Missing 'at' key: {data}")
+def is_member(value, valid_values: frozenset) -> bool:
+    """Check set membership, treating unhashable values as invalid"""
+    try:
+        return value in valid_values
+    except TypeError:
         return False
 
-    if "val" not in json_data:
-        logging.error(f"Missing 'val' key: {data}")
-        return False
 
-    if json_data['val'] == -1 and "type" not in json_data:
-        logging.error(f"Missing 'type' key for support instance: {data}")
+def valid_at(at: str) -> bool:
+    """Check a fixed-layout timestamp, e.g. 2023-06-01T10:15:00.123456+00:00"""
+    for index, separator in AT_SEPARATORS:
+        if at[index] != separator:
+            return False
+    if not at.endswith(AT_SUFFIX):
         return False
-
-    if "site" not in json_data:
-        logging.error(f"Missing 'site' key: {data}")
+    try:
+        datetime.fromisoformat(at)
+    except ValueError:
         return False
+    return True
 
-    if not json_data['val'] and json_data['val'] != 0:
-        logging.error(f"Missing 'val' key value: {data}")
-        return False
 
-    if not json_data['site'] and json_data['site'] != 0:
-        logging.error(f"Missing 'site' key value: {data}")
-        return False
+def parse_message(raw: bytes) -> tuple[dict | None, str | None]:
+    """Parse a raw kiosk message, returning either its JSON object or the reason it was rejected"""
+    try:
+        json_data = json.loads(raw)
+    except (ValueError, TypeError):
+        return None, 'invalid_json'
+    if not isinstance(json_data, dict):
+        return None, 'invalid_json'
+    return json_data, None
+
+
+def validate_message(raw: bytes) -> tuple[KioskEvent | None, str | None]:
+    """
+    Parse and validate a raw kiosk message in a single pass,
+    returning either the typed event or the reason it was rejected
+    """
+    json_data, reason = parse_message(raw)
+    if json_data is None:
+        return None, reason
+    return validate_data(json_data)
+
+
+def validate_data(json_data: dict) -> tuple[KioskEvent | None, str | None]:
+    """Validate a parsed kiosk message, returning either the typed event or the reason it was rejected"""
+    if 'at' not in json_data:
+        return None, 'missing_at'
+    if 'val' not in json_data:
+        return None, 'missing_val'
+    val = json_data['val']
+    has_type = 'type' in json_data
+    if val == -1 and not has_type:
+        return None, 'missing_type'
+    if 'site' not in json_data:
+        return None, 'missing_site'
+    site = json_data['site']
+    if not val and val != 0:
+        return None, 'missing_val_value'
+    if not site and site != 0:
+        return None, 'missing_site_value'
+
+    if not is_member(val, VALID_VAL_SET):
+        return None, 'invalid_val'
+    if not is_member(site, VALID_SITE_SET):
+        return None, 'invalid_site'
+    type = json_data['type'] if has_type else None
+    if has_type and not is_member(type, VALID_TYPE_SET):
+        return None, 'invalid_type'
+
+    at = json_data['at']
+    if not at or not isinstance(at, str) or len(at) != VALID_AT_LEN:
+        return None, 'invalid_at'
+    if not valid_at(at):
+        return None, 'invalid_at_format'
+    if not OPENING_AT <= at[11:26] <= CLOSING_AT:
+        return None, 'invalid_at_time'
+
+    return KioskEvent(at, int(site), int(val),
+                      None if type is None else int(type)), None
+
+
+def validate_batch(batch, at_format: str = 'ISO8601') -> tuple['np.ndarray', dict[str, int]]:
+    """
+    Validate a column-oriented batch of kiosk data (a DataFrame or a mapping of
+    at/site/val/type arrays) with the same rules as validate_message, returning
+    the accepted mask and the number of rows rejected by each rule.
+    Values are coerced as they arrive from csv files: empty strings count as
+    missing, val, type and site may be numbers or numeric strings (read_csv
+    gives a float column when a value is missing) and at is parsed with at_format.
+    """
+    # numpy and pandas are only loaded for batch validation, so the consumer starts fast
+    import numpy as np  # pylint: disable=import-outside-toplevel
+    import pandas as pd  # pylint: disable=import-outside-toplevel
+
+    frame = batch if isinstance(batch, pd.DataFrame) else pd.DataFrame(batch)
+    columns = {name: (frame[name] if name in frame
+                      else pd.Series(np.nan, index=frame.index))
+               for name in BATCH_COLUMNS}
+    missing = {name: column.isna().to_numpy() | (column == '').to_numpy()
+               for name, column in columns.items()}
+
+    val = pd.to_numeric(columns['val'], errors='coerce').to_numpy()
+    type = pd.to_numeric(columns['type'], errors='coerce').to_numpy()
+    site = pd.to_numeric(columns['site'], errors='coerce').to_numpy()
+    at = pd.to_datetime(columns['at'], format=at_format, errors='coerce', utc=True)
+    at_second = (at.dt.hour * 3600 + at.dt.minute * 60 + at.dt.second
+                 + at.dt.microsecond / 1e6).to_numpy()
+
+    rejections = {
+        'missing_at': missing['at'],
+        'missing_val': missing['val'],
+        'missing_type': (val == -1) & missing['type'],
+        'missing_site': missing['site'],
+        'invalid_val': ~np.isin(val, VALID_VALS),
+        'invalid_site': ~np.isin(site, VALID_SITE_CODES),
+        'invalid_type': ~missing['type'] & ~np.isin(type, VALID_TYPES),
+        'invalid_at_format': at.isna().to_numpy(),
+        'invalid_at_time': ~((OPENING_SECOND <= at_second)
+                             & (at_second <= CLOSING_SECOND)),
+    }
+
+    accepted = np.ones(len(frame), dtype=bool)
+    counts = {}
+    for reason in BATCH_REJECTION_REASONS:
+        rejected = accepted & rejections[reason]
+        counts[reason] = int(rejected.sum())
+        accepted &= ~rejected
+    return accepted, counts
 
-    return True
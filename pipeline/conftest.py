@@ -0,0 +1,38 @@
+"""Shared fixtures of the pipeline tests"""
+
+import json
+from unittest.mock import MagicMock
+
+import pytest
+
+from dimensions import DimensionCache
+
+
+@pytest.fixture
+def seeded_dimensions() -> DimensionCache:
+    """A dimension cache holding the seeded ids of each kiosk code"""
+    dimensions = DimensionCache()
+    dimensions.set_mappings({site: site + 1 for site in range(6)},
+                            {val: val + 1 for val in range(5)},
+                            {type: type + 1 for type in range(2)})
+    return dimensions
+
+
+@pytest.fixture
+def rating() -> dict:
+    """A valid rating message payload"""
+    return {"at": "2023-06-01T10:15:00.123456+00:00", "site": "2", "val": 3}
+
+
+@pytest.fixture
+def make_message(rating):
+    """Build mock Kafka messages holding a payload, the rating by default, at a position"""
+    def make(data: dict | None = None, offset: int = 0, partition: int = 0) -> MagicMock:
+        msg = MagicMock()
+        msg.error.return_value = None
+        msg.value.return_value = json.dumps(rating if data is None else data).encode()
+        msg.topic.return_value = "lmnh"
+        msg.partition.return_value = partition
+        msg.offset.return_value = offset
+        return msg
+    return make
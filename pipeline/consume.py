@@ -2,47 +2,208 @@
 Museum data consume script
 Collect and clean data from a Kafka cluster associated with the museum
 """
+from collections import Counter
 from os import environ as ENV
+import argparse
 import logging
-from psycopg2.extras import RealDictCursor
-from psycopg2 import connect, OperationalError
-from confluent_kafka import Consumer
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+from threading import Event
+from time import monotonic, perf_counter
+from typing import TYPE_CHECKING
+from psycopg2 import Error
+from confluent_kafka import Consumer, TopicPartition
 from dotenv import load_dotenv
-import json
-from cleaning import clean_data
-
-logging.basicConfig(filename='consume_logs.txt', encoding='utf-8', level=logging.INFO,
-                    format='%(asctime)s -- %(name)s -- %(levelname)s -- %(message)s',
-                    filemode='w',)
-
-logging.getLogger().setLevel(logging.INFO)
+from cleaning import KioskEvent, parse_message, validate_data
+from dead_letter import (DEAD_LETTER_FILE,
+                         DEAD_LETTER_SINKS,
+                         from_message,
+                         get_dead_letter_sink)
+# get_cursor and get_db_connection stay importable from this module
+from database import (CONNECTION_ERRORS,
+                      RATING_TABLE,
+                      SUPPORT_TABLE,
+                      ConnectionPool,
+                      commit,
+                      get_cursor,
+                      get_db_connection,
+                      insert_instance,
+                      insert_instances,
+                      rollback)
+from dimensions import DimensionCache
+from endpoints import start_endpoint_server
+from metrics import (inc,
+                     metrics_route,
+                     record_rows,
+                     set_gauge,
+                     start_metrics_dump,
+                     timed)
+from profiling import SNAPSHOT_INTERVAL, start_profiler
+from sources import REPLAY_FORMATS, FileSource
+
+if TYPE_CHECKING:
+    from aggregation import RollingAggregator
+
+LOG_FILE = 'consume_logs.txt'
+LOG_FORMAT = '%(asctime)s -- %(name)s -- %(levelname)s -- %(message)s'
+LOG_LEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR')
+SUMMARY_EVERY = 10000
+SUMMARY_INTERVAL = 10.0
+LAG_INTERVAL = 10
+QUEUE_SIZE = 4
 
 VALID_TYPES = [0, 1]
 
 
-def get_db_connection():
+def argparse_is_my_friend():
+    """Set up argparse to pass arguments automatically in command line"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch_size", "-bs", type=int,
+                        help="number of messages buffered before a batched upload")
+    parser.add_argument("--max_delay", "-md", type=float, default=1.0,
+                        help="maximum seconds a buffered message waits before upload")
+    parser.add_argument("--snapshot_port", "-sp", type=int,
+                        help="local port serving live per-exhibition metrics at /snapshot")
+    parser.add_argument("--dead_letter", "-dl", choices=DEAD_LETTER_SINKS, default='file',
+                        help="send rejected messages to a local file or the DEAD_LETTER_TOPIC topic")
+    parser.add_argument("--dead_letter_path", "-dlp", default=DEAD_LETTER_FILE,
+                        help="file rejected messages are appended to with the file sink")
+    parser.add_argument("--log_level", "-ll", choices=LOG_LEVELS, default='INFO',
+                        help="lowest level logged, DEBUG adds a line per message")
+    parser.add_argument("--summary_every", "-se", type=int, default=SUMMARY_EVERY,
+                        help="number of messages between summary log lines")
+    parser.add_argument("--summary_interval", "-si", type=float, default=SUMMARY_INTERVAL,
+                        help="maximum seconds between summary log lines")
+    parser.add_argument("--metrics_port", "-mp", type=int,
+                        help="local port serving Prometheus metrics at /metrics")
+    parser.add_argument("--metrics_file", "-mf",
+                        help="file the Prometheus metrics are periodically dumped to")
+    parser.add_argument("--async_mode", "-am", default=False, action='store_true',
+                        help="overlap polling, validation and database writes as asyncio stages")
+    parser.add_argument("--queue_size", "-qs", type=int, default=QUEUE_SIZE,
+                        help="number of batches waiting between asyncio stages before polling pauses")
+    parser.add_argument("--replay", "-r",
+                        help="replay recorded kiosk messages from this file instead of Kafka")
+    parser.add_argument("--replay_format", "-rf", choices=REPLAY_FORMATS, default='ndjson',
+                        help="recorded file of JSON lines or length-prefixed messages")
+    parser.add_argument("--replay_speed", "-rs", type=float,
+                        help="replay at the pace events happened (1) or N times faster, "
+                        "default is as fast as possible")
+    parser.add_argument("--replay_mmap", "-rm", default=False, action='store_true',
+                        help="memory-map the recorded file instead of reading it")
+    parser.add_argument("--profile", "-p",
+                        help="directory sampled stacks and tracemalloc snapshots of each stage are written to")
+    parser.add_argument("--profile_interval", "-pi", type=float, default=SNAPSHOT_INTERVAL,
+                        help="seconds between periodic profile dumps while consuming")
+
+    args = vars(parser.parse_args())
+    return (args.get('batch_size'), args.get('max_delay'), args.get('snapshot_port'),
+            args.get('dead_letter'), args.get('dead_letter_path'), args.get('log_level'),
+            args.get('summary_every'), args.get('summary_interval'),
+            args.get('metrics_port'), args.get('metrics_file'),
+            args.get('async_mode'), args.get('queue_size'), args.get('replay'),
+            args.get('replay_format'), args.get('replay_speed'), args.get('replay_mmap'),
+            args.get('profile'), args.get('profile_interval'))
+
+
+def log_to_queue(level: str | int = 'INFO', file_name: str = LOG_FILE) -> QueueListener:
     """
-    Gets a connection to the specified database
+    Send logs through a queue to a background thread that appends them to a file,
+    so log writes never block polling. Stop the returned listener to flush the queue.
+    """
+    file_handler = logging.FileHandler(file_name, mode='a', encoding='utf-8')
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    log_queue = SimpleQueue()
+    root = logging.getLogger()
+    root.handlers = [QueueHandler(log_queue)]
+    root.setLevel(level)
+    listener = QueueListener(log_queue, file_handler)
+    listener.start()
+    return listener
+
+
+class MessageSummary:
+    """
+    Count consumed messages by outcome in the kiosk_messages_total metric and log
+    them as one summary line every `every` messages or `interval` seconds,
+    instead of a line per message
     """
-    load_dotenv()
-    try:
-        conn = connect(
-            user=ENV["DATABASE_USERNAME"],
-            password=ENV["DATABASE_PASSWORD"],
-            host=ENV["DATABASE_IP"],
-            port=ENV["DATABASE_PORT"],
-            database=ENV["DATABASE_NAME"],
-            cursor_factory=RealDictCursor)
-        logging.info('Connected to database successfully')
-        return conn
-    except OperationalError as err:
-        logging.error('Connection attempt to database unsuccessful. %s', err)
-        return None
 
+    def __init__(self, every: int = SUMMARY_EVERY, interval: float = SUMMARY_INTERVAL,
+                 clock=monotonic):
+        self.every = every
+        self.interval = interval
+        self.clock = clock
+        self.counts = Counter()
+        self.pending = 0
+        self.since = clock()
+
+    def add(self, outcome: str, num_messages: int = 1):
+        """Count messages with an outcome, logging a summary when one is due"""
+        inc('kiosk_messages_total', num_messages, outcome=outcome)
+        self.counts[outcome] += num_messages
+        self.pending += num_messages
+        if self.pending >= self.every or self.clock() - self.since >= self.interval:
+            self.log()
+
+    def log(self):
+        """Log the counts since the last summary and start counting again"""
+        if self.pending:
+            elapsed = self.clock() - self.since
+            logging.info('Consumed %s messages in %.1fs (%.0f msg/s): %s',
+                         self.pending, elapsed, self.pending / elapsed if elapsed else 0,
+                         dict(self.counts))
+        self.counts.clear()
+        self.pending = 0
+        self.since = self.clock()
+
+
+def get_partition_lag(consumer, cached: bool = True) -> dict[tuple[str, int], int]:
+    """
+    Get the number of unread messages in each of a consumer's assigned partitions,
+    from the watermarks cached by its fetches unless cached is False
+    """
+    lag = {}
+    for partition in consumer.position(consumer.assignment()):
+        low, high = consumer.get_watermark_offsets(partition, timeout=1, cached=cached)
+        offset = partition.offset if partition.offset >= 0 else low
+        lag[(partition.topic, partition.partition)] = max(0, high - offset)
+    return lag
+
+
+def record_consumer_lag(consumer):
+    """Set the consumer_lag metric of each assigned partition"""
+    for (topic, partition), lag in get_partition_lag(consumer).items():
+        set_gauge('consumer_lag', lag, topic=topic, partition=partition)
+
+
+def validate_timed(raw: bytes) -> tuple[KioskEvent | None, str | None]:
+    """Parse and validate a raw message, timing JSON parsing and validation as separate stages"""
+    with timed('parse'):
+        json_data, reason = parse_message(raw)
+    if json_data is None:
+        return None, reason
+    with timed('validate'):
+        return validate_data(json_data)
+
+
+def get_consumer(topic: str | None = None, group: str | None = None) -> Consumer:
+    """Create a Kafka consumer subscribed to the museum topic, or another topic and group"""
+    load_dotenv()
+    kafka_config = {
+        'bootstrap.servers': ENV["BOOTSTRAP_SERVERS"],
+        'security.protocol': ENV["SECURITY_PROTOCOL"],
+        'sasl.mechanisms': ENV["SASL_MECHANISM"],
+        'sasl.username': ENV["USERNAME"],
+        'sasl.password': ENV["PASSWORD"],
+        'group.id': group or ENV["GROUP"],
+        'auto.offset.reset': 'earliest',
+        'enable.auto.commit': False
+    }
 
-def get_cursor(conn) -> list[dict[str, str]]:
-    """Gets a cursor to browse database"""
-    return conn.cursor(cursor_factory=RealDictCursor)
+    consumer = Consumer(kafka_config)
+    consumer.subscribe([topic or ENV["TOPIC"]])
+    return consumer
 
 
 def format_support_instance(loaded_data):
@@ -55,26 +216,22 @@ def format_support_instance(loaded_data):
     return at, site, type
 
 
-def upload_support_instance(conn, loaded_data):
+def upload_support_instance(conn, loaded_data, dimensions: DimensionCache):
     """Upload support instance cleaned data to an AWS RDS"""
 
     at, site, type = format_support_instance(loaded_data)
 
-    sql_query = """
-    INSERT INTO support_instance
-        (instance_created_at, exhibition_id, support_type_id)
-    VALUES
-    (%s, %s, %s);
-    """
-
     try:
-        curr = get_cursor(conn)
-        curr.execute(sql_query, (at, (int(site) + 1), (int(type) + 1)))
-        conn.commit()
-        logging.info('Uploaded support instance to the database.')
+        insert_instance(conn, SUPPORT_TABLE, (at, dimensions.get_exhibition_id(int(site)),
+                                              dimensions.get_support_type_id(int(type)),
+                                              loaded_data.get("source_id")))
+        commit(conn)
+        logging.debug('Uploaded support instance to the database.')
+        return True
     except AttributeError:
         logging.error(
             'Cursor was not created successfully, database not updated.')
+        return False
 
 
 def format_rating_instance(loaded_data):
@@ -87,83 +244,387 @@ def format_rating_instance(loaded_data):
     return at, site, val
 
 
-def upload_rating_instance(conn, loaded_data):
+def upload_rating_instance(conn, loaded_data, dimensions: DimensionCache):
     """Upload rating instance cleaned data to an AWS RDS"""
 
     at, site, val = format_rating_instance(loaded_data)
 
-    sql_query = """
-    INSERT INTO rating_instance
-        (rating_created_at, exhibition_id, rating_type_id)
-    VALUES
-    (%s, %s, %s);
-    """
-
     try:
-        curr = get_cursor(conn)
-        curr.execute(sql_query, (at, int(site) + 1, int(val) + 1))
-        conn.commit()
-        logging.info('Uploaded rating instance to the database.')
+        insert_instance(conn, RATING_TABLE, (at, dimensions.get_exhibition_id(int(site)),
+                                             dimensions.get_rating_type_id(int(val)),
+                                             loaded_data.get("source_id")))
+        commit(conn)
+        logging.debug('Uploaded rating instance to the database.')
+        return True
     except AttributeError:
         logging.error(
             'Cursor was not created successfully, database not updated.')
+        return False
 
 
-def select_data_upload(conn, loaded_data):
+def select_data_upload(conn, loaded_data, dimensions: DimensionCache):
     """Select upload function to upload message to AWS RDS"""
     type = loaded_data.get('type', None)
     if type in VALID_TYPES:
-        upload_support_instance(conn, loaded_data)
+        return upload_support_instance(conn, loaded_data, dimensions)
+    return upload_rating_instance(conn, loaded_data, dimensions)
+
+
+def get_source_id(topic: str | None, partition: int | None, offset: int | None) -> str | None:
+    """Identify a message by its topic, partition and offset, or None if its position is unknown"""
+    if topic is None or partition is None or offset is None or offset < 0:
+        return None
+    return f'{topic}:{partition}:{offset}'
+
+
+def get_message_source_id(msg) -> str | None:
+    """Identify a Kafka message by where it was read from, so a re-read is not inserted twice"""
+    return get_source_id(msg.topic(), msg.partition(), msg.offset())
+
+
+def format_instance_row(event: KioskEvent, dimensions: DimensionCache,
+                        source_id: str | None = None
+                        ) -> tuple[tuple[str, tuple] | None, str | None]:
+    """
+    Obtain the target table and sql-friendly row for a validated event, resolving its
+    codes through the dimension cache, or the reason it was rejected if one is unknown.
+    The row ends with the source_id of the message it came from.
+    """
+    exhibition_id = dimensions.get_exhibition_id(event.site)
+    if exhibition_id is None:
+        return None, 'unknown_site'
+    if event.type is not None:
+        type_id = dimensions.get_support_type_id(event.type)
+        if type_id is None:
+            return None, 'unknown_type'
+        return (SUPPORT_TABLE, (event.at, exhibition_id, type_id, source_id)), None
+    type_id = dimensions.get_rating_type_id(event.val)
+    if type_id is None:
+        return None, 'unknown_val'
+    return (RATING_TABLE, (event.at, exhibition_id, type_id, source_id)), None
+
+
+def record_offset(offsets: dict[tuple[str, int], int], msg):
+    """Record the offset to commit for a handled message's partition, one past the message"""
+    if msg.offset() is not None and msg.offset() >= 0:
+        offsets[(msg.topic(), msg.partition())] = msg.offset() + 1
+
+
+def get_offsets(messages: list) -> dict[tuple[str, int], int]:
+    """Get the offset to commit for each partition, one past its last message"""
+    offsets = {}
+    for msg in messages:
+        record_offset(offsets, msg)
+    return offsets
+
+
+def get_topic_partitions(offsets: dict[tuple[str, int], int]) -> list[TopicPartition]:
+    """Get the topic partitions to commit for offsets by topic and partition"""
+    return [TopicPartition(topic, partition, offset)
+            for (topic, partition), offset in offsets.items()]
+
+
+def commit_offsets(consumer: Consumer, offsets: dict[tuple[str, int], int],
+                   dead_letters=None, asynchronous: bool = False):
+    """Flush the dead letter sink and commit the recorded offsets, if there are any"""
+    if not offsets:
+        return
+    if dead_letters is not None:
+        dead_letters.flush()
+    with timed('offset_commit'):
+        consumer.commit(offsets=get_topic_partitions(offsets), asynchronous=asynchronous)
+    offsets.clear()
+
+
+def reject_message(msg, reason: str, dead_letters=None):
+    """Route a rejected message to the dead letter sink, or log it at DEBUG level when there is none"""
+    if dead_letters is None:
+        logging.debug("Rejected kiosk message (%s): %s", reason, msg.value())
     else:
-        upload_rating_instance(conn, loaded_data)
+        dead_letters.write(from_message(msg, reason))
 
 
-def consume_messages(conn, consumer: Consumer):
-    """Intake messages from a Kafka cluster"""
+def upload_batches(conn, batches: dict[str, list[tuple]]) -> bool:
+    """
+    Upload buffered instance rows to an AWS RDS with a single
+    multi-row insert per table and one commit.
+    """
+    try:
+        insert_seconds = {}
+        for table, rows in batches.items():
+            if rows:
+                start = perf_counter()
+                insert_instances(conn, table, rows)
+                insert_seconds[table] = perf_counter() - start
+        with timed('db_commit'):
+            commit(conn)
+        for table, seconds in insert_seconds.items():
+            record_rows(table, len(batches[table]), seconds)
+        logging.debug('Uploaded %s rating and %s support instances to the database.',
+                     len(batches[RATING_TABLE]), len(batches[SUPPORT_TABLE]))
+        return True
+    except CONNECTION_ERRORS:
+        # left to the connection pool to reconnect and retry
+        raise
+    except Error as err:
+        rollback(conn)
+        logging.error('Batch upload failed and was rolled back. %s', err)
+        return False
+
+
+def add_events(aggregator: 'RollingAggregator | None', events: list[KioskEvent]):
+    """Count uploaded events in the optional live aggregator and empty the list"""
+    if aggregator:
+        for event in events:
+            aggregator.add(event)
+    events.clear()
+
+
+def upload_buffered(pool: ConnectionPool, batches: dict[str, list[tuple]]) -> bool:
+    """Upload buffered instance rows through the connection pool and empty the buffers"""
+    try:
+        return pool.run(upload_batches, batches)
+    finally:
+        for rows in batches.values():
+            rows.clear()
+
+
+def consume_batches(pool: ConnectionPool, consumer: Consumer, batch_size: int = 500,
+                    max_delay: float = 1.0, stop_event=None, report=None,
+                    aggregator: 'RollingAggregator | None' = None,
+                    dead_letters=None, summary: MessageSummary | None = None,
+                    dimensions: DimensionCache | None = None,
+                    max_messages: int | None = None, close_consumer: bool = True) -> bool:
+    """
+    Intake messages from a Kafka cluster in micro-batches,
+    uploading once batch_size messages are buffered or max_delay seconds pass.
+    Offsets are only committed after the batch is committed to the database,
+    so a failed upload stops consuming and the batch is re-read on restart.
+    Consuming also stops once the optional stop_event is set, and the optional
+    report callback receives the consumer and the number of committed messages.
+    Valid messages are also counted by the optional live aggregator once uploaded, and rejected
+    messages are sent to the optional dead letter sink before their offsets are committed.
+    Outcomes are counted in summary log lines rather than logged per message.
+    Kiosk codes are resolved through the dimension cache, refreshed once its TTL passes,
+    and messages with unknown codes are rejected before they reach the database.
+    With max_messages, consuming stops once that many messages are committed, and
+    close_consumer=False leaves the consumer open for the next drain.
+    Returns False if consuming stopped because of a failed upload.
+    """
+    batches = {RATING_TABLE: [], SUPPORT_TABLE: []}
+    summary = summary or MessageSummary()
+    dimensions = dimensions or DimensionCache()
+    buffered = 0
+    consumed = 0
+    total = 0
+    offsets = {}
+    events = []
+    last_upload = monotonic()
+    last_lag_check = monotonic()
+    try:
+        while stop_event is None or not stop_event.is_set():
+            dimensions.refresh_if_stale(pool)
+            timeout = max(0.0, last_upload + max_delay - monotonic())
+            num_messages = batch_size - buffered
+            if max_messages is not None:
+                num_messages = min(num_messages, max_messages - total)
+            with timed('poll'):
+                messages = consumer.consume(num_messages, timeout)
+            for msg in messages:
+                consumed += 1
+                total += 1
+                if msg.error():
+                    logging.error("ERROR: %s", msg.error())
+                    summary.add('error')
+                else:
+                    event, reason = validate_timed(msg.value())
+                    instance = None
+                    if event is not None:
+                        instance, reason = format_instance_row(event, dimensions,
+                                                               get_message_source_id(msg))
+                    if instance is None:
+                        reject_message(msg, reason, dead_letters)
+                        summary.add(reason)
+                    else:
+                        summary.add('accepted')
+                        table, row = instance
+                        batches[table].append(row)
+                        buffered += 1
+                        events.append(event)
+                record_offset(offsets, msg)
+
+            drained = max_messages is not None and total >= max_messages
+            if drained or buffered >= batch_size or monotonic() - last_upload >= max_delay:
+                if buffered:
+                    buffered = 0
+                    with timed('upload'):
+                        uploaded = upload_buffered(pool, batches)
+                    if not uploaded:
+                        logging.error('Stopping consumer, offsets not committed.')
+                        return False
+                    add_events(aggregator, events)
+                if consumed:
+                    if dead_letters is not None:
+                        dead_letters.flush()
+                    with timed('offset_commit'):
+                        consumer.commit(asynchronous=False)
+                    if report:
+                        report(consumer, consumed)
+                    consumed = 0
+                    offsets.clear()
+                last_upload = monotonic()
+            if drained:
+                break
+
+            if monotonic() - last_lag_check >= LAG_INTERVAL:
+                record_consumer_lag(consumer)
+                last_lag_check = monotonic()
+
+    except KeyboardInterrupt as err:
+        logging.error('Consuming period cancelled %s', err)
+    finally:
+        # only the messages handled so far are committed, as the loop may
+        # have stopped partway through a consumed list
+        if buffered and upload_buffered(pool, batches):
+            add_events(aggregator, events)
+            if dead_letters is not None:
+                dead_letters.flush()
+            consumer.commit(offsets=get_topic_partitions(offsets), asynchronous=False)
+            if report:
+                report(consumer, consumed)
+        summary.log()
+        if close_consumer:
+            consumer.close()
+    return True
+
+
+def consume_messages(pool: ConnectionPool, consumer: Consumer,
+                     aggregator: 'RollingAggregator | None' = None, dead_letters=None,
+                     summary: MessageSummary | None = None, stop_event=None,
+                     dimensions: DimensionCache | None = None):
+    """
+    Intake messages from a Kafka cluster, counting uploaded ones in the optional
+    live aggregator and sending rejected ones to the optional dead letter sink.
+    Each message is only logged at DEBUG level, with outcomes counted in summary lines.
+    Consuming stops once the optional stop_event is set, and messages with kiosk
+    codes unknown to the dimension cache are rejected before they reach the database.
+    The offsets of rejected messages are committed with the next upload's, so the
+    dead letter sink is only flushed before a commit, not on every rejection.
+    """
+    summary = summary or MessageSummary()
+    dimensions = dimensions or DimensionCache()
+    log_messages = logging.getLogger().isEnabledFor(logging.DEBUG)
     msg_num = 0
+    offsets = {}
+    last_lag_check = monotonic()
     try:
-        while True:
-            msg = consumer.poll(1)
+        while stop_event is None or not stop_event.is_set():
+            if monotonic() - last_lag_check >= LAG_INTERVAL:
+                record_consumer_lag(consumer)
+                last_lag_check = monotonic()
+            dimensions.refresh_if_stale(pool)
+            with timed('poll'):
+                msg = consumer.poll(1)
             if msg is None:
                 continue
             if msg.error():
                 logging.error("ERROR: %s", msg.error())
-            if clean_data(msg) is True:
-                data = msg.value().decode()
-                loaded_data = json.loads(data)
-
-                select_data_upload(conn, loaded_data)
+                summary.add('error')
+                continue
+            event, reason = validate_timed(msg.value())
+            instance = None
+            if event is not None:
+                instance, reason = format_instance_row(event, dimensions,
+                                                       get_message_source_id(msg))
+            if instance is None:
+                reject_message(msg, reason, dead_letters)
+                summary.add(reason)
+                record_offset(offsets, msg)
+            else:
+                start = perf_counter()
+                with timed('upload'):
+                    uploaded = pool.run(select_data_upload,
+                                        {**event._asdict(),
+                                         'source_id': get_message_source_id(msg)},
+                                        dimensions)
+                if not uploaded:
+                    logging.error('Stopping consumer, offset not committed.')
+                    break
+                elapsed = perf_counter() - start
+                record_rows(SUPPORT_TABLE if event.type is not None else RATING_TABLE,
+                            1, elapsed)
                 msg_num += 1
-
-                logging.info(f'Message {msg_num} log: {data}')
+                if aggregator:
+                    aggregator.add(event)
+                summary.add('accepted')
+                if log_messages:
+                    logging.debug('Message %s log: %s', msg_num, event)
+                record_offset(offsets, msg)
+                commit_offsets(consumer, offsets, dead_letters, asynchronous=True)
 
     except KeyboardInterrupt as err:
         logging.error('Consuming period cancelled %s', err)
     finally:
+        commit_offsets(consumer, offsets, dead_letters)
+        summary.log()
         consumer.close()
 
 
 def main():
     """Run the consume pipeline using the associated functions"""
 
+    (batch_size, max_delay, snapshot_port, dead_letter, dead_letter_path, log_level,
+     summary_every, summary_interval, metrics_port, metrics_file,
+     async_mode, queue_size, replay, replay_format, replay_speed,
+     replay_mmap, profile, profile_interval) = argparse_is_my_friend()
+
     load_dotenv()
 
-    conn = get_db_connection()
+    listener = log_to_queue(log_level)
+    summary = MessageSummary(summary_every, summary_interval)
+    profiler = start_profiler(profile, profile_interval) if profile else None
 
-    kafka_config = {
-        'bootstrap.servers': ENV["BOOTSTRAP_SERVERS"],
-        'security.protocol': ENV["SECURITY_PROTOCOL"],
-        'sasl.mechanisms': ENV["SASL_MECHANISM"],
-        'sasl.username': ENV["USERNAME"],
-        'sasl.password': ENV["PASSWORD"],
-        'group.id': ENV["GROUP"],
-        'auto.offset.reset': 'earliest'
-    }
+    pool = ConnectionPool(size=1)
 
-    consumer = Consumer(kafka_config)
-    consumer.subscribe([ENV["TOPIC"]])
-
-    consume_messages(conn, consumer)
+    # a replayed file sets stop_event once it is exhausted
+    stop_event = Event()
+    if replay:
+        consumer = FileSource(replay, replay_format, replay_speed, replay_mmap, stop_event)
+    else:
+        consumer = get_consumer()
+    dead_letters = get_dead_letter_sink(dead_letter, dead_letter_path)
+
+    aggregator = None
+    routes = {}
+    if snapshot_port:
+        # numpy is only loaded when the live aggregator is served
+        from aggregation import RollingAggregator
+        aggregator = RollingAggregator()
+        routes.setdefault(snapshot_port, {})['/snapshot'] = aggregator.snapshot_route
+    if metrics_port:
+        routes.setdefault(metrics_port, {})['/metrics'] = metrics_route
+    for port, port_routes in routes.items():
+        start_endpoint_server(port_routes, port)
+    stop_metrics_dump = start_metrics_dump(metrics_file) if metrics_file else None
+
+    if async_mode:
+        # imported here as the asyncio stages are built from this module's functions
+        from async_consume import consume_async
+        consume_async(pool, consumer, batch_size or 500, max_delay, stop_event, queue_size,
+                      aggregator=aggregator, dead_letters=dead_letters, summary=summary)
+    elif batch_size:
+        consume_batches(pool, consumer, batch_size, max_delay, stop_event,
+                        aggregator=aggregator, dead_letters=dead_letters, summary=summary)
+    else:
+        consume_messages(pool, consumer, aggregator, dead_letters, summary, stop_event)
+
+    dead_letters.close()
+    pool.close()
+    if stop_metrics_dump:
+        stop_metrics_dump()
+    if profiler:
+        profiler.stop()
+    listener.stop()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,292 @@
+"""
+Museum database layer
+Shared connections, a retrying connection pool and insert statements
+for the S3 pipeline and the Kafka consume script
+"""
+
+from contextlib import contextmanager
+from os import environ
+import logging
+from threading import BoundedSemaphore, Lock
+from time import perf_counter, sleep
+from weakref import WeakKeyDictionary
+
+from dotenv import load_dotenv
+
+from psycopg2 import connect, InterfaceError, OperationalError
+from psycopg2.extras import execute_values, RealDictCursor
+
+from metrics import observe
+
+POOL_SIZE = 4
+INSERT_PAGE_SIZE = 10000
+MAX_RETRIES = 5
+RETRY_DELAY = 0.5
+MAX_RETRY_DELAY = 30.0
+CONNECTION_ERRORS = (InterfaceError, OperationalError)
+
+RATING_TABLE = 'rating_instance'
+SUPPORT_TABLE = 'support_instance'
+PARTITION_COLUMNS = {
+    RATING_TABLE: 'rating_created_at',
+    SUPPORT_TABLE: 'instance_created_at'
+}
+INSTANCE_COLUMNS = {
+    RATING_TABLE: ('rating_created_at', 'rating_type_id'),
+    SUPPORT_TABLE: ('instance_created_at', 'support_type_id')
+}
+ROLLUP_TABLES = {
+    RATING_TABLE: ('rating_hourly_rollup', 'rating_count'),
+    SUPPORT_TABLE: ('support_hourly_rollup', 'support_count')
+}
+
+
+def get_insert_query(table: str, values: str) -> str:
+    """
+    Build an insert of new rows into an instance table from a VALUES list or SELECT,
+    adding the rows actually inserted to the table's hourly rollup in the same statement.
+    Rows whose source_id was already loaded are skipped, while rows without one always insert.
+    """
+    created_at, type_id = INSTANCE_COLUMNS[table]
+    rollup, count = ROLLUP_TABLES[table]
+    return f"""
+    WITH inserted AS (
+        INSERT INTO {table}
+            ({created_at}, exhibition_id, {type_id}, source_id)
+        {values}
+        ON CONFLICT DO NOTHING
+        RETURNING {created_at}, exhibition_id, {type_id}
+    )
+    INSERT INTO {rollup}
+        (exhibition_id, hour_start, {type_id}, {count})
+    SELECT exhibition_id, date_trunc('hour', {created_at}) AS hour_start, {type_id}, COUNT(*)
+    FROM inserted
+    GROUP BY exhibition_id, hour_start, {type_id}
+    ORDER BY exhibition_id, hour_start, {type_id}
+    ON CONFLICT (exhibition_id, hour_start, {type_id})
+    DO UPDATE SET {count} = {rollup}.{count} + EXCLUDED.{count};
+    """
+
+
+INSERT_QUERIES = {table: get_insert_query(table, "VALUES\n        %s")
+                  for table in (RATING_TABLE, SUPPORT_TABLE)}
+PREPARED_STATEMENTS = {
+    table: f"PREPARE insert_{table} (TIMESTAMPTZ, SMALLINT, SMALLINT, TEXT) AS"
+           + get_insert_query(table, "VALUES ($1, $2, $3, $4)")
+    for table in (RATING_TABLE, SUPPORT_TABLE)}
+
+known_partitions = set()
+pending_partitions = WeakKeyDictionary()
+known_partitions_lock = Lock()
+
+
+def get_connection_config() -> dict[str, str]:
+    """Get the database connection settings from the environment"""
+    load_dotenv()
+    return {
+        'user': environ["DATABASE_USERNAME"],
+        'password': environ["DATABASE_PASSWORD"],
+        'host': environ["DATABASE_IP"],
+        'port': environ["DATABASE_PORT"],
+        'database': environ["DATABASE_NAME"]
+    }
+
+
+def get_retry_delay(attempt: int) -> float:
+    """Exponential backoff delay for a retry attempt"""
+    return min(RETRY_DELAY * 2 ** attempt, MAX_RETRY_DELAY)
+
+
+def get_db_connection(retries: int = MAX_RETRIES):
+    """
+    Gets a connection to the specified database,
+    retrying with backoff before giving up and returning None
+    """
+    for attempt in range(retries + 1):
+        try:
+            conn = connect(**get_connection_config(),
+                           cursor_factory=RealDictCursor)
+            prepare_inserts(conn)
+            logging.info('Connected to database successfully')
+            return conn
+        except OperationalError as err:
+            logging.error('Connection attempt to database unsuccessful. %s', err)
+            if attempt < retries:
+                sleep(get_retry_delay(attempt))
+    return None
+
+
+def get_cursor(conn) -> list[dict[str, str]]:
+    """Gets a cursor to browse database"""
+    return conn.cursor(cursor_factory=RealDictCursor)
+
+
+def prepare_inserts(conn):
+    """Prepare the single-row insert statements on a new connection"""
+    curr = get_cursor(conn)
+    for statement in PREPARED_STATEMENTS.values():
+        curr.execute(statement)
+    conn.commit()
+
+
+def record_query(name: str, seconds: float):
+    """Record the latency of a query under a name in the db_query_seconds histogram"""
+    observe('db_query_seconds', seconds, query=name)
+
+
+@contextmanager
+def timed_query(name: str):
+    """Time the enclosed query and record its latency"""
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        record_query(name, perf_counter() - start)
+
+
+def get_row_months(rows) -> set[str]:
+    """Get the 'YYYY-MM' months of instance rows from their ISO timestamps"""
+    return {row[0][:7] for row in rows}
+
+
+def ensure_partitions(conn, table: str, months: set[str]):
+    """
+    Create the monthly partitions of an instance table for the given 'YYYY-MM' months,
+    skipping months already committed by this process or created in the connection's
+    open transaction, without committing. Months are only remembered process-wide once
+    commit() commits them, so a rolled back partition is created again on the retry.
+    """
+    with known_partitions_lock:
+        pending = pending_partitions.get(conn, set())
+        missing = sorted(month for month in months
+                         if (table, month) not in known_partitions
+                         and (table, month) not in pending)
+    if not missing:
+        return
+    with timed_query(f'ensure_{table}_partitions'):
+        curr = get_cursor(conn)
+        for month in missing:
+            curr.execute("SELECT ensure_monthly_partition(%s, %s, %s);",
+                         (table, PARTITION_COLUMNS[table], f'{month}-01'))
+    with known_partitions_lock:
+        pending_partitions.setdefault(conn, set()).update((table, month) for month in missing)
+
+
+def commit(conn):
+    """Commit a connection's transaction, remembering the partitions it created"""
+    conn.commit()
+    with known_partitions_lock:
+        known_partitions.update(pending_partitions.pop(conn, ()))
+
+
+def rollback(conn):
+    """Roll back a connection's transaction, forgetting the partitions it created"""
+    with known_partitions_lock:
+        pending_partitions.pop(conn, None)
+    conn.rollback()
+
+
+def insert_instances(conn, table: str, rows: list[tuple]):
+    """Insert rows into an instance table with one multi-row insert, without committing"""
+    ensure_partitions(conn, table, get_row_months(rows))
+    with timed_query(f'insert_{table}'):
+        execute_values(get_cursor(conn), INSERT_QUERIES[table], rows,
+                       page_size=min(max(len(rows), 1), INSERT_PAGE_SIZE))
+
+
+def insert_instance(conn, table: str, row: tuple):
+    """Insert one row into an instance table with its prepared statement, without committing"""
+    ensure_partitions(conn, table, get_row_months([row]))
+    with timed_query(f'insert_{table}'):
+        get_cursor(conn).execute(f"EXECUTE insert_{table} (%s, %s, %s, %s);", row)
+
+
+class ConnectionPool:
+    """
+    A thread-safe pool of database connections with prepared insert statements.
+    Work is run through run(), which replaces broken connections and retries
+    with backoff, so throughput recovers by itself after a failover.
+    """
+
+    def __init__(self, size: int | None = None, retries: int = MAX_RETRIES):
+        self.size = size or int(environ.get("DATABASE_POOL_SIZE", POOL_SIZE))
+        self.retries = retries
+        self.idle = []
+        self.available = BoundedSemaphore(self.size)
+        self.lock = Lock()
+
+    def acquire(self):
+        """Check out an open connection, connecting if none are idle"""
+        self.available.acquire()
+        with self.lock:
+            conn = self.idle.pop() if self.idle else None
+        if conn is not None and not conn.closed:
+            return conn
+        try:
+            conn = connect(**get_connection_config(), cursor_factory=RealDictCursor)
+        except Exception:
+            self.available.release()
+            raise
+        try:
+            prepare_inserts(conn)
+        except Exception:
+            self.release(conn, broken=True)
+            raise
+        logging.info('Opened pooled database connection.')
+        return conn
+
+    def release(self, conn, broken: bool = False):
+        """Return a connection to the pool, closing it if it is broken"""
+        if broken or conn.closed:
+            with known_partitions_lock:
+                pending_partitions.pop(conn, None)
+            if not conn.closed:
+                conn.close()
+        else:
+            with self.lock:
+                self.idle.append(conn)
+        self.available.release()
+
+    @contextmanager
+    def connection(self):
+        """Check out a healthy, prepared connection for the enclosed block"""
+        conn = self.acquire()
+        try:
+            yield conn
+        except CONNECTION_ERRORS:
+            self.release(conn, broken=True)
+            raise
+        except Exception:
+            # a connection that cannot roll back is closed, so its slot is never lost
+            try:
+                rollback(conn)
+            except Exception as err:  # pylint: disable=broad-except
+                logging.warning('Rollback failed (%s), closing the connection.', err)
+                self.release(conn, broken=True)
+            else:
+                self.release(conn)
+            raise
+        self.release(conn)
+
+    def run(self, func, *args):
+        """
+        Run func(conn, *args) on a pooled connection, reconnecting with
+        backoff when the connection fails, and record its latency
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                with self.connection() as conn, timed_query(func.__name__):
+                    return func(conn, *args)
+            except CONNECTION_ERRORS as err:
+                if attempt == self.retries:
+                    raise
+                logging.warning('Database connection failed (%s), retrying.', err)
+                sleep(get_retry_delay(attempt))
+        return None
+
+    def close(self):
+        """Close every idle connection in the pool"""
+        with self.lock:
+            for conn in self.idle:
+                conn.close()
+            self.idle.clear()
@@ -0,0 +1,145 @@
+"""
+Museum dead letters
+Route rejected Kafka messages to an append-only file or a Kafka topic
+as compact records of reason code, position and raw bytes
+"""
+
+from base64 import b64decode, b64encode
+from datetime import datetime
+from os import environ as ENV, replace
+import json
+import logging
+from typing import NamedTuple
+
+from confluent_kafka import Producer
+from dotenv import load_dotenv
+
+DEAD_LETTER_FILE = "dead_letters.jsonl"
+DEAD_LETTER_SINKS = ('file', 'kafka')
+
+
+class DeadLetter(NamedTuple):
+    """A rejected message with the reason it was rejected and where it was read from"""
+    reason: str
+    topic: str | None
+    partition: int | None
+    offset: int | None
+    value: bytes
+
+
+def from_message(msg, reason: str) -> DeadLetter:
+    """Build a dead letter from a rejected Kafka message"""
+    return DeadLetter(reason, msg.topic(), msg.partition(), msg.offset(), msg.value() or b'')
+
+
+def encode_dead_letter(dead_letter: DeadLetter) -> str:
+    """Encode a dead letter as one compact JSON line, with its raw bytes in base64"""
+    return json.dumps({**dead_letter._asdict(),
+                       'value': b64encode(dead_letter.value).decode()},
+                      separators=(',', ':')) + '\n'
+
+
+def decode_dead_letter(line: str) -> DeadLetter:
+    """Decode a dead letter from a JSON line"""
+    record = json.loads(line)
+    return DeadLetter(**{**record, 'value': b64decode(record['value'])})
+
+
+class FileDeadLetterSink:
+    """Append dead letters to a local file, which is only rotated once it is replayed"""
+
+    def __init__(self, file_path: str = DEAD_LETTER_FILE):
+        self.file_path = file_path
+        self.file = open(file_path, 'a', encoding='utf-8')
+
+    def write(self, dead_letter: DeadLetter):
+        """Buffer a dead letter for appending"""
+        self.file.write(encode_dead_letter(dead_letter))
+
+    def flush(self):
+        """Write buffered dead letters to the file"""
+        self.file.flush()
+
+    def close(self):
+        """Flush and close the file"""
+        self.file.close()
+
+
+class KafkaDeadLetterSink:
+    """Produce dead letters to a Kafka topic, keyed by reason with the position in headers"""
+
+    def __init__(self, producer: Producer, topic: str):
+        self.producer = producer
+        self.topic = topic
+
+    def write(self, dead_letter: DeadLetter):
+        """Queue a dead letter for producing"""
+        position = (('topic', dead_letter.topic), ('partition', dead_letter.partition),
+                    ('offset', dead_letter.offset))
+        self.producer.produce(
+            self.topic, value=dead_letter.value, key=dead_letter.reason,
+            headers=[(key, str(value)) for key, value in position if value is not None])
+        self.producer.poll(0)
+
+    def flush(self):
+        """Wait until every queued dead letter is delivered"""
+        remaining = self.producer.flush()
+        if remaining:
+            raise RuntimeError(f'{remaining} dead letters were not delivered.')
+
+    def close(self):
+        """Deliver any queued dead letters"""
+        self.flush()
+
+
+def get_producer() -> Producer:
+    """Create a Kafka producer for the museum cluster"""
+    load_dotenv()
+    return Producer({
+        'bootstrap.servers': ENV["BOOTSTRAP_SERVERS"],
+        'security.protocol': ENV["SECURITY_PROTOCOL"],
+        'sasl.mechanisms': ENV["SASL_MECHANISM"],
+        'sasl.username': ENV["USERNAME"],
+        'sasl.password': ENV["PASSWORD"],
+        'enable.idempotence': True
+    })
+
+
+def get_dead_letter_sink(kind: str, file_path: str = DEAD_LETTER_FILE):
+    """Create a dead letter sink writing to a local file or the DEAD_LETTER_TOPIC topic"""
+    if kind == 'kafka':
+        return KafkaDeadLetterSink(get_producer(), ENV["DEAD_LETTER_TOPIC"])
+    logging.info('Writing dead letters to %s.', file_path)
+    return FileDeadLetterSink(file_path)
+
+
+def read_dead_letter_file(file_path: str = DEAD_LETTER_FILE):
+    """Yield the dead letters in a dead letter file"""
+    with open(file_path, 'r', encoding='utf-8') as file:
+        for line in file:
+            if line.strip():
+                yield decode_dead_letter(line)
+
+
+def rotate_dead_letter_file(file_path: str = DEAD_LETTER_FILE, now: datetime | None = None) -> str:
+    """Move a replayed dead letter file aside under a timestamped name, returning the new path"""
+    rotated = f'{file_path}.replayed-{(now or datetime.now()).strftime("%Y%m%dT%H%M%S")}'
+    replace(file_path, rotated)
+    logging.info('Rotated replayed dead letters to %s.', rotated)
+    return rotated
+
+
+def read_dead_letter_topic(consumer, timeout: float = 10.0):
+    """Yield the dead letters in a dead letter topic until no more arrive within timeout"""
+    while True:
+        msg = consumer.poll(timeout)
+        if msg is None:
+            return
+        if msg.error():
+            logging.error("ERROR: %s", msg.error())
+            continue
+        headers = {key: value.decode() for key, value in msg.headers() or []}
+        yield DeadLetter(msg.key().decode(), headers.get('topic'),
+                         int(headers['partition']) if 'partition' in headers else None,
+                         int(headers['offset']) if 'offset' in headers else None,
+                         msg.value() or b'')
@@ -0,0 +1,99 @@
+"""
+Museum dimension cache
+Map kiosk site codes, rating values and support values to the ids of the exhibition,
+rating_type and support_type tables, loaded once and refreshed after a TTL, so both
+pipelines resolve foreign keys in memory with list-indexed lookups
+"""
+
+import logging
+from time import monotonic
+
+DIMENSION_TTL = 300.0
+EXHIBITION_QUERY = """
+SELECT site_code AS code, exhibition_id AS id FROM exhibition WHERE site_code IS NOT NULL;
+"""
+RATING_TYPE_QUERY = "SELECT rating_type_value AS code, rating_type_id AS id FROM rating_type;"
+SUPPORT_TYPE_QUERY = "SELECT support_type_value AS code, support_type_id AS id FROM support_type;"
+
+
+def to_lookup(mapping: dict[int, int]) -> list[int | None]:
+    """Build a list indexed by code holding each id, with None for unused codes"""
+    lookup = [None] * (max(mapping, default=-1) + 1)
+    for code, id_value in mapping.items():
+        if code >= 0:
+            lookup[code] = id_value
+    return lookup
+
+
+def get_id(lookup: list[int | None], code: int) -> int | None:
+    """Get the id of a code from a lookup list, or None if the code is unknown"""
+    if 0 <= code < len(lookup):
+        return lookup[code]
+    return None
+
+
+def fetch_mapping(conn, query: str) -> dict[int, int]:
+    """Fetch a code to id mapping from a query of code and id columns"""
+    with conn.cursor() as curr:
+        curr.execute(query)
+        return {row['code']: row['id'] for row in curr.fetchall()}
+
+
+class DimensionCache:
+    """
+    Exhibition, rating type and support type ids by kiosk code, reloaded
+    from the database by refresh_if_stale once ttl seconds have passed
+    """
+
+    def __init__(self, ttl: float = DIMENSION_TTL, clock=monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self.exhibition_ids = []
+        self.rating_type_ids = []
+        self.support_type_ids = []
+        self.loaded_at = None
+
+    def set_mappings(self, exhibitions: dict[int, int], rating_types: dict[int, int],
+                     support_types: dict[int, int]):
+        """Replace the lookups, each a mapping of kiosk code to id"""
+        self.exhibition_ids = to_lookup(exhibitions)
+        self.rating_type_ids = to_lookup(rating_types)
+        self.support_type_ids = to_lookup(support_types)
+        self.loaded_at = self.clock()
+
+    def load(self, conn) -> bool:
+        """Load every mapping from the database"""
+        self.set_mappings(fetch_mapping(conn, EXHIBITION_QUERY),
+                          fetch_mapping(conn, RATING_TYPE_QUERY),
+                          fetch_mapping(conn, SUPPORT_TYPE_QUERY))
+        conn.commit()
+        logging.info('Loaded %s exhibitions, %s rating types and %s support types.',
+                     sum(i is not None for i in self.exhibition_ids),
+                     sum(i is not None for i in self.rating_type_ids),
+                     sum(i is not None for i in self.support_type_ids))
+        return True
+
+    def refresh(self, pool):
+        """Reload every mapping through the connection pool"""
+        pool.run(self.load)
+
+    def is_stale(self) -> bool:
+        """Check if the mappings were never loaded or are older than the TTL"""
+        return self.loaded_at is None or self.clock() - self.loaded_at >= self.ttl
+
+    def refresh_if_stale(self, pool):
+        """Reload the mappings if they are stale"""
+        if self.is_stale():
+            self.refresh(pool)
+
+    def get_exhibition_id(self, site: int) -> int | None:
+        """Get the exhibition id of a kiosk site code"""
+        return get_id(self.exhibition_ids, site)
+
+    def get_rating_type_id(self, val: int) -> int | None:
+        """Get the rating type id of a kiosk rating value"""
+        return get_id(self.rating_type_ids, val)
+
+    def get_support_type_id(self, type: int) -> int | None:
+        """Get the support type id of a kiosk support value"""
+        return get_id(self.support_type_ids, type)
@@ -0,0 +1,48 @@
+"""
+Museum local endpoints
+Serve live consumer state over a small local HTTP server running in a background thread
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+from threading import Thread
+
+ENDPOINT_HOST = "127.0.0.1"
+
+
+def make_handler(routes: dict):
+    """
+    Build a request handler answering GET requests for each route path
+    with the (content type, body) returned by the route's function
+    """
+
+    class EndpointHandler(BaseHTTPRequestHandler):
+        """Answer GET requests from the route functions"""
+
+        def do_GET(self):
+            route = routes.get(self.path.split("?")[0])
+            if route is None:
+                self.send_error(404)
+                return
+            content_type, body = route()
+            body = body.encode()
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logging.debug('Endpoint request: ' + format, *args)
+
+    return EndpointHandler
+
+
+def start_endpoint_server(routes: dict, port: int,
+                          host: str = ENDPOINT_HOST) -> ThreadingHTTPServer:
+    """Serve the routes on a local port from a daemon thread, returning the server"""
+    server = ThreadingHTTPServer((host, port), make_handler(routes))
+    Thread(target=server.serve_forever, name="endpoint-server", daemon=True).start()
+    logging.info('Serving %s on http://%s:%s.', ", ".join(routes), host,
+                 server.server_address[1])
+    return server
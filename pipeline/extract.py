@@ -3,19 +3,33 @@ Museum data extraction script
 Collect and clean data from an S3 bucket associated with the museum
 """
 
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from csv import reader
+from itertools import islice
 from os import (environ,
                 listdir,
+                path,
                 remove)
 import logging
+from time import perf_counter, sleep
 
 from dotenv import load_dotenv
 
-from boto3 import client
-import pandas as pd
+from botocore.exceptions import BotoCoreError, ClientError
 
+from cleaning import BATCH_COLUMNS
 
-def get_s3_client() -> client:
+CHUNK_SIZE = 10000
+MAX_WORKERS = 8
+MAX_RETRIES = 3
+RETRY_DELAY = 1.0
+
+
+def get_s3_client():
     """Create an s3 client to access s3 buckets."""
+    # boto3 is loaded on first use, as it is slow to import
+    from boto3 import client  # pylint: disable=import-outside-toplevel
+
     load_dotenv()
 
     s3 = client("s3",
@@ -36,52 +50,210 @@ def get_bucket_names(s3_client) -> list[str]:
     return [b["Name"] for b in buckets]
 
 
+def list_bucket_objects(s3_client, bucket_name: str, prefix: str = "") -> list[dict]:
+    """Return every object in a bucket, paging through the full listing."""
+
+    paginator = s3_client.get_paginator("list_objects_v2")
+
+    objects = [o for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix)
+               for o in page.get("Contents", [])]
+
+    logging.info('%s bucket objects listed.', len(objects))
+
+    return objects
+
+
 def get_bucket_objects(s3_client, bucket_name: str) -> list[str]:
     """Return a list of available objects in a bucket."""
 
-    response = s3_client.list_objects(Bucket=bucket_name)
-
-    objects = response['Contents']
+    objects = list_bucket_objects(s3_client, bucket_name)
 
     logging.info('Bucket objects retrieved.')
 
     return [o["Key"] for o in objects]
 
 
-def download_all_files(s3_client, bucket_name: str, folder_name: str = "data") -> None:
+def download_object(s3_client, bucket_name: str, key: str, file_path: str,
+                    retries: int = MAX_RETRIES) -> None:
+    """Download one object, retrying with exponential backoff."""
+
+    for attempt in range(retries + 1):
+        try:
+            s3_client.download_file(bucket_name, key, file_path)
+            return
+        except (BotoCoreError, ClientError) as err:
+            if attempt == retries:
+                raise
+            logging.warning('Download of %s failed (%s), retrying.', key, err)
+            sleep(RETRY_DELAY * 2 ** attempt)
+
+
+def download_objects(s3_client, bucket_name: str, objects: list[dict],
+                     folder_name: str = "data",
+                     max_workers: int = MAX_WORKERS) -> tuple[list[str], list[str]]:
+    """
+    Download objects concurrently to a named folder through a bounded thread pool,
+    logging progress and throughput, and return the keys that were downloaded
+    and the keys that failed once their retries were used up.
+    """
+
+    start = perf_counter()
+    downloaded = []
+    failed = []
+    downloaded_bytes = 0
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(download_object, s3_client, bucket_name,
+                               o["Key"], f"{folder_name}/{o['Key']}"): o
+                   for o in objects}
+        for future in as_completed(futures):
+            o = futures[future]
+            try:
+                future.result()
+            except (BotoCoreError, ClientError) as err:
+                logging.error('Download of %s failed. %s', o["Key"], err)
+                failed.append(o["Key"])
+                continue
+            downloaded.append(o["Key"])
+            downloaded_bytes += o.get("Size", 0)
+            elapsed = perf_counter() - start
+            logging.info('Downloaded %s/%s objects, %.1f MB at %.1f MB/s.',
+                         len(downloaded), len(objects), downloaded_bytes / 1e6,
+                         downloaded_bytes / 1e6 / elapsed if elapsed else 0)
+
+    return downloaded, failed
+
+
+def download_all_files(s3_client, bucket_name: str, folder_name: str = "data",
+                       max_workers: int = MAX_WORKERS) -> None:
     """Downloads all files from a bucket to a named folder"""
 
-    objects = get_bucket_objects(s3_client, "sigma-resources-museum")
+    objects = list_bucket_objects(s3_client, bucket_name)
 
-    for o in objects:
-        s3_client.download_file(bucket_name,
-                                o,
-                                f"{folder_name}/{o}")
+    download_objects(s3_client, bucket_name, objects, folder_name, max_workers)
 
     logging.info('All bucket objects downloaded.')
 
 
 def download_specific_files(s3_client, bucket_name: str,
-                            filter_by: str, folder_name: str = "data") -> None:
-    """Downloads specific files from a bucket to a named folder"""
-
-    objects = get_bucket_objects(s3_client, "sigma-resources-museum")
+                            filter_by: str, folder_name: str = "data",
+                            max_workers: int = MAX_WORKERS) -> tuple[list[str], list[str]]:
+    """
+    Downloads specific files from a bucket to a named folder,
+    returning the keys downloaded and the keys that failed
+    """
+
+    objects = list_bucket_objects(s3_client, bucket_name, filter_by)
     filtered_objects = [
-        relevant for relevant in objects if relevant.startswith(filter_by)]
+        relevant for relevant in objects
+        if relevant["Key"].endswith('.csv') or relevant["Key"].endswith('.json')]
 
     if filtered_objects:
-        for o in filtered_objects:
-            if o.endswith('.csv') or o.endswith('.json'):
-                s3_client.download_file(bucket_name,
-                                        o,
-                                        f"{folder_name}/{o}")
+        downloaded, failed = download_objects(s3_client, bucket_name, filtered_objects,
+                                              folder_name, max_workers)
         logging.info('Selected bucket objects downloaded.')
-    else:
-        logging.error("Museum data folder does not consist of relevant data")
+        return downloaded, failed
+
+    logging.error("Museum data folder does not consist of relevant data")
+    return [], []
+
+
+def position_lines(lines, position: int = 0):
+    """Pair raw csv lines with the byte offset each one starts at."""
+
+    for line in lines:
+        yield position, line
+        position += len(line)
+
+
+def read_source_rows(positioned_lines, name: str):
+    """
+    Parse raw csv lines paired with their byte offsets into kiosk rows, padded or cut
+    to the kiosk columns and ending with their source_id: the file or object name and
+    the offset of the row's line. The id is the same whether the object is downloaded,
+    streamed or read in byte ranges, so a reloaded row is not inserted twice.
+    """
+
+    row_start = None
+
+    def decode_lines():
+        nonlocal row_start
+        for position, line in positioned_lines:
+            if row_start is None:
+                row_start = position
+            yield line.decode("utf-8-sig")
+
+    num_columns = len(BATCH_COLUMNS)
+    for row in reader(decode_lines()):
+        source_id = f"{name}@{row_start}"
+        row_start = None
+        if row:
+            yield (row + [""] * num_columns)[:num_columns] + [source_id]
+
+
+def read_csv_files(file_paths: list[str]):
+    """Yield the source rows of each downloaded file in turn."""
+
+    for file_path in file_paths:
+        with open(file_path, "rb") as file:
+            yield read_source_rows(position_lines(file), path.basename(file_path))
+
+
+def read_s3_csv_objects(s3_client, bucket_name: str, keys: list[str]):
+    """Yield the source rows of each object body in turn, without downloading it."""
+
+    for key in keys:
+        body = s3_client.get_object(Bucket=bucket_name, Key=key)["Body"]
+        yield read_source_rows(position_lines(body.iter_lines(keepends=True)),
+                               path.basename(key))
+        body.close()
+
+
+def merge_csv_rows(csv_readers):
+    """
+    Yield the rows of several csv sources as one stream, skipping each header,
+    whose trailing source_id is left out when comparing them.
+    """
+
+    header = None
+    for csv_reader in csv_readers:
+        file_header = next(csv_reader, None)
+        if file_header is not None:
+            file_header = file_header[:-1]
+        if header is None:
+            header = file_header
+        elif file_header != header:
+            logging.warning('CSV header %s does not match %s.', file_header, header)
+        yield from csv_reader
+
+
+def chunk_rows(rows, chunk_size: int = CHUNK_SIZE):
+    """Yield a stream of rows in chunks of at most chunk_size rows."""
+
+    rows = iter(rows)
+    while chunk := list(islice(rows, chunk_size)):
+        yield chunk
+
+
+def stream_csv_files(file_paths: list[str], chunk_size: int = CHUNK_SIZE):
+    """Stream-merge downloaded csv files into chunks of rows."""
+
+    return chunk_rows(merge_csv_rows(read_csv_files(file_paths)), chunk_size)
+
+
+def stream_s3_csv_objects(s3_client, bucket_name: str, keys: list[str],
+                          chunk_size: int = CHUNK_SIZE):
+    """Stream-merge csv objects straight from S3 into chunks of rows."""
+
+    return chunk_rows(merge_csv_rows(
+        read_s3_csv_objects(s3_client, bucket_name, keys)), chunk_size)
 
 
 def merge_csv_to_file(filter_by: str, folder_path: str):
     """Merge multiple csvs downloaded into one combined csv"""
+    # pandas is only loaded when a merged file is explicitly requested
+    import pandas as pd  # pylint: disable=import-outside-toplevel
+
     csv_list = listdir(folder_path)
     filtered_csv_list = [
         relevant for relevant in csv_list if relevant.startswith(filter_by)]
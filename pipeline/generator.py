@@ -0,0 +1,95 @@
+"""
+Museum synthetic kiosk data
+Generate realistic kiosk events, as Kafka messages or historical csv rows,
+with configurable rates of invalid and missing fields for tests and benchmarks
+"""
+
+from csv import writer
+from datetime import date, datetime, timedelta, timezone
+import json
+from random import Random
+
+from cleaning import CLOSING_SECOND, OPENING_SECOND, VALID_SITES
+
+# share of kiosk presses per rating value; the rest are support requests
+RATING_WEIGHTS = {0: 0.06, 1: 0.12, 2: 0.22, 3: 0.30, 4: 0.20}
+SUPPORT_WEIGHTS = {0: 0.8, 1: 0.2}
+INVALID_RATE = 0.02
+MISSING_RATE = 0.01
+CSV_HEADER = ['at', 'site', 'val', 'type']
+MESSAGE_FIELDS = ('at', 'site', 'val', 'type')
+INVALID_VALUES = {'at': ['2023-06-01T07:15:00.000000+00:00', 'yesterday', ''],
+                  'site': ['9', '-1', 'A'],
+                  'val': [5, -2, '3'],
+                  'type': [2, None, 'emergency']}
+
+
+def pick_weighted(rng: Random, weights: dict) -> int:
+    """Pick a key with probability proportional to its weight"""
+    return rng.choices(list(weights), weights=list(weights.values()))[0]
+
+
+def generate_event(rng: Random, day: date) -> tuple[datetime, str, int, int | None]:
+    """Generate one valid kiosk press during a day's opening hours"""
+    second = rng.uniform(OPENING_SECOND, CLOSING_SECOND)
+    at = (datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+          + timedelta(seconds=second))
+    site = rng.choice(VALID_SITES)
+    if rng.random() < 1 - sum(RATING_WEIGHTS.values()):
+        return at, site, -1, pick_weighted(rng, SUPPORT_WEIGHTS)
+    return at, site, pick_weighted(rng, RATING_WEIGHTS), None
+
+
+def generate_messages(num_messages: int, seed: int = 0, day: date = date(2023, 6, 1),
+                      invalid_rate: float = INVALID_RATE,
+                      missing_rate: float = MISSING_RATE) -> list[bytes]:
+    """
+    Generate raw Kafka kiosk messages in time order, where about invalid_rate
+    of them have an invalid field and missing_rate of them a missing field
+    """
+    rng = Random(seed)
+    events = sorted((generate_event(rng, day) for _ in range(num_messages)),
+                    key=lambda event: event[0])
+    messages = []
+    for at, site, val, type in events:
+        data = {'at': at.isoformat(timespec='microseconds'), 'site': site, 'val': val}
+        if type is not None:
+            data['type'] = type
+        roll = rng.random()
+        if roll < invalid_rate:
+            field = rng.choice(MESSAGE_FIELDS)
+            data[field] = rng.choice(INVALID_VALUES[field])
+        elif roll < invalid_rate + missing_rate:
+            data.pop(rng.choice(list(data)))
+        messages.append(json.dumps(data).encode())
+    return messages
+
+
+def generate_csv_rows(num_rows: int, seed: int = 0, day: date = date(2022, 10, 30),
+                      invalid_rate: float = INVALID_RATE) -> list[list[str]]:
+    """
+    Generate historical kiosk csv rows in time order, where about invalid_rate
+    of them have a value or time outside the kiosk validation rules
+    """
+    rng = Random(seed)
+    events = sorted((generate_event(rng, day) for _ in range(num_rows)),
+                    key=lambda event: event[0])
+    rows = []
+    for at, site, val, type in events:
+        row = [at.strftime('%Y-%m-%d %H:%M:%S'), site, str(val),
+               '' if type is None else f'{type:.1f}']
+        if rng.random() < invalid_rate:
+            if rng.random() < 0.5:
+                row[2] = '7'
+            else:
+                row[0] = at.strftime('%Y-%m-%d 20:%M:%S')
+        rows.append(row)
+    return rows
+
+
+def write_csv_rows(file_path: str, rows: list[list[str]]) -> None:
+    """Write kiosk rows to a csv file shaped like the historical kiosk files"""
+    with open(file_path, 'w', encoding='utf-8', newline='') as file:
+        csv_writer = writer(file)
+        csv_writer.writerow(CSV_HEADER)
+        csv_writer.writerows(rows)
@@ -0,0 +1,140 @@
+"""
+Museum handler entry points
+Run the S3 pipeline or drain a bounded number of Kafka messages from a function handler.
+Pandas, boto3 and the pipeline modules are only imported by the handler that needs them,
+and the S3 client, database pool, Kafka consumer, dead letter sink and dimension cache
+are kept at module level, so warm invocations reuse them instead of reconnecting.
+"""
+
+from os import environ
+import logging
+from threading import Event, Timer
+from time import perf_counter
+
+from dotenv import load_dotenv
+
+from database import ConnectionPool
+from dimensions import DimensionCache
+
+DRAIN_MESSAGES = 1000
+DRAIN_SECONDS = 60.0
+DRAIN_MARGIN = 5.0
+
+load_dotenv()
+
+clients = {}
+
+
+def get_client(name: str | tuple, create):
+    """Get a client kept from an earlier invocation, creating it on first use"""
+    if name not in clients:
+        clients[name] = create()
+    return clients[name]
+
+
+def discard_client(name: str | tuple):
+    """Close and forget a kept client, so the next invocation creates a new one"""
+    client = clients.pop(name, None)
+    if client is not None:
+        client.close()
+
+
+def get_pool() -> ConnectionPool:
+    """Get the kept database pool, which replaces broken connections by itself"""
+    return get_client('pool', lambda: ConnectionPool(size=1))
+
+
+def get_dimensions() -> DimensionCache:
+    """Get the kept dimension cache, which reloads itself once its TTL passes"""
+    return get_client('dimensions', DimensionCache)
+
+
+def get_drain_seconds(event: dict, context=None) -> float:
+    """
+    Get how long a drain may run, at most the event's max_seconds and
+    leaving DRAIN_MARGIN seconds of the invocation's remaining time
+    """
+    seconds = float(event.get('max_seconds', DRAIN_SECONDS))
+    if context is not None and hasattr(context, 'get_remaining_time_in_millis'):
+        seconds = min(seconds, context.get_remaining_time_in_millis() / 1000 - DRAIN_MARGIN)
+    return max(0.0, seconds)
+
+
+def pipeline_handler(event: dict | None = None, context=None) -> dict:
+    """
+    Load kiosk objects from the museum bucket, by default only those new or
+    changed since the last run, returning the objects and rows loaded
+    """
+    # pandas and boto3 are only imported by invocations of this handler
+    from extract import get_s3_client, list_bucket_objects  # pylint: disable=import-outside-toplevel
+    from extract import stream_s3_csv_objects  # pylint: disable=import-outside-toplevel
+    from load import load_kiosk_stream  # pylint: disable=import-outside-toplevel
+    from pipeline import load_incremental  # pylint: disable=import-outside-toplevel
+
+    event = event or {}
+    start = perf_counter()
+    s3 = get_client('s3', get_s3_client)
+    bucket = event.get('bucket') or environ["MUSEUM_BUCKET"]
+    num_rows = event.get('num_rows')
+    load_mode = event.get('load_mode', 'insert')
+
+    if event.get('incremental', True):
+        loaded = load_incremental(s3, get_pool(), bucket, num_rows, load_mode,
+                                  event.get('folder_path', 'museum_files'), get_dimensions())
+        objects, rows = len(loaded), sum(loaded.values())
+    else:
+        keys = [o["Key"] for o in list_bucket_objects(s3, bucket, 'lmnh_hist_data')
+                if o["Key"].endswith('.csv')]
+        uploaded = load_kiosk_stream(get_pool(), stream_s3_csv_objects(s3, bucket, keys),
+                                     num_rows, load_mode, dimensions=get_dimensions())
+        objects, rows = len(keys), sum(uploaded.values())
+
+    seconds = perf_counter() - start
+    logging.info('Loaded %s rows from %s objects in %.2fs.', rows, objects, seconds)
+    return {'objects': objects, 'rows': rows, 'seconds': seconds}
+
+
+def consume_handler(event: dict | None = None, context=None) -> dict:
+    """
+    Drain up to max_messages Kafka messages, or as many as arrive within the
+    drain time, uploading them in batches and returning the number committed.
+    The consumer stays subscribed between warm invocations unless an upload
+    fails, when it is closed so the next invocation re-reads the uncommitted batch.
+    """
+    # confluent_kafka and the consume loops are only imported by invocations of this handler
+    from consume import MessageSummary, consume_batches, get_consumer  # pylint: disable=import-outside-toplevel
+    from dead_letter import DEAD_LETTER_FILE, get_dead_letter_sink  # pylint: disable=import-outside-toplevel
+
+    event = event or {}
+    start = perf_counter()
+    max_messages = int(event.get('max_messages', DRAIN_MESSAGES))
+    batch_size = min(int(event.get('batch_size', 500)), max_messages)
+    consumer = get_client('consumer', get_consumer)
+    # a sink is kept for each dead letter setting, so later events can change them
+    dead_letter = (event.get('dead_letter', 'file'),
+                   event.get('dead_letter_path', DEAD_LETTER_FILE))
+    dead_letters = get_client(('dead_letters', *dead_letter),
+                              lambda: get_dead_letter_sink(*dead_letter))
+
+    committed = 0
+
+    def report(consumer, num_messages: int):
+        nonlocal committed
+        committed += num_messages
+
+    stop_event = Event()
+    timer = Timer(get_drain_seconds(event, context), stop_event.set)
+    timer.daemon = True
+    timer.start()
+    try:
+        succeeded = consume_batches(get_pool(), consumer, batch_size,
+                                    float(event.get('max_delay', 1.0)), stop_event, report,
+                                    dead_letters=dead_letters, summary=MessageSummary(),
+                                    dimensions=get_dimensions(), max_messages=max_messages,
+                                    close_consumer=False)
+    finally:
+        timer.cancel()
+    if not succeeded:
+        discard_client('consumer')
+    return {'succeeded': succeeded, 'committed': committed,
+            'seconds': perf_counter() - start}
@@ -0,0 +1,269 @@
+"""
+Museum kiosk loading
+Validate, format and upload chunks of kiosk rows with multi-row inserts or COPY,
+shared by the single process pipeline and the parallel ingest workers.
+"""
+
+from csv import writer
+from io import StringIO
+from itertools import islice
+import logging
+from time import perf_counter
+
+from cleaning import BATCH_COLUMNS, validate_batch
+from database import (RATING_TABLE,
+                      SUPPORT_TABLE,
+                      ConnectionPool,
+                      commit,
+                      ensure_partitions,
+                      get_cursor,
+                      get_insert_query,
+                      insert_instances)
+from dimensions import DimensionCache
+from metrics import record_rows, timed
+
+UPLOAD_BATCH_SIZE = 10000
+COPY_BUFFER_SIZE = 8 * 1024 * 1024
+COPY_COLUMNS = {
+    RATING_TABLE: 'rating_created_at, exhibition_id, rating_type_id, source_id',
+    SUPPORT_TABLE: 'instance_created_at, exhibition_id, support_type_id, source_id'
+}
+
+
+def validate_kiosk_data(kiosk_data: list[list]) -> list[list]:
+    """Remove kiosk rows that break the kiosk validation rules"""
+    if not kiosk_data:
+        return kiosk_data
+    # pandas is loaded on the first chunk rather than at start up
+    import pandas as pd  # pylint: disable=import-outside-toplevel
+
+    num_columns = len(BATCH_COLUMNS)
+    accepted, rejections = validate_batch(
+        pd.DataFrame([row[:num_columns] for row in kiosk_data], columns=list(BATCH_COLUMNS)))
+    logging.info('Kiosk data validated, %s rows rejected: %s',
+                 len(kiosk_data) - int(accepted.sum()), rejections)
+    return [row for row, valid in zip(kiosk_data, accepted) if valid]
+
+
+def get_rating_instances(kiosk_data: list[list]) -> list[list]:
+    """Get a list of rating instances"""
+    logging.info('Rating instances obtained.')
+    return [instance for instance in kiosk_data if int(instance[2]) >= 0]
+
+
+def format_rating_instances(ratings: list[list], dimensions: DimensionCache) -> list[list]:
+    """
+    Format the rating instances to return sql-friendly data,
+    dropping any with a site or value unknown to the dimension cache.
+    """
+    formatted = []
+    for row in ratings:
+        del row[3]
+        row[1] = dimensions.get_exhibition_id(int(row[1]))
+        row[2] = dimensions.get_rating_type_id(int(row[2]))
+        if row[1] is not None and row[2] is not None:
+            formatted.append(row)
+    logging.info('Rating instances formatted, %s unknown dropped.',
+                 len(ratings) - len(formatted))
+    return formatted
+
+
+def upload_rating_instances(conn, formatted_ratings: list[list], num_rows: int | None):
+    """
+    Upload the formatted rating instances to a database,
+    given a number of rows.
+    """
+    try:
+        selected_rows = formatted_ratings[:
+                                          num_rows] if num_rows else formatted_ratings
+        insert_instances(conn, RATING_TABLE, selected_rows)
+        commit(conn)
+        logging.info('Uploaded rating instances to the database.')
+    except AttributeError:
+        logging.error(
+            'Cursor was not created successfully, database not updated.')
+
+
+def get_support_instances(kiosk_data: list[list]) -> list[list]:
+    """Get a list of support instances"""
+    logging.info('Support instances obtained.')
+    return [instance for instance in kiosk_data if int(instance[2]) < 0]
+
+
+def format_support_instances(supports: list[list], dimensions: DimensionCache) -> list[list]:
+    """
+    Format the support instances to return sql-friendly data,
+    dropping any with a site or type unknown to the dimension cache.
+    """
+    formatted = []
+    for row in supports:
+        del row[2]
+        row[1] = dimensions.get_exhibition_id(int(row[1]))
+        # third column becomes type after deleting val
+        row[2] = dimensions.get_support_type_id(int(float(row[2])))
+        if row[1] is not None and row[2] is not None:
+            formatted.append(row)
+    logging.info('Support instances formatted, %s unknown dropped.',
+                 len(supports) - len(formatted))
+    return formatted
+
+
+def upload_support_instances(conn, formatted_supports: list[list], num_rows: int | None):
+    """
+    Upload the formatted support instances to a database,
+    given a number of rows.
+    """
+    try:
+        selected_rows = formatted_supports[:
+                                           num_rows] if num_rows else formatted_supports
+        insert_instances(conn, SUPPORT_TABLE, selected_rows)
+        commit(conn)
+        logging.info('Uploaded support instances to the database.')
+    except AttributeError:
+        logging.error(
+            'Cursor was not created successfully, database not updated.')
+
+
+def copy_buffer(curr, table: str, buffer: StringIO):
+    """Copy a csv buffer into a table's staging table and move new rows and their rollups across"""
+    buffer.seek(0)
+    curr.copy_expert(
+        f"COPY {table}_stage ({COPY_COLUMNS[table]}) FROM STDIN WITH (FORMAT csv)",
+        buffer)
+    curr.execute(get_insert_query(
+        table, f"SELECT {COPY_COLUMNS[table]} FROM {table}_stage"))
+    curr.execute(f"TRUNCATE {table}_stage;")
+    buffer.seek(0)
+    buffer.truncate()
+
+
+def copy_instances(conn, table: str, formatted_rows, num_rows: int | None,
+                   buffer_size: int = COPY_BUFFER_SIZE) -> int:
+    """
+    Upload formatted instance rows to a database with COPY FROM STDIN,
+    given a number of rows. Rows are streamed through in-memory buffers of
+    at most buffer_size bytes into a staging table, so existing rows are skipped.
+    """
+    start = perf_counter()
+    uploaded = 0
+    try:
+        curr = get_cursor(conn)
+        curr.execute(f"""
+        CREATE TEMP TABLE IF NOT EXISTS {table}_stage AS
+            SELECT {COPY_COLUMNS[table]} FROM {table} WITH NO DATA;
+        """)
+        buffer = StringIO()
+        csv_writer = writer(buffer)
+        months = set()
+        for row in islice(formatted_rows, num_rows):
+            csv_writer.writerow(row)
+            months.add(row[0][:7])
+            uploaded += 1
+            if buffer.tell() >= buffer_size:
+                ensure_partitions(conn, table, months)
+                copy_buffer(curr, table, buffer)
+        ensure_partitions(conn, table, months)
+        copy_buffer(curr, table, buffer)
+        commit(conn)
+    except AttributeError:
+        logging.error(
+            'Cursor was not created successfully, database not updated.')
+        return 0
+
+    logging.debug('Copied %s rows into %s in %.2fs.', uploaded, table, perf_counter() - start)
+    return uploaded
+
+
+def format_instance(row: list, dimensions: DimensionCache) -> tuple[str, tuple] | None:
+    """
+    Obtain the target table and sql-friendly row for a kiosk row, ending with the
+    row's source_id if it has one, or None if its site or value is unknown to the
+    dimension cache
+    """
+    exhibition_id = dimensions.get_exhibition_id(int(row[1]))
+    if int(row[2]) < 0:
+        table, type_id = SUPPORT_TABLE, dimensions.get_support_type_id(int(float(row[3])))
+    else:
+        table, type_id = RATING_TABLE, dimensions.get_rating_type_id(int(row[2]))
+    if exhibition_id is None or type_id is None:
+        return None
+    return table, (row[0], exhibition_id, type_id, row[4] if len(row) > 4 else None)
+
+
+def upload_instances(conn, table: str, formatted_rows: list[tuple], load_mode: str) -> float:
+    """
+    Upload a batch of formatted rows to a table with the selected load mode,
+    recording its time and the table's rows per second, returning the seconds taken
+    """
+    start = perf_counter()
+    with timed('upload', table=table):
+        if load_mode == 'copy':
+            copy_instances(conn, table, formatted_rows, None)
+        elif table == RATING_TABLE:
+            upload_rating_instances(conn, formatted_rows, None)
+        else:
+            upload_support_instances(conn, formatted_rows, None)
+    elapsed = perf_counter() - start
+    record_rows(table, len(formatted_rows), elapsed)
+    return elapsed
+
+
+def log_load_rates(uploaded: dict[str, int], seconds: dict[str, float]):
+    """Log the rows per second of a whole load for each table"""
+    for table, count in uploaded.items():
+        logging.info('Loaded %s rows into %s in %.2fs (%.0f rows/s).', count, table,
+                     seconds[table], count / seconds[table] if seconds[table] else 0)
+
+
+def load_kiosk_stream(pool: ConnectionPool, chunks, num_rows: int | None, load_mode: str = 'insert',
+                      batch_size: int = UPLOAD_BATCH_SIZE,
+                      dimensions: DimensionCache | None = None) -> dict[str, int]:
+    """
+    Validate, route, format and upload chunks of kiosk rows in bounded batches,
+    given a number of rows per table, returning the rows uploaded per table.
+    Reading each chunk, which includes any download or decoding, is timed as
+    the extract stage, and validating and formatting as their own stages.
+    Kiosk codes are resolved through the dimension cache, and rows with
+    unknown codes are dropped before they reach the database. Upload times
+    are added up per table, so one rows per second line is logged per table.
+    """
+    batches = {RATING_TABLE: [], SUPPORT_TABLE: []}
+    uploaded = {RATING_TABLE: 0, SUPPORT_TABLE: 0}
+    seconds = {RATING_TABLE: 0.0, SUPPORT_TABLE: 0.0}
+    limit = num_rows if num_rows else float('inf')
+    dimensions = dimensions or DimensionCache()
+    unknown = 0
+
+    chunks = iter(chunks)
+    while True:
+        with timed('extract'):
+            chunk = next(chunks, None)
+        if chunk is None:
+            break
+        with timed('validate'):
+            valid_rows = validate_kiosk_data(chunk)
+        dimensions.refresh_if_stale(pool)
+        with timed('format'):
+            formatted_rows = [format_instance(row, dimensions) for row in valid_rows]
+            known_rows = [instance for instance in formatted_rows if instance is not None]
+        unknown += len(formatted_rows) - len(known_rows)
+        for table, formatted_row in known_rows:
+            if uploaded[table] + len(batches[table]) >= limit:
+                continue
+            batches[table].append(formatted_row)
+            if len(batches[table]) >= batch_size:
+                seconds[table] += pool.run(upload_instances, table, batches[table], load_mode)
+                uploaded[table] += len(batches[table])
+                batches[table] = []
+        if all(count + len(batches[table]) >= limit
+               for table, count in uploaded.items()):
+            break
+
+    for table, rows in batches.items():
+        if rows:
+            seconds[table] += pool.run(upload_instances, table, rows, load_mode)
+            uploaded[table] += len(rows)
+    log_load_rates(uploaded, seconds)
+    logging.info('Uploaded %s rating and %s support instances, %s with unknown codes dropped.',
+                 uploaded[RATING_TABLE], uploaded[SUPPORT_TABLE], unknown)
+    return uploaded
@@ -0,0 +1,66 @@
+"""
+Museum extract manifest
+Keep a local record of the S3 objects that have been loaded,
+so incremental runs only download and load new or changed objects
+"""
+
+import json
+import logging
+from os import path, replace
+
+MANIFEST_FILE = "manifest.json"
+
+
+def load_manifest(folder_path: str) -> dict[str, dict]:
+    """Load the manifest of processed objects, keyed by object key."""
+
+    manifest_path = f"{folder_path}/{MANIFEST_FILE}"
+    if not path.exists(manifest_path):
+        return {}
+
+    with open(manifest_path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def save_manifest(manifest: dict[str, dict], folder_path: str) -> None:
+    """Write the manifest atomically so an interrupted run cannot corrupt it."""
+
+    manifest_path = f"{folder_path}/{MANIFEST_FILE}"
+    with open(f"{manifest_path}.tmp", "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=2)
+    replace(f"{manifest_path}.tmp", manifest_path)
+
+
+def get_changed_objects(objects: list[dict], manifest: dict[str, dict]) -> list[dict]:
+    """Return the objects that are new or whose ETag or size has changed."""
+
+    changed = [o for o in objects
+               if o["Key"] not in manifest
+               or manifest[o["Key"]]["etag"] != o.get("ETag")
+               or manifest[o["Key"]]["size"] != o.get("Size")]
+
+    logging.info('%s of %s objects are new or changed.',
+                 len(changed), len(objects))
+
+    return changed
+
+
+def record_object(manifest: dict[str, dict], s3_object: dict, row_count: int) -> None:
+    """Record an object as processed, with the number of rows loaded from it."""
+
+    last_modified = s3_object.get("LastModified")
+    manifest[s3_object["Key"]] = {
+        "etag": s3_object.get("ETag"),
+        "size": s3_object.get("Size"),
+        "last_modified": last_modified.isoformat() if last_modified else None,
+        "row_count": row_count
+    }
+
+
+def is_truncated(rows: dict[str, int], num_rows: int | None) -> bool:
+    """
+    Check if a num_rows limit may have cut an object's load short, in which
+    case it is left out of the manifest so a later run loads it in full.
+    """
+
+    return num_rows is not None and any(count >= num_rows for count in rows.values())
@@ -0,0 +1,177 @@
+"""
+Museum pipeline metrics
+Counters, gauges, histograms and stage timers shared by the S3 pipeline
+and the Kafka consume script, rendered in the Prometheus text format
+for a local scrape endpoint or a periodically dumped file
+"""
+
+from bisect import bisect_left
+from contextlib import contextmanager
+import logging
+from os import replace
+from threading import Event, Lock, Thread
+from time import perf_counter
+
+from profiling import enter_stage, exit_stage
+
+METRICS_CONTENT_TYPE = 'text/plain; version=0.0.4'
+METRICS_DUMP_INTERVAL = 15.0
+SECONDS_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05,
+                   0.1, 0.5, 1.0, 5.0, 10.0, 60.0)
+
+counters = {}
+gauges = {}
+histograms = {}
+metrics_lock = Lock()
+
+
+def get_key(name: str, labels: dict) -> tuple:
+    """Get the key of a metric from its name and sorted labels"""
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name: str, amount: float = 1, **labels):
+    """Add to a counter"""
+    key = get_key(name, labels)
+    with metrics_lock:
+        counters[key] = counters.get(key, 0) + amount
+
+
+def set_gauge(name: str, value: float, **labels):
+    """Set a gauge to its latest value"""
+    with metrics_lock:
+        gauges[get_key(name, labels)] = value
+
+
+def observe(name: str, value: float, **labels):
+    """Record a value in a histogram of cumulative second buckets"""
+    key = get_key(name, labels)
+    bucket = bisect_left(SECONDS_BUCKETS, value)
+    with metrics_lock:
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = [[0] * (len(SECONDS_BUCKETS) + 1), 0, 0.0]
+        histogram[0][bucket] += 1
+        histogram[1] += 1
+        histogram[2] += value
+
+
+@contextmanager
+def timed(stage: str, **labels):
+    """Time the enclosed stage into the stage_seconds histogram, and tag it for any profiler"""
+    with tagged(stage), timed_untagged(stage, **labels):
+        yield
+
+
+@contextmanager
+def timed_untagged(stage: str, **labels):
+    """
+    Time the enclosed stage without tagging it for the profiler, for stages that
+    await: the profiler tags stages by thread, which asyncio tasks share
+    """
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        observe('stage_seconds', perf_counter() - start, stage=stage, **labels)
+
+
+@contextmanager
+def tagged(stage: str):
+    """Tag the enclosed code with a stage for any profiler, without timing it"""
+    previous = enter_stage(stage)
+    try:
+        yield
+    finally:
+        exit_stage(stage, previous)
+
+
+def record_rows(table: str, num_rows: int, seconds: float):
+    """Count rows loaded into a table and set its latest rows per second"""
+    inc('rows_loaded_total', num_rows, table=table)
+    if seconds > 0:
+        set_gauge('rows_per_second', num_rows / seconds, table=table)
+
+
+def format_labels(labels: tuple) -> str:
+    """Format metric labels in the Prometheus text format"""
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels) + '}'
+
+
+def render_metrics() -> str:
+    """Render every metric in the Prometheus text exposition format"""
+    with metrics_lock:
+        counter_items = sorted(counters.items())
+        gauge_items = sorted(gauges.items())
+        histogram_items = sorted((key, [list(buckets), count, total])
+                                 for key, (buckets, count, total) in histograms.items())
+
+    lines = []
+    declared = set()
+
+    def declare(name: str, metric_type: str):
+        if name not in declared:
+            declared.add(name)
+            lines.append(f'# TYPE {name} {metric_type}')
+
+    for (name, labels), value in counter_items:
+        declare(name, 'counter')
+        lines.append(f'{name}{format_labels(labels)} {value}')
+    for (name, labels), value in gauge_items:
+        declare(name, 'gauge')
+        lines.append(f'{name}{format_labels(labels)} {value}')
+    for (name, labels), (buckets, count, total) in histogram_items:
+        declare(name, 'histogram')
+        cumulative = 0
+        for bound, bucket_count in zip(SECONDS_BUCKETS + ('+Inf',), buckets):
+            cumulative += bucket_count
+            lines.append(f'{name}_bucket{format_labels(labels + (("le", bound),))} '
+                         f'{cumulative}')
+        lines.append(f'{name}_sum{format_labels(labels)} {total}')
+        lines.append(f'{name}_count{format_labels(labels)} {count}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_route() -> tuple[str, str]:
+    """Get the metrics as a scrape endpoint response"""
+    return METRICS_CONTENT_TYPE, render_metrics()
+
+
+def dump_metrics(file_path: str):
+    """Write the metrics to a file atomically, so readers never see a partial dump"""
+    with open(f'{file_path}.tmp', 'w', encoding='utf-8') as file:
+        file.write(render_metrics())
+    replace(f'{file_path}.tmp', file_path)
+
+
+def start_metrics_dump(file_path: str, interval: float = METRICS_DUMP_INTERVAL):
+    """
+    Dump the metrics to a file every interval seconds from a daemon thread.
+    Calling the returned function stops the thread after a final dump.
+    """
+    stop_event = Event()
+
+    def dump_periodically():
+        while not stop_event.wait(interval):
+            dump_metrics(file_path)
+        dump_metrics(file_path)
+
+    thread = Thread(target=dump_periodically, name='metrics-dump', daemon=True)
+    thread.start()
+    logging.info('Dumping metrics to %s every %ss.', file_path, interval)
+
+    def stop():
+        stop_event.set()
+        thread.join()
+
+    return stop
+
+
+def reset_metrics():
+    """Clear every metric"""
+    with metrics_lock:
+        counters.clear()
+        gauges.clear()
+        histograms.clear()
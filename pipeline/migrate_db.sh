@@ -0,0 +1,2 @@
+source db.env
+psql -h $DATABASE_IP -U $DATABASE_USERNAME -d $DATABASE_NAME -p $DATABASE_PORT -f migrations/$1
@@ -0,0 +1,20 @@
+-- Adds a source_id to the instance tables naming where each row was read from:
+-- '<topic>:<partition>:<offset>' for Kafka messages, or '<object>@<byte offset>'
+-- for the line of an S3 object or csv file. Replayed Kafka messages and re-run S3
+-- loads are then inserted with ON CONFLICT DO NOTHING, while separate presses in
+-- the same second are kept. Existing rows keep a NULL source_id, which never
+-- conflicts, so no existing rows are removed.
+
+ALTER TABLE rating_instance ADD COLUMN IF NOT EXISTS source_id TEXT;
+
+ALTER TABLE support_instance ADD COLUMN IF NOT EXISTS source_id TEXT;
+
+ALTER TABLE rating_instance
+    ADD CONSTRAINT rating_instance_source_key
+    UNIQUE (source_id)
+;
+
+ALTER TABLE support_instance
+    ADD CONSTRAINT support_instance_source_key
+    UNIQUE (source_id)
+;
@@ -0,0 +1,121 @@
+-- Moves the instance tables onto BIGINT identity keys and monthly range partitions
+-- on their created_at columns, with an index for per-exhibition time range queries.
+-- Existing rows, ids and source ids are copied into the new partitioned tables, which
+-- then replace the old tables in a single transaction. Unique keys on partitioned
+-- tables must hold the partition column, so the source_id key from 001 becomes
+-- (source_id, created_at), which skips the same rows as a row's source fixes its time.
+
+BEGIN;
+
+CREATE OR REPLACE FUNCTION ensure_monthly_partition(parent TEXT, time_column TEXT, month_start DATE)
+RETURNS VOID AS $$
+DECLARE
+    partition_name TEXT := format('%s_%s', parent, to_char(month_start, 'YYYY_MM'));
+    range_start TIMESTAMPTZ := month_start::TIMESTAMP AT TIME ZONE 'UTC';
+    range_end TIMESTAMPTZ := (month_start + INTERVAL '1 month')::TIMESTAMP AT TIME ZONE 'UTC';
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext(partition_name));
+    IF to_regclass(partition_name) IS NOT NULL THEN
+        RETURN;
+    END IF;
+    EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS)', partition_name, parent);
+    EXECUTE format('WITH moved AS (DELETE FROM %I WHERE %I >= %L AND %I < %L RETURNING *) '
+                   'INSERT INTO %I SELECT * FROM moved',
+                   parent || '_default', time_column, range_start, time_column, range_end,
+                   partition_name);
+    EXECUTE format('ALTER TABLE %I ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                   parent, partition_name, range_start, range_end);
+END;
+$$ LANGUAGE plpgsql;
+
+ALTER TABLE rating_instance RENAME TO rating_instance_old;
+ALTER TABLE rating_instance_old RENAME CONSTRAINT rating_instance_source_key TO rating_instance_old_source_key;
+ALTER TABLE rating_instance_old RENAME CONSTRAINT rating_instance_pkey TO rating_instance_old_pkey;
+
+CREATE TABLE rating_instance (
+    rating_instance_id BIGINT GENERATED ALWAYS AS IDENTITY,
+    exhibition_id SMALLINT NOT NULL,
+    rating_type_id SMALLINT NOT NULL,
+    rating_created_at TIMESTAMPTZ NOT NULL,
+    source_id TEXT,
+    PRIMARY KEY (rating_instance_id, rating_created_at),
+    CONSTRAINT rating_instance_source_key
+        UNIQUE (source_id, rating_created_at),
+    FOREIGN KEY (exhibition_id) REFERENCES exhibition(exhibition_id)
+        ON DELETE CASCADE,
+    FOREIGN KEY (rating_type_id) REFERENCES rating_type(rating_type_id)
+        ON DELETE CASCADE
+) PARTITION BY RANGE (rating_created_at);
+
+CREATE TABLE rating_instance_default PARTITION OF rating_instance DEFAULT;
+
+SELECT ensure_monthly_partition('rating_instance', 'rating_created_at', month)
+    FROM (SELECT DISTINCT date_trunc('month', rating_created_at AT TIME ZONE 'UTC')::DATE AS month
+          FROM rating_instance_old) AS months
+;
+
+INSERT INTO rating_instance
+    (rating_instance_id, exhibition_id, rating_type_id, rating_created_at, source_id)
+OVERRIDING SYSTEM VALUE
+SELECT rating_instance_id, exhibition_id, rating_type_id, rating_created_at, source_id
+FROM rating_instance_old
+;
+
+SELECT setval(pg_get_serial_sequence('rating_instance', 'rating_instance_id'),
+              COALESCE(MAX(rating_instance_id), 0) + 1, false)
+    FROM rating_instance
+;
+
+DROP TABLE rating_instance_old;
+
+CREATE INDEX rating_instance_exhibition_created_idx
+    ON rating_instance (exhibition_id, rating_created_at)
+    INCLUDE (rating_type_id)
+;
+
+ALTER TABLE support_instance RENAME TO support_instance_old;
+ALTER TABLE support_instance_old RENAME CONSTRAINT support_instance_source_key TO support_instance_old_source_key;
+ALTER TABLE support_instance_old RENAME CONSTRAINT support_instance_pkey TO support_instance_old_pkey;
+
+CREATE TABLE support_instance (
+    support_instance_id BIGINT GENERATED ALWAYS AS IDENTITY,
+    exhibition_id SMALLINT NOT NULL,
+    support_type_id SMALLINT NOT NULL,
+    instance_created_at TIMESTAMPTZ NOT NULL,
+    source_id TEXT,
+    PRIMARY KEY (support_instance_id, instance_created_at),
+    CONSTRAINT support_instance_source_key
+        UNIQUE (source_id, instance_created_at),
+    FOREIGN KEY (exhibition_id) REFERENCES exhibition(exhibition_id)
+        ON DELETE CASCADE,
+    FOREIGN KEY (support_type_id) REFERENCES support_type(support_type_id)
+        ON DELETE CASCADE
+) PARTITION BY RANGE (instance_created_at);
+
+CREATE TABLE support_instance_default PARTITION OF support_instance DEFAULT;
+
+SELECT ensure_monthly_partition('support_instance', 'instance_created_at', month)
+    FROM (SELECT DISTINCT date_trunc('month', instance_created_at AT TIME ZONE 'UTC')::DATE AS month
+          FROM support_instance_old) AS months
+;
+
+INSERT INTO support_instance
+    (support_instance_id, exhibition_id, support_type_id, instance_created_at, source_id)
+OVERRIDING SYSTEM VALUE
+SELECT support_instance_id, exhibition_id, support_type_id, instance_created_at, source_id
+FROM support_instance_old
+;
+
+SELECT setval(pg_get_serial_sequence('support_instance', 'support_instance_id'),
+              COALESCE(MAX(support_instance_id), 0) + 1, false)
+    FROM support_instance
+;
+
+DROP TABLE support_instance_old;
+
+CREATE INDEX support_instance_exhibition_created_idx
+    ON support_instance (exhibition_id, instance_created_at)
+    INCLUDE (support_type_id)
+;
+
+COMMIT;
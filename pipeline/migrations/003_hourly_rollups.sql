@@ -0,0 +1,47 @@
+-- Adds hourly per-exhibition rollups of the instance tables, which the loaders
+-- keep up to date as they insert instances, and backfills them from existing rows.
+-- Stop the consumers and pipeline while this runs, so no inserts are counted twice.
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS rating_hourly_rollup (
+    exhibition_id SMALLINT NOT NULL,
+        FOREIGN KEY (exhibition_id) REFERENCES exhibition(exhibition_id)
+        ON DELETE CASCADE,
+    hour_start TIMESTAMPTZ NOT NULL,
+    rating_type_id SMALLINT NOT NULL,
+        FOREIGN KEY (rating_type_id) REFERENCES rating_type(rating_type_id)
+        ON DELETE CASCADE,
+    rating_count BIGINT NOT NULL,
+    PRIMARY KEY (exhibition_id, hour_start, rating_type_id)
+);
+
+CREATE TABLE IF NOT EXISTS support_hourly_rollup (
+    exhibition_id SMALLINT NOT NULL,
+        FOREIGN KEY (exhibition_id) REFERENCES exhibition(exhibition_id)
+        ON DELETE CASCADE,
+    hour_start TIMESTAMPTZ NOT NULL,
+    support_type_id SMALLINT NOT NULL,
+        FOREIGN KEY (support_type_id) REFERENCES support_type(support_type_id)
+        ON DELETE CASCADE,
+    support_count BIGINT NOT NULL,
+    PRIMARY KEY (exhibition_id, hour_start, support_type_id)
+);
+
+TRUNCATE rating_hourly_rollup, support_hourly_rollup;
+
+INSERT INTO rating_hourly_rollup
+    (exhibition_id, hour_start, rating_type_id, rating_count)
+SELECT exhibition_id, date_trunc('hour', rating_created_at) AS hour_start, rating_type_id, COUNT(*)
+FROM rating_instance
+GROUP BY exhibition_id, hour_start, rating_type_id
+;
+
+INSERT INTO support_hourly_rollup
+    (exhibition_id, hour_start, support_type_id, support_count)
+SELECT exhibition_id, date_trunc('hour', instance_created_at) AS hour_start, support_type_id, COUNT(*)
+FROM support_instance
+GROUP BY exhibition_id, hour_start, support_type_id
+;
+
+COMMIT;
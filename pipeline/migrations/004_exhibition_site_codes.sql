@@ -0,0 +1,23 @@
+-- Adds the kiosk 'site' code of each exhibition, which the loaders now resolve
+-- to exhibition ids through the dimension cache instead of assuming id = site + 1.
+-- Exhibitions are matched by name, so the codes do not depend on their seeded order.
+
+BEGIN;
+
+ALTER TABLE exhibition ADD COLUMN IF NOT EXISTS site_code SMALLINT;
+
+UPDATE exhibition
+    SET site_code = codes.site_code
+    FROM (VALUES
+        ('Measureless to Man', 0),
+        ('Adaptation', 1),
+        ('The Crenshaw Collection', 2),
+        ('Cetacean Sensations', 3),
+        ('Our Polluted World', 4),
+        ('Thunder Lizards', 5)
+    ) AS codes (exhibition_name, site_code)
+    WHERE exhibition.exhibition_name = codes.exhibition_name;
+
+ALTER TABLE exhibition ADD CONSTRAINT exhibition_site_code_key UNIQUE (site_code);
+
+COMMIT;
@@ -0,0 +1,220 @@
+"""
+Museum parallel ingest
+Load kiosk csv files or S3 objects with a pool of worker processes, where each
+worker takes one object, or a line-aligned byte range of a large one, end to end:
+parse, validate, format and bulk insert over its own database connection.
+A coordinator collects the rows loaded and any failure per object.
+"""
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from os import cpu_count, path
+import logging
+from time import perf_counter
+from typing import NamedTuple
+
+from database import RATING_TABLE, SUPPORT_TABLE, ConnectionPool
+from extract import (CHUNK_SIZE,
+                     chunk_rows,
+                     get_s3_client,
+                     list_bucket_objects,
+                     read_source_rows)
+from load import load_kiosk_stream
+from manifest import (get_changed_objects,
+                      is_truncated,
+                      load_manifest,
+                      record_object,
+                      save_manifest)
+from metrics import record_rows
+from profiling import start_profiler
+
+# objects larger than this are split into byte ranges loaded by separate workers
+SPLIT_SIZE = 64 * 1024 * 1024
+
+
+class IngestTask(NamedTuple):
+    """A csv file or S3 object, or a byte range of one, loaded by one worker"""
+    key: str
+    bucket: str | None = None
+    start: int = 0
+    end: int | None = None
+
+
+class IngestResult(NamedTuple):
+    """The rows a task loaded per table, or the error it failed with"""
+    task: IngestTask
+    rows: dict[str, int]
+    seconds: float
+    error: str | None = None
+
+
+def get_ranges(size: int, split_size: int = SPLIT_SIZE) -> list[tuple[int, int | None]]:
+    """Split an object of size bytes into byte ranges of about split_size bytes"""
+    num_parts = max(1, -(-size // split_size))
+    if num_parts == 1:
+        return [(0, None)]
+    bounds = [size * part // num_parts for part in range(num_parts)]
+    return list(zip(bounds, bounds[1:] + [None]))
+
+
+def get_file_tasks(file_paths: list[str], split_size: int = SPLIT_SIZE) -> list[IngestTask]:
+    """Get a task per downloaded csv file, or per byte range of a large one"""
+    return [IngestTask(file_path, None, start, end)
+            for file_path in file_paths
+            for start, end in get_ranges(path.getsize(file_path), split_size)]
+
+
+def get_s3_tasks(bucket: str, objects: list[dict],
+                 split_size: int = SPLIT_SIZE) -> list[IngestTask]:
+    """Get a task per listed S3 object, or per byte range of a large one"""
+    return [IngestTask(o["Key"], bucket, start, end)
+            for o in objects
+            for start, end in get_ranges(o.get("Size", 0), split_size)]
+
+
+def read_line_range(lines, start: int, end: int | None):
+    """
+    Yield the lines that start within a byte range with their byte offsets, given
+    the lines read from the byte before start. The line holding that byte belongs
+    to the previous range, and the header is skipped in the first range.
+    """
+    lines = iter(lines)
+    position = max(start - 1, 0)
+    skipped = next(lines, b'')
+    position += len(skipped)
+    for line in lines:
+        if end is not None and position >= end:
+            return
+        yield position, line
+        position += len(line)
+
+
+def read_task_lines(task: IngestTask):
+    """Yield the raw csv lines of a task's file or S3 object range with their byte offsets"""
+    offset = max(task.start - 1, 0)
+    if task.bucket is None:
+        with open(task.key, 'rb') as file:
+            file.seek(offset)
+            yield from read_line_range(file, task.start, task.end)
+        return
+
+    # read on past the end of the range to finish its last line
+    body = get_s3_client().get_object(Bucket=task.bucket, Key=task.key,
+                                      Range=f'bytes={offset}-')["Body"]
+    try:
+        yield from read_line_range(body.iter_lines(keepends=True), task.start, task.end)
+    finally:
+        body.close()
+
+
+def stream_task_rows(task: IngestTask, chunk_size: int = CHUNK_SIZE):
+    """Stream a task's csv rows in chunks of at most chunk_size rows"""
+    return chunk_rows(read_source_rows(read_task_lines(task), path.basename(task.key)),
+                      chunk_size)
+
+
+def ingest_task(task: IngestTask, num_rows: int | None = None,
+                load_mode: str = 'copy', profile_dir: str | None = None) -> IngestResult:
+    """
+    Load one task end to end in a worker process over its own database connection,
+    returning the error instead of raising so one failed object does not stop the rest.
+    With a profile_dir, the task is profiled to a directory named after its key and range.
+    """
+    start = perf_counter()
+    pool = None
+    profiler = None
+    if profile_dir:
+        profiler = start_profiler(
+            path.join(profile_dir, f'{path.basename(task.key)}_{task.start}'))
+    try:
+        pool = ConnectionPool(size=1)
+        rows = load_kiosk_stream(pool, stream_task_rows(task), num_rows, load_mode)
+        return IngestResult(task, rows, perf_counter() - start)
+    except Exception as err:  # pylint: disable=broad-except
+        logging.error('Loading %s from byte %s failed. %s', task.key, task.start, err)
+        return IngestResult(task, {}, perf_counter() - start, repr(err))
+    finally:
+        if pool:
+            pool.close()
+        if profiler:
+            profiler.stop()
+
+
+def get_totals(results: list[IngestResult]) -> dict[str, int]:
+    """Sum the rows loaded per table over every task"""
+    totals = {RATING_TABLE: 0, SUPPORT_TABLE: 0}
+    for result in results:
+        for table, count in result.rows.items():
+            totals[table] += count
+    return totals
+
+
+def get_object_rows(results: list[IngestResult]) -> dict[str, int | None]:
+    """Get the rows loaded per object, or None for an object with a failed task"""
+    object_rows = {}
+    for result in results:
+        if result.error or object_rows.get(result.task.key, 0) is None:
+            object_rows[result.task.key] = None
+        else:
+            object_rows[result.task.key] = (object_rows.get(result.task.key, 0)
+                                            + sum(result.rows.values()))
+    return object_rows
+
+
+def ingest_parallel(tasks: list[IngestTask], workers: int | None = None,
+                    num_rows: int | None = None, load_mode: str = 'copy',
+                    profile_dir: str | None = None) -> list[IngestResult]:
+    """
+    Load tasks with a pool of worker processes, one task per worker at a time,
+    logging each result as it completes. num_rows limits the rows per task and table.
+    """
+    workers = workers or cpu_count() or 1
+    start = perf_counter()
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(ingest_task, task, num_rows, load_mode, profile_dir)
+                   for task in tasks]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            for table, count in result.rows.items():
+                record_rows(table, count, result.seconds)
+            logging.info('Loaded %s/%s tasks, %s from byte %s: %s rows in %.2fs.',
+                         len(results), len(tasks), result.task.key, result.task.start,
+                         sum(result.rows.values()), result.seconds)
+
+    totals = get_totals(results)
+    failed = [result for result in results if result.error]
+    logging.info('Loaded %s rating and %s support instances with %s workers in %.2fs, '
+                 '%s tasks failed.', totals[RATING_TABLE], totals[SUPPORT_TABLE],
+                 workers, perf_counter() - start, len(failed))
+    for result in failed:
+        logging.error('Failed to load %s from byte %s: %s',
+                      result.task.key, result.task.start, result.error)
+    return results
+
+
+def ingest_incremental(s3, bucket: str, workers: int | None = None, num_rows: int | None = None,
+                       load_mode: str = 'copy', folder_path: str = 'museum_files',
+                       split_size: int = SPLIT_SIZE,
+                       profile_dir: str | None = None) -> list[IngestResult]:
+    """
+    Load the kiosk objects that are new or changed since the last run straight
+    from S3 with a pool of worker processes, recording each object in the manifest
+    once every one of its tasks has loaded, so failed objects are retried next run.
+    Objects with a task that num_rows may have cut short are not recorded either.
+    """
+    manifest = load_manifest(folder_path)
+    objects = [o for o in list_bucket_objects(s3, bucket, 'lmnh_hist_data')
+               if o["Key"].endswith('.csv')]
+    changed = get_changed_objects(objects, manifest)
+    results = ingest_parallel(get_s3_tasks(bucket, changed, split_size),
+                              workers, num_rows, load_mode, profile_dir)
+
+    object_rows = get_object_rows(results)
+    truncated = {result.task.key for result in results if is_truncated(result.rows, num_rows)}
+    for s3_object in changed:
+        if (object_rows.get(s3_object["Key"]) is not None
+                and s3_object["Key"] not in truncated):
+            record_object(manifest, s3_object, object_rows[s3_object["Key"]])
+    save_manifest(manifest, folder_path)
+    return results
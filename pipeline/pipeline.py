@@ -3,20 +3,44 @@ ETL pipeline that takes kiosk data from museum S3 bucket
 and transforms it into a psql database.
 """
 
-from os import environ
+from os import environ, remove
 import argparse
+import atexit
 from csv import reader
+from itertools import islice
 import logging
+import sys
 
 from dotenv import load_dotenv
 
-from psycopg2 import connect, OperationalError
-from psycopg2.extras import execute_values, RealDictCursor
-
-from extract import (download_specific_files,
+# get_cursor and get_db_connection stay importable from this module
+from database import ConnectionPool, get_cursor, get_db_connection
+from dimensions import DimensionCache
+from extract import (download_objects,
+                     download_specific_files,
                      delete_csv_files,
                      get_s3_client,
-                     merge_csv_to_file)
+                     list_bucket_objects,
+                     merge_csv_to_file,
+                     position_lines,
+                     read_source_rows,
+                     stream_csv_files,
+                     stream_s3_csv_objects)
+from load import load_kiosk_stream
+from manifest import (get_changed_objects,
+                      is_truncated,
+                      load_manifest,
+                      record_object,
+                      save_manifest)
+from metrics import start_metrics_dump, timed
+from parallel_ingest import (IngestResult,
+                             get_file_tasks,
+                             get_s3_tasks,
+                             ingest_incremental,
+                             ingest_parallel)
+from profiling import start_profiler
+
+CHUNK_SIZE = 10000
 
 
 def argparse_is_my_friend():
@@ -28,9 +52,30 @@ def argparse_is_my_friend():
                         help="number of instance rows to be uploaded to database")
     parser.add_argument("--log", "-l", default=False, action='store_true',
                         help="boolean argument to set log to output in console or file")
+    parser.add_argument("--load_mode", "-lm", choices=['insert', 'copy'], default='insert',
+                        help="upload rows with batched inserts or with COPY FROM STDIN")
+    parser.add_argument("--incremental", "-i", default=False, action='store_true',
+                        help="only download and load objects that are new or changed")
+    parser.add_argument("--source", "-s", choices=['files', 's3', 'merged'], default='files',
+                        help="stream downloaded files, stream S3 objects directly "
+                        "or load a pandas-merged csv file")
+    parser.add_argument("--cache", "-c", choices=['write', 'read'],
+                        help="write the extracted data to the parquet cache before loading "
+                        "it, or load from the existing parquet cache instead of S3")
+    parser.add_argument("--metrics_file", "-mf",
+                        help="file the Prometheus stage and load metrics are periodically dumped to")
+    parser.add_argument("--workers", "-w", type=int,
+                        help="load each kiosk file or S3 object, or byte range of a large one, "
+                        "in a pool of this many worker processes")
+    parser.add_argument("--profile", "-p",
+                        help="directory sampled stacks and tracemalloc snapshots of each stage, "
+                        "and of each worker process, are written to")
 
     args = vars(parser.parse_args())
-    return (args.get('bucket'), args.get('num_rows'), args.get('log'))
+    return (args.get('bucket'), args.get('num_rows'), args.get('log'),
+            args.get('load_mode'), args.get('incremental'), args.get('source'),
+            args.get('cache'), args.get('metrics_file'), args.get('workers'),
+            args.get('profile'))
 
 
 def log_to_file():
@@ -39,31 +84,6 @@ def log_to_file():
                         format='%(asctime)s %(levelname)s %(message)s')
 
 
-def get_db_connection():
-    """
-    Gets a connection to the specified database
-    """
-    load_dotenv()
-    try:
-        conn = connect(
-            user=environ["DATABASE_USERNAME"],
-            password=environ["DATABASE_PASSWORD"],
-            host=environ["DATABASE_IP"],
-            port=environ["DATABASE_PORT"],
-            database=environ["DATABASE_NAME"],
-            cursor_factory=RealDictCursor)
-        logging.info('Connected to database successfully')
-        return conn
-    except OperationalError as err:
-        logging.error('Connection attempt to database unsuccessful. %s', err)
-        return None
-
-
-def get_cursor(conn) -> list[dict[str, str]]:
-    """Gets a cursor to browse database"""
-    return conn.cursor(cursor_factory=RealDictCursor)
-
-
 def load_kiosk_data(file_path: str) -> list:
     """Loads the merged csv file generated by kiosks"""
     with open(f'{file_path}/lmnh_merged_hist_data.csv', 'r',
@@ -73,119 +93,195 @@ def load_kiosk_data(file_path: str) -> list:
     return data[1:]
 
 
-def get_rating_instances(kiosk_data: list[list]) -> list[list]:
-    """Get a list of rating instances"""
-    logging.info('Rating instances obtained.')
-    return [instance for instance in kiosk_data if int(instance[2]) >= 0]
+def stream_kiosk_data(file_path: str, chunk_size: int = CHUNK_SIZE,
+                      file_name: str = 'lmnh_merged_hist_data.csv'):
+    """Yield a csv file generated by kiosks in chunks of rows ending with their source_id"""
+    with open(f'{file_path}/{file_name}', 'rb') as file:
+        rows = read_source_rows(position_lines(file), file_name)
+        next(rows, None)
+        while chunk := list(islice(rows, chunk_size)):
+            yield chunk
+    logging.info('Kiosk data successfully streamed.')
 
 
-def format_rating_instances(ratings: list[list]) -> list[list]:
-    """Format the rating instances to return sql-friendly data."""
-    for row in ratings:
-        del row[3]
-        row[1] = int(row[1]) + 1
-        row[2] = int(row[2]) + 1
-    logging.info('Rating instances formatted.')
-    return ratings
-
-
-def upload_rating_instances(conn, formatted_ratings: list[list], num_rows: int | None):
-    """
-    Upload the formatted rating instances to a database,
-    given a number of rows.
+def load_incremental(s3, pool: ConnectionPool, bucket: str, num_rows: int | None,
+                     load_mode: str, folder_path: str = 'museum_files',
+                     dimensions: DimensionCache | None = None) -> dict[str, int]:
     """
-    sql_query = """
-    INSERT INTO rating_instance
-        (rating_created_at, exhibition_id, rating_type_id)
-    VALUES
-    %s;
-    """
-
-    try:
-        curr = get_cursor(conn)
-        selected_rows = formatted_ratings[:
-                                          num_rows] if num_rows else formatted_ratings
-        execute_values(curr, sql_query, selected_rows)
-        conn.commit()
-        logging.info('Uploaded rating instances to the database.')
-    except AttributeError:
-        logging.error(
-            'Cursor was not created successfully, database not updated.')
-
-
-def get_support_instances(kiosk_data: list[list]) -> list[list]:
-    """Get a list of support instances"""
-    logging.info('Support instances obtained.')
-    return [instance for instance in kiosk_data if int(instance[2]) < 0]
-
-
-def format_support_instances(supports: list[list]) -> list[list]:
-    """Format the support instances to return sql-friendly data."""
-    for row in supports:
-        del row[2]
-        row[1] = int(row[1]) + 1
-        # third column becomes type after deleting val
-        row[2] = int(float(row[2])) + 1
-    logging.info('Support instances formatted.')
-    return supports
-
-
-def upload_support_instances(conn, formatted_supports: list[list], num_rows: int | None):
+    Download and load only the kiosk objects that are new or changed since
+    the last run, recording each one in the manifest once it is loaded in full.
+    Objects that num_rows may have cut short are not recorded.
+    Returns the number of rows loaded from each object.
     """
-    Upload the formatted support instances to a database,
-    given a number of rows.
+    dimensions = dimensions or DimensionCache()
+    loaded = {}
+    manifest = load_manifest(folder_path)
+    objects = [o for o in list_bucket_objects(s3, bucket, 'lmnh_hist_data')
+               if o["Key"].endswith('.csv')]
+    changed = get_changed_objects(objects, manifest)
+    with timed('download'):
+        # failed objects are left out of the manifest, so the next run retries them
+        downloaded = set(download_objects(s3, bucket, changed, folder_path)[0])
+
+    for s3_object in changed:
+        key = s3_object["Key"]
+        if key not in downloaded:
+            continue
+        uploaded = load_kiosk_stream(
+            pool, stream_kiosk_data(folder_path, file_name=key),
+            num_rows, load_mode, dimensions=dimensions)
+        loaded[key] = sum(uploaded.values())
+        if is_truncated(uploaded, num_rows):
+            logging.warning('Not recording %s in the manifest, as num_rows may have '
+                            'cut it short.', key)
+        else:
+            record_object(manifest, s3_object, loaded[key])
+            save_manifest(manifest, folder_path)
+        remove(f'{folder_path}/{key}')
+        logging.info('Loaded %s incrementally.', key)
+    return loaded
+
+
+def load_parallel(s3, bucket: str, workers: int,
+                  num_rows: int | None, load_mode: str, incremental: bool,
+                  source: str, folder_path: str = 'museum_files',
+                  profile_dir: str | None = None) -> bool:
     """
-    sql_query = """
-    INSERT INTO support_instance
-        (instance_created_at, exhibition_id, support_type_id)
-    VALUES
-    %s;
+    Load kiosk objects with a pool of worker processes, each over its own
+    database connection, streaming them from S3 or from downloaded files.
+    With a profile_dir, each task is profiled to its own directory within it.
+    Returns False without loading if any downloaded file failed to download,
+    or after loading if any task failed.
     """
-
-    try:
-        curr = get_cursor(conn)
-        selected_rows = formatted_supports[:
-                                           num_rows] if num_rows else formatted_supports
-        execute_values(curr, sql_query, selected_rows)
-        conn.commit()
-        logging.info('Uploaded support instances to the database.')
-    except AttributeError:
-        logging.error(
-            'Cursor was not created successfully, database not updated.')
+    if incremental:
+        results = ingest_incremental(s3, bucket, workers, num_rows, load_mode, folder_path,
+                                     profile_dir=profile_dir)
+    elif source == 's3':
+        objects = [o for o in list_bucket_objects(s3, bucket, 'lmnh_hist_data')
+                   if o["Key"].endswith('.csv')]
+        results = ingest_parallel(get_s3_tasks(bucket, objects), workers, num_rows,
+                                  load_mode, profile_dir)
+    else:
+        with timed('download'):
+            keys, failed = download_specific_files(s3, bucket, 'lmnh', folder_path)
+        if failed:
+            log_failed_downloads(failed)
+            return False
+        results = ingest_parallel(get_file_tasks([f'{folder_path}/{key}' for key in keys
+                                                  if key.startswith('lmnh_hist_data')
+                                                  and key.endswith('.csv')]),
+                                  workers, num_rows, load_mode, profile_dir)
+        delete_csv_files("lmnh_hist_data", f"{folder_path}/")
+    failed_tasks = [result for result in results if result.error is not None]
+    if failed_tasks:
+        log_failed_tasks(failed_tasks)
+        return False
+    return True
+
+
+def log_failed_downloads(failed: list[str]):
+    """Log the keys that failed to download, as the load stops rather than run on partial data"""
+    logging.error('Not loading, %s objects failed to download: %s',
+                  len(failed), ', '.join(sorted(failed)))
+
+
+def log_failed_tasks(failed: list[IngestResult]):
+    """Log the tasks that failed to load, so the run exits with an error"""
+    logging.error('%s tasks failed to load: %s', len(failed),
+                  ', '.join(f'{result.task.key} from byte {result.task.start}'
+                            for result in failed))
 
 
 def main():
     """Run the pipeline using the associated functions"""
 
-    (arg_bucket, arg_num_rows,
-     arg_log_to_file) = argparse_is_my_friend()
+    (arg_bucket, arg_num_rows, arg_log_to_file,
+     arg_load_mode, arg_incremental, arg_source,
+     arg_cache, arg_metrics_file, arg_workers, arg_profile) = argparse_is_my_friend()
 
     if arg_log_to_file:
         log_to_file()
 
-    load_dotenv()
+    if arg_metrics_file:
+        atexit.register(start_metrics_dump(arg_metrics_file))
 
-    bucket = arg_bucket if arg_bucket else environ["MUSEUM_BUCKET"]
+    if arg_profile:
+        atexit.register(start_profiler(arg_profile).stop)
 
-    s3 = get_s3_client()
+    pool = ConnectionPool(size=1)
 
-    download_specific_files(
-        s3, bucket, 'lmnh', 'museum_files')
+    if arg_cache == 'read':
+        # pyarrow is only loaded when the parquet cache is used
+        from cache import CACHE_DIR, stream_kiosk_cache  # pylint: disable=import-outside-toplevel
+        load_kiosk_stream(pool, stream_kiosk_cache(CACHE_DIR),
+                          arg_num_rows, arg_load_mode)
+        pool.close()
+        return
 
-    merge_csv_to_file("lmnh_hist_data", "museum_files/")
+    load_dotenv()
 
-    delete_csv_files("lmnh_hist_data", "museum_files/")
+    bucket = arg_bucket if arg_bucket else environ["MUSEUM_BUCKET"]
 
-    conn = get_db_connection()
-    kiosk_data = load_kiosk_data("museum_files")
-    rating_instances = get_rating_instances(kiosk_data)
-    formatted_rating_instances = format_rating_instances(rating_instances)
-    upload_rating_instances(conn, formatted_rating_instances, arg_num_rows)
-    support_instances = get_support_instances(kiosk_data)
-    formatted_support_instances = format_support_instances(support_instances)
-    upload_support_instances(conn, formatted_support_instances, arg_num_rows)
+    s3 = get_s3_client()
 
-    conn.close()
+    if arg_workers and not arg_cache and arg_source != 'merged':
+        # the worker processes open their own connections
+        pool.close()
+        if not load_parallel(s3, bucket, arg_workers, arg_num_rows,
+                             arg_load_mode, arg_incremental, arg_source,
+                             profile_dir=arg_profile):
+            sys.exit(1)
+        return
+
+    if arg_incremental:
+        load_incremental(s3, pool, bucket, arg_num_rows, arg_load_mode)
+        pool.close()
+        return
+
+    if arg_source == 's3':
+        keys = [o["Key"] for o in list_bucket_objects(s3, bucket, 'lmnh_hist_data')
+                if o["Key"].endswith('.csv')]
+        kiosk_chunks = stream_s3_csv_objects(s3, bucket, keys)
+    elif arg_source == 'merged':
+        with timed('download'):
+            _, failed = download_specific_files(
+                s3, bucket, 'lmnh', 'museum_files')
+        if failed:
+            log_failed_downloads(failed)
+            pool.close()
+            sys.exit(1)
+
+        with timed('merge'):
+            merge_csv_to_file("lmnh_hist_data", "museum_files/")
+
+        delete_csv_files("lmnh_hist_data", "museum_files/")
+
+        kiosk_chunks = stream_kiosk_data("museum_files")
+    else:
+        with timed('download'):
+            keys, failed = download_specific_files(
+                s3, bucket, 'lmnh', 'museum_files')
+        if failed:
+            log_failed_downloads(failed)
+            pool.close()
+            sys.exit(1)
+        kiosk_chunks = stream_csv_files(
+            [f'museum_files/{key}' for key in keys
+             if key.startswith('lmnh_hist_data') and key.endswith('.csv')])
+
+    if arg_cache == 'write':
+        from cache import (  # pylint: disable=import-outside-toplevel
+            CACHE_DIR, stream_kiosk_cache, write_kiosk_cache)
+        with timed('cache_write'):
+            write_kiosk_cache(kiosk_chunks, CACHE_DIR)
+        kiosk_chunks = stream_kiosk_cache(CACHE_DIR)
+
+    load_kiosk_stream(pool, kiosk_chunks, arg_num_rows, arg_load_mode)
+
+    pool.close()
+
+    if arg_source == 'files':
+        delete_csv_files("lmnh_hist_data", "museum_files/")
 
 
 if __name__ == "__main__":
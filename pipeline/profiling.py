@@ -0,0 +1,181 @@
+"""
+Museum pipeline profiling
+Sample the stacks of every thread into collapsed stacks that flame graph tools read,
+each rooted at its thread and the stage the thread was timing, and dump tracemalloc
+snapshots as stages end and periodically, which can be diffed between runs with
+compare_snapshots. Stages are the ones timed with metrics.timed.
+"""
+
+from collections import Counter
+import logging
+from os import makedirs, path, replace
+import sys
+from threading import Event, Lock, Thread, enumerate as enumerate_threads, get_ident
+from time import monotonic
+import tracemalloc
+
+SAMPLE_INTERVAL = 0.005
+SNAPSHOT_INTERVAL = 60.0
+TRACEMALLOC_FRAMES = 5
+COLLAPSED_FILE = 'cpu.collapsed'
+
+active_profiler = None
+
+
+def get_frame_name(frame) -> str:
+    """Name a stack frame by its function, file and first line"""
+    code = frame.f_code
+    return f'{code.co_name} ({path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+def collapse_stack(frame, root: tuple[str, ...] = ()) -> str:
+    """Collapse a stack into semicolon separated frame names, outermost first"""
+    names = []
+    while frame is not None:
+        names.append(get_frame_name(frame))
+        frame = frame.f_back
+    return ';'.join(root + tuple(reversed(names)))
+
+
+def compare_snapshots(old_path: str, new_path: str, limit: int = 10) -> list[str]:
+    """Get the lines allocating the most more memory in a newer tracemalloc snapshot"""
+    old = tracemalloc.Snapshot.load(old_path)
+    new = tracemalloc.Snapshot.load(new_path)
+    return [str(stat) for stat in new.compare_to(old, 'lineno')[:limit]]
+
+
+class Profiler:
+    """
+    Sample thread stacks every interval seconds and take tracemalloc snapshots,
+    written to output_dir. A stage snapshot is dumped the first time each stage
+    ends and then at most once per snapshot_interval, and a periodic snapshot and
+    the collapsed stacks so far are dumped every snapshot_interval, so long-running
+    consumers can be profiled while they run.
+    """
+
+    def __init__(self, output_dir: str, interval: float = SAMPLE_INTERVAL,
+                 snapshot_interval: float = SNAPSHOT_INTERVAL, clock=monotonic):
+        self.output_dir = output_dir
+        self.interval = interval
+        self.snapshot_interval = snapshot_interval
+        self.clock = clock
+        self.samples = Counter()
+        self.stages = {}
+        self.snapshot_times = {}
+        self.snapshot_counts = Counter()
+        self.lock = Lock()
+        self.stop_event = Event()
+        self.thread = None
+        self.tracing = False
+
+    def start(self) -> 'Profiler':
+        """Start tracing allocations and sampling stacks, making this the active profiler"""
+        global active_profiler  # pylint: disable=global-statement
+        makedirs(self.output_dir, exist_ok=True)
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            self.tracing = True
+        self.thread = Thread(target=self.run, name='profiler', daemon=True)
+        self.thread.start()
+        active_profiler = self
+        logging.info('Profiling to %s.', self.output_dir)
+        return self
+
+    def stop(self):
+        """Stop sampling and write the collapsed stacks and a final snapshot"""
+        global active_profiler  # pylint: disable=global-statement
+        if active_profiler is self:
+            active_profiler = None
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.dump_snapshot('final')
+        self.write_collapsed()
+        if self.tracing:
+            tracemalloc.stop()
+        logging.info('Wrote %s stack samples to %s.', sum(self.samples.values()), self.output_dir)
+
+    def __enter__(self) -> 'Profiler':
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def sample(self):
+        """Count the current stack of every thread other than the sampler"""
+        sampler = get_ident()
+        names = {thread.ident: thread.name for thread in enumerate_threads()}
+        for ident, frame in sys._current_frames().items():  # pylint: disable=protected-access
+            if ident == sampler:
+                continue
+            root = (names.get(ident, str(ident)), f'[{self.stages.get(ident, "none")}]')
+            self.samples[collapse_stack(frame, root)] += 1
+
+    def run(self):
+        """Sample stacks until stopped, dumping the progress so far every snapshot_interval"""
+        last_dump = self.clock()
+        while not self.stop_event.wait(self.interval):
+            self.sample()
+            if self.clock() - last_dump >= self.snapshot_interval:
+                self.dump_snapshot('periodic')
+                self.write_collapsed()
+                last_dump = self.clock()
+
+    def enter_stage(self, stage: str) -> str | None:
+        """Record the stage the current thread is in, returning the stage it was in"""
+        ident = get_ident()
+        previous = self.stages.get(ident)
+        self.stages[ident] = stage
+        return previous
+
+    def exit_stage(self, stage: str, previous: str | None):
+        """Return the current thread to its previous stage, snapshotting the ended stage if due"""
+        ident = get_ident()
+        if previous is None:
+            self.stages.pop(ident, None)
+        else:
+            self.stages[ident] = previous
+        with self.lock:
+            last = self.snapshot_times.get(stage)
+            due = last is None or self.clock() - last >= self.snapshot_interval
+            if due:
+                self.snapshot_times[stage] = self.clock()
+        if due:
+            self.dump_snapshot(stage)
+
+    def dump_snapshot(self, name: str) -> str | None:
+        """Dump a numbered tracemalloc snapshot, returning its path"""
+        if not tracemalloc.is_tracing():
+            return None
+        with self.lock:
+            self.snapshot_counts[name] += 1
+            number = self.snapshot_counts[name]
+        file_path = path.join(self.output_dir, f'{name}_{number}.tracemalloc')
+        tracemalloc.take_snapshot().dump(file_path)
+        return file_path
+
+    def write_collapsed(self):
+        """Write the stack samples so far in the collapsed format, replacing the last write"""
+        file_path = path.join(self.output_dir, COLLAPSED_FILE)
+        with open(file_path + '.tmp', 'w', encoding='utf-8') as file:
+            for stack, count in list(self.samples.items()):
+                file.write(f'{stack} {count}\n')
+        replace(file_path + '.tmp', file_path)
+
+
+def start_profiler(output_dir: str, snapshot_interval: float = SNAPSHOT_INTERVAL) -> Profiler:
+    """Start profiling the process to a directory"""
+    return Profiler(output_dir, snapshot_interval=snapshot_interval).start()
+
+
+def enter_stage(stage: str) -> str | None:
+    """Record the stage the current thread is in with the active profiler, if any"""
+    if active_profiler is None:
+        return None
+    return active_profiler.enter_stage(stage)
+
+
+def exit_stage(stage: str, previous: str | None):
+    """Leave a stage entered with enter_stage"""
+    if active_profiler is not None:
+        active_profiler.exit_stage(stage, previous)
@@ -0,0 +1,124 @@
+"""
+Museum dead letter replay
+Re-validate dead letters after a cleaning rule fix, ingesting the ones that
+now pass and keeping the ones that are still rejected. A replayed file is
+rotated once its replay completes, so running the replay again skips it.
+"""
+from os import environ as ENV
+import argparse
+import logging
+
+from dotenv import load_dotenv
+
+from cleaning import validate_message
+from consume import format_instance_row, get_consumer, get_source_id, upload_buffered
+from database import RATING_TABLE, SUPPORT_TABLE, ConnectionPool
+from dimensions import DimensionCache
+from dead_letter import (DEAD_LETTER_FILE,
+                         FileDeadLetterSink,
+                         read_dead_letter_file,
+                         read_dead_letter_topic,
+                         rotate_dead_letter_file)
+
+REJECTED_FILE = "dead_letters_rejected.jsonl"
+
+
+def argparse_is_my_friend():
+    """Set up argparse to pass arguments automatically in command line"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--source", "-s", choices=['file', 'kafka'], default='file',
+                        help="replay dead letters from a local file or the DEAD_LETTER_TOPIC topic")
+    parser.add_argument("--dead_letter_path", "-dlp", default=DEAD_LETTER_FILE,
+                        help="dead letter file to replay with the file source")
+    parser.add_argument("--rejected_path", "-rp", default=REJECTED_FILE,
+                        help="file that dead letters still rejected are appended to")
+    parser.add_argument("--batch_size", "-bs", type=int, default=500,
+                        help="number of valid dead letters uploaded together")
+
+    args = vars(parser.parse_args())
+    return (args.get('source'), args.get('dead_letter_path'),
+            args.get('rejected_path'), args.get('batch_size'))
+
+
+def replay_dead_letters(pool: ConnectionPool, dead_letters, rejected,
+                        batch_size: int = 500, consumer=None,
+                        dimensions: DimensionCache | None = None) -> tuple[int, int, bool]:
+    """
+    Re-validate dead letters, uploading the valid ones in batches and writing
+    the rest to the rejected sink with their new reason, including kiosk codes
+    still unknown to the dimension cache. When replaying from a
+    topic, its offsets are committed after each upload. Returns the number of
+    dead letters replayed and still rejected, and whether every upload succeeded,
+    stopping early on a failed upload.
+    """
+    batches = {RATING_TABLE: [], SUPPORT_TABLE: []}
+    replayed, still_rejected, buffered, pending = 0, 0, 0, 0
+    dimensions = dimensions or DimensionCache()
+    dimensions.refresh_if_stale(pool)
+
+    def upload() -> bool:
+        nonlocal replayed, buffered, pending
+        if buffered and not upload_buffered(pool, batches):
+            logging.error('Stopping replay, dead letters not committed.')
+            return False
+        replayed += buffered
+        buffered = 0
+        rejected.flush()
+        if consumer and pending:
+            consumer.commit(asynchronous=False)
+        pending = 0
+        return True
+
+    for dead_letter in dead_letters:
+        pending += 1
+        event, reason = validate_message(dead_letter.value)
+        instance = None
+        if event is not None:
+            # the original message position keeps a replayed dead letter from loading twice
+            instance, reason = format_instance_row(
+                event, dimensions, get_source_id(dead_letter.topic, dead_letter.partition,
+                                                 dead_letter.offset))
+        if instance is None:
+            rejected.write(dead_letter._replace(reason=reason))
+            still_rejected += 1
+            continue
+        table, row = instance
+        batches[table].append(row)
+        buffered += 1
+        if buffered >= batch_size and not upload():
+            return replayed, still_rejected, False
+
+    completed = upload()
+    logging.info('Replayed %s dead letters, %s still rejected.',
+                 replayed, still_rejected)
+    return replayed, still_rejected, completed
+
+
+def main():
+    """Replay dead letters using the associated functions"""
+
+    source, dead_letter_path, rejected_path, batch_size = argparse_is_my_friend()
+
+    load_dotenv()
+
+    pool = ConnectionPool(size=1)
+    rejected = FileDeadLetterSink(rejected_path)
+
+    if source == 'kafka':
+        consumer = get_consumer(ENV["DEAD_LETTER_TOPIC"], f'{ENV["GROUP"]}-replay')
+        replay_dead_letters(pool, read_dead_letter_topic(consumer), rejected,
+                            batch_size, consumer)
+        consumer.close()
+    else:
+        completed = replay_dead_letters(pool, read_dead_letter_file(dead_letter_path),
+                                        rejected, batch_size)[2]
+        if completed:
+            rotate_dead_letter_file(dead_letter_path)
+
+    rejected.close()
+    pool.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
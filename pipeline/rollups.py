@@ -0,0 +1,106 @@
+"""
+Museum rollup queries
+Answer the analysis and dashboard questions from the hourly rollup tables,
+so their cost depends on the number of hours and exhibitions, not instances
+"""
+
+from datetime import datetime
+
+from database import get_cursor
+
+MOST_VISITED_QUERY = """
+    SELECT e.exhibition_id, e.exhibition_name, SUM(r.rating_count) AS instance_count
+    FROM exhibition AS e
+    JOIN rating_hourly_rollup AS r
+        ON r.exhibition_id = e.exhibition_id
+    WHERE r.hour_start >= %(start)s AND r.hour_start < %(end)s
+    GROUP BY e.exhibition_id, e.exhibition_name
+    ORDER BY instance_count DESC
+    ;
+    """
+RATINGS_PER_HOUR_QUERY = """
+    SELECT EXTRACT(HOUR FROM r.hour_start) AS hour, SUM(r.rating_count) AS num_ratings
+    FROM rating_hourly_rollup AS r
+    WHERE r.hour_start >= %(start)s AND r.hour_start < %(end)s
+    GROUP BY hour
+    ORDER BY num_ratings DESC
+    ;
+    """
+AVERAGE_RATING_QUERY = """
+    SELECT e.exhibition_id, e.exhibition_name,
+        ROUND(SUM(rt.rating_type_value * r.rating_count)::NUMERIC
+              / SUM(r.rating_count), 2) AS average_rating
+    FROM exhibition AS e
+    JOIN rating_hourly_rollup AS r
+        ON r.exhibition_id = e.exhibition_id
+    JOIN rating_type AS rt
+        ON rt.rating_type_id = r.rating_type_id
+    WHERE r.hour_start >= %(start)s AND r.hour_start < %(end)s
+    GROUP BY e.exhibition_id, e.exhibition_name
+    ORDER BY e.exhibition_id
+    ;
+    """
+EMERGENCIES_QUERY = """
+    SELECT e.exhibition_id, e.exhibition_name,
+        SUM(CASE WHEN st.support_description = 'Emergency'
+            THEN s.support_count ELSE 0 END) AS emergency_count
+    FROM exhibition AS e
+    JOIN support_hourly_rollup AS s
+        ON s.exhibition_id = e.exhibition_id
+    JOIN support_type AS st
+        ON st.support_type_id = s.support_type_id
+    WHERE s.hour_start >= %(start)s AND s.hour_start < %(end)s
+    GROUP BY e.exhibition_id, e.exhibition_name
+    ORDER BY emergency_count DESC
+    ;
+    """
+SUPPORT_PER_HOUR_QUERY = """
+    SELECT EXTRACT(HOUR FROM s.hour_start) AS hour, st.support_description,
+        SUM(s.support_count) AS num_requests
+    FROM support_hourly_rollup AS s
+    JOIN support_type AS st
+        ON st.support_type_id = s.support_type_id
+    WHERE s.hour_start >= %(start)s AND s.hour_start < %(end)s
+    GROUP BY hour, st.support_description
+    ORDER BY num_requests DESC
+    ;
+    """
+
+
+def run_rollup_query(conn, sql_query: str, start: datetime | None = None,
+                     end: datetime | None = None) -> list[dict]:
+    """Run a rollup query over the hours from start up to end, defaulting to all hours"""
+    with get_cursor(conn) as curr:
+        curr.execute(sql_query, {'start': start or datetime.min,
+                                 'end': end or datetime.max})
+        return curr.fetchall()
+
+
+def get_most_visited_exhibitions(conn, start: datetime | None = None,
+                                 end: datetime | None = None) -> list[dict]:
+    """Get each exhibition's number of ratings, most visited first"""
+    return run_rollup_query(conn, MOST_VISITED_QUERY, start, end)
+
+
+def get_ratings_per_hour(conn, start: datetime | None = None,
+                         end: datetime | None = None) -> list[dict]:
+    """Get the number of ratings given in each hour of the day, busiest first"""
+    return run_rollup_query(conn, RATINGS_PER_HOUR_QUERY, start, end)
+
+
+def get_average_ratings(conn, start: datetime | None = None,
+                        end: datetime | None = None) -> list[dict]:
+    """Get the average rating value of each exhibition"""
+    return run_rollup_query(conn, AVERAGE_RATING_QUERY, start, end)
+
+
+def get_emergencies_per_exhibition(conn, start: datetime | None = None,
+                                   end: datetime | None = None) -> list[dict]:
+    """Get each exhibition's number of emergencies, most emergencies first"""
+    return run_rollup_query(conn, EMERGENCIES_QUERY, start, end)
+
+
+def get_support_per_hour(conn, start: datetime | None = None,
+                         end: datetime | None = None) -> list[dict]:
+    """Get the number of each type of support request in each hour of the day"""
+    return run_rollup_query(conn, SUPPORT_PER_HOUR_QUERY, start, end)
@@ -0,0 +1,155 @@
+"""
+Museum consume runner
+Run several consume workers in one Kafka consumer group, restarting
+crashed workers and reporting their throughput and lag
+"""
+import argparse
+import logging
+from multiprocessing import Array, Event, Process, cpu_count
+import signal
+import sys
+from time import monotonic, sleep
+
+from consume import (LAG_INTERVAL,
+                     LOG_LEVELS,
+                     consume_batches,
+                     get_consumer,
+                     get_partition_lag,
+                     log_to_queue)
+from database import ConnectionPool
+from dead_letter import DEAD_LETTER_SINKS, get_dead_letter_sink
+
+RESTART_DELAY = 5
+SHUTDOWN_TIMEOUT = 30
+
+
+def argparse_is_my_friend():
+    """Set up argparse to pass arguments automatically in command line"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", "-w", type=int, default=cpu_count(),
+                        help="number of consume worker processes")
+    parser.add_argument("--batch_size", "-bs", type=int, default=500,
+                        help="number of messages buffered before a batched upload")
+    parser.add_argument("--max_delay", "-md", type=float, default=1.0,
+                        help="maximum seconds a buffered message waits before upload")
+    parser.add_argument("--report_interval", "-ri", type=float, default=30.0,
+                        help="seconds between worker throughput and lag reports")
+    parser.add_argument("--dead_letter", "-dl", choices=DEAD_LETTER_SINKS, default='file',
+                        help="send rejected messages to per-worker files or the DEAD_LETTER_TOPIC topic")
+    parser.add_argument("--log_level", "-ll", choices=LOG_LEVELS, default='INFO',
+                        help="lowest level logged by the supervisor and workers")
+
+    args = vars(parser.parse_args())
+    return (args.get('workers'), args.get('batch_size'), args.get('max_delay'),
+            args.get('report_interval'), args.get('dead_letter'), args.get('log_level'))
+
+
+def get_consumer_lag(consumer) -> int:
+    """Sum the number of unread messages over a consumer's assigned partitions"""
+    return sum(get_partition_lag(consumer, cached=False).values())
+
+
+def run_worker(worker_id: int, stop_event, stats, batch_size: int, max_delay: float,
+               dead_letter: str = 'file'):
+    """Consume batches with a dedicated consumer and database connection"""
+    # the supervisor handles signals and stops workers through stop_event
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    # the supervisor's log queue listener does not run in this process
+    listener = log_to_queue(logging.getLogger().getEffectiveLevel())
+
+    pool = ConnectionPool(size=1)
+    consumer = get_consumer()
+    dead_letters = get_dead_letter_sink(dead_letter, f"dead_letters_{worker_id}.jsonl")
+    last_lag_check = 0.0
+
+    def report(consumer, num_messages: int):
+        nonlocal last_lag_check
+        with stats.get_lock():
+            stats[2 * worker_id] += num_messages
+        if monotonic() - last_lag_check >= LAG_INTERVAL:
+            stats[2 * worker_id + 1] = get_consumer_lag(consumer)
+            last_lag_check = monotonic()
+
+    succeeded = consume_batches(pool, consumer, batch_size, max_delay,
+                                stop_event, report, dead_letters=dead_letters)
+    dead_letters.close()
+    pool.close()
+    listener.stop()
+    if not succeeded:
+        sys.exit(1)
+
+
+def start_worker(worker_id: int, stop_event, stats, batch_size: int,
+                 max_delay: float, dead_letter: str = 'file') -> Process:
+    """Start a consume worker process"""
+    worker = Process(target=run_worker, name=f"consume-worker-{worker_id}",
+                     args=(worker_id, stop_event, stats, batch_size, max_delay,
+                           dead_letter))
+    worker.start()
+    logging.info('Started %s (pid %s).', worker.name, worker.pid)
+    return worker
+
+
+def report_workers(stats, previous: list[int], elapsed: float) -> list[int]:
+    """Log each worker's throughput since the last report and its latest lag"""
+    totals = [stats[2 * i] for i in range(len(previous))]
+    for i, total in enumerate(totals):
+        logging.info('consume-worker-%s: %.1f msg/s, %s total, lag %s.',
+                     i, (total - previous[i]) / elapsed, total, stats[2 * i + 1])
+    return totals
+
+
+def supervise(num_workers: int, batch_size: int, max_delay: float,
+              report_interval: float, dead_letter: str = 'file'):
+    """Run consume workers until SIGTERM or SIGINT, restarting any that crash"""
+    stop_event = Event()
+    stats = Array('q', 2 * num_workers)
+
+    def request_stop(signum, frame):
+        logging.info('Received signal %s, stopping workers.', signum)
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    workers = [start_worker(i, stop_event, stats, batch_size, max_delay, dead_letter)
+               for i in range(num_workers)]
+    totals = [0] * num_workers
+    last_report = monotonic()
+
+    while not stop_event.is_set():
+        sleep(1)
+        for i, worker in enumerate(workers):
+            if not worker.is_alive() and not stop_event.is_set():
+                logging.error('%s exited with code %s, restarting.',
+                              worker.name, worker.exitcode)
+                sleep(RESTART_DELAY)
+                workers[i] = start_worker(i, stop_event, stats,
+                                          batch_size, max_delay, dead_letter)
+
+        if monotonic() - last_report >= report_interval:
+            totals = report_workers(stats, totals, monotonic() - last_report)
+            last_report = monotonic()
+
+    for worker in workers:
+        worker.join(SHUTDOWN_TIMEOUT)
+        if worker.is_alive():
+            logging.error('%s did not stop in time, terminating.', worker.name)
+            worker.terminate()
+    logging.info('All consume workers stopped.')
+
+
+def main():
+    """Run the consume workers using the associated functions"""
+
+    (num_workers, batch_size, max_delay,
+     report_interval, dead_letter, log_level) = argparse_is_my_friend()
+
+    listener = log_to_queue(log_level)
+    supervise(num_workers, batch_size, max_delay, report_interval, dead_letter)
+    listener.stop()
+
+
+if __name__ == "__main__":
+    main()
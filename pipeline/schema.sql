@@ -1,11 +1,13 @@
 -- This file should contain all code required to create & seed database tables.
 
+DROP TABLE IF EXISTS rating_hourly_rollup;
+DROP TABLE IF EXISTS support_hourly_rollup;
+DROP TABLE IF EXISTS rating_instance;
+DROP TABLE IF EXISTS support_instance;
 DROP TABLE IF EXISTS exhibition;
 DROP TABLE IF EXISTS floor;
 DROP TABLE IF EXISTS department;
-DROP TABLE IF EXISTS rating_instance;
 DROP TABLE IF EXISTS rating_type;
-DROP TABLE IF EXISTS support_instance;
 DROP TABLE IF EXISTS support_type;
 
 CREATE TABLE IF NOT EXISTS floor (
@@ -25,6 +27,8 @@ CREATE TABLE IF NOT EXISTS exhibition (
     exhibition_name VARCHAR(30) UNIQUE NOT NULL,
     exhibition_start_date TIMESTAMPTZ NOT NULL,
     exhibition_description VARCHAR(150),
+    -- the 'site' code sent by the exhibition's kiosks
+    site_code SMALLINT UNIQUE,
     floor_id SMALLINT NOT NULL,
        FOREIGN KEY (floor_id) REFERENCES floor(floor_id)
        ON DELETE CASCADE,
@@ -42,7 +46,7 @@ CREATE TABLE IF NOT EXISTS rating_type (
 );
 
 CREATE TABLE IF NOT EXISTS rating_instance (
-    rating_instance_id SMALLINT GENERATED ALWAYS AS IDENTITY,
+    rating_instance_id BIGINT GENERATED ALWAYS AS IDENTITY,
     exhibition_id SMALLINT NOT NULL,
         FOREIGN KEY (exhibition_id) REFERENCES exhibition(exhibition_id)
         ON DELETE CASCADE,
@@ -50,8 +54,19 @@ CREATE TABLE IF NOT EXISTS rating_instance (
         FOREIGN KEY (rating_type_id) REFERENCES rating_type(rating_type_id)
         ON DELETE CASCADE,
     rating_created_at TIMESTAMPTZ NOT NULL,
-    PRIMARY KEY (rating_instance_id)
-);
+    -- where the row was read from, so a reloaded row is skipped; NULL never conflicts
+    source_id TEXT,
+    PRIMARY KEY (rating_instance_id, rating_created_at),
+    CONSTRAINT rating_instance_source_key
+        UNIQUE (source_id, rating_created_at)
+) PARTITION BY RANGE (rating_created_at);
+
+CREATE TABLE IF NOT EXISTS rating_instance_default
+    PARTITION OF rating_instance DEFAULT;
+
+CREATE INDEX IF NOT EXISTS rating_instance_exhibition_created_idx
+    ON rating_instance (exhibition_id, rating_created_at)
+    INCLUDE (rating_type_id);
 
 CREATE TABLE IF NOT EXISTS support_type (
     support_type_id SMALLINT GENERATED ALWAYS AS IDENTITY,
@@ -61,7 +76,7 @@ CREATE TABLE IF NOT EXISTS support_type (
 );
 
 CREATE TABLE IF NOT EXISTS support_instance (
-    support_instance_id SMALLINT GENERATED ALWAYS AS IDENTITY,
+    support_instance_id BIGINT GENERATED ALWAYS AS IDENTITY,
     instance_created_at TIMESTAMPTZ NOT NULL,
     support_type_id SMALLINT NOT NULL,
         FOREIGN KEY (support_type_id) REFERENCES support_type(support_type_id)
@@ -69,9 +84,69 @@ CREATE TABLE IF NOT EXISTS support_instance (
     exhibition_id SMALLINT NOT NULL,
         FOREIGN KEY (exhibition_id) REFERENCES exhibition(exhibition_id)
         ON DELETE CASCADE,
-    PRIMARY KEY (support_instance_id)
+    -- where the row was read from, so a reloaded row is skipped; NULL never conflicts
+    source_id TEXT,
+    PRIMARY KEY (support_instance_id, instance_created_at),
+    CONSTRAINT support_instance_source_key
+        UNIQUE (source_id, instance_created_at)
+) PARTITION BY RANGE (instance_created_at);
+
+CREATE TABLE IF NOT EXISTS support_instance_default
+    PARTITION OF support_instance DEFAULT;
+
+CREATE INDEX IF NOT EXISTS support_instance_exhibition_created_idx
+    ON support_instance (exhibition_id, instance_created_at)
+    INCLUDE (support_type_id);
+
+-- Hourly per-exhibition counts, kept up to date by the same statements that
+-- insert instances, so dashboard queries do not scan the instance tables.
+CREATE TABLE IF NOT EXISTS rating_hourly_rollup (
+    exhibition_id SMALLINT NOT NULL,
+        FOREIGN KEY (exhibition_id) REFERENCES exhibition(exhibition_id)
+        ON DELETE CASCADE,
+    hour_start TIMESTAMPTZ NOT NULL,
+    rating_type_id SMALLINT NOT NULL,
+        FOREIGN KEY (rating_type_id) REFERENCES rating_type(rating_type_id)
+        ON DELETE CASCADE,
+    rating_count BIGINT NOT NULL,
+    PRIMARY KEY (exhibition_id, hour_start, rating_type_id)
+);
+
+CREATE TABLE IF NOT EXISTS support_hourly_rollup (
+    exhibition_id SMALLINT NOT NULL,
+        FOREIGN KEY (exhibition_id) REFERENCES exhibition(exhibition_id)
+        ON DELETE CASCADE,
+    hour_start TIMESTAMPTZ NOT NULL,
+    support_type_id SMALLINT NOT NULL,
+        FOREIGN KEY (support_type_id) REFERENCES support_type(support_type_id)
+        ON DELETE CASCADE,
+    support_count BIGINT NOT NULL,
+    PRIMARY KEY (exhibition_id, hour_start, support_type_id)
 );
 
+-- Creates the monthly partition of an instance table holding month_start (UTC),
+-- moving across any rows that already landed in the default partition.
+CREATE OR REPLACE FUNCTION ensure_monthly_partition(parent TEXT, time_column TEXT, month_start DATE)
+RETURNS VOID AS $$
+DECLARE
+    partition_name TEXT := format('%s_%s', parent, to_char(month_start, 'YYYY_MM'));
+    range_start TIMESTAMPTZ := month_start::TIMESTAMP AT TIME ZONE 'UTC';
+    range_end TIMESTAMPTZ := (month_start + INTERVAL '1 month')::TIMESTAMP AT TIME ZONE 'UTC';
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext(partition_name));
+    IF to_regclass(partition_name) IS NOT NULL THEN
+        RETURN;
+    END IF;
+    EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS)', partition_name, parent);
+    EXECUTE format('WITH moved AS (DELETE FROM %I WHERE %I >= %L AND %I < %L RETURNING *) '
+                   'INSERT INTO %I SELECT * FROM moved',
+                   parent || '_default', time_column, range_start, time_column, range_end,
+                   partition_name);
+    EXECUTE format('ALTER TABLE %I ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                   parent, partition_name, range_start, range_end);
+END;
+$$ LANGUAGE plpgsql;
+
 INSERT INTO floor
         (floor)
     VALUES
@@ -92,14 +167,14 @@ INSERT INTO department
 ;
 
 INSERT INTO exhibition
-        (exhibition_name, exhibition_start_date, exhibition_description, floor_id, department_id)
+        (exhibition_name, exhibition_start_date, exhibition_description, site_code, floor_id, department_id)
     VALUES
-        ('Measureless to Man', '2021-08-23 00:00:00', 'An immersive 3D experience: delve deep into a previously-inaccessible cave system.', 2, 1),
-        ('Adaptation', '2019-07-01 00:00:00', 'How insect evolution has kept pace with an industrialised world', 1, 2),
-        ('The Crenshaw Collection', '2021-03-03 00:00:00', 'An exhibition of 18th Century watercolours, mostly focused on South American wildlife.', 3, 3),
-        ('Cetacean Sensations', '2019-07-01 00:00:00', 'Whales: from ancient myth to critically endangered.', 2, 3),
-        ('Our Polluted World', '2021-05-12 00:00:00', 'A hard-hitting exploration of humanity''s impact on the environment.', 4, 4),
-        ('Thunder Lizards',  '2023-02-01 00:00:00', 'How new research is making scientists rethink what dinosaurs really looked like.', 2, 5)
+        ('Measureless to Man', '2021-08-23 00:00:00', 'An immersive 3D experience: delve deep into a previously-inaccessible cave system.', 0, 2, 1),
+        ('Adaptation', '2019-07-01 00:00:00', 'How insect evolution has kept pace with an industrialised world', 1, 1, 2),
+        ('The Crenshaw Collection', '2021-03-03 00:00:00', 'An exhibition of 18th Century watercolours, mostly focused on South American wildlife.', 2, 3, 3),
+        ('Cetacean Sensations', '2019-07-01 00:00:00', 'Whales: from ancient myth to critically endangered.', 3, 2, 3),
+        ('Our Polluted World', '2021-05-12 00:00:00', 'A hard-hitting exploration of humanity''s impact on the environment.', 4, 4, 4),
+        ('Thunder Lizards',  '2023-02-01 00:00:00', 'How new research is making scientists rethink what dinosaurs really looked like.', 5, 2, 5)
 ;
 
 INSERT INTO rating_type
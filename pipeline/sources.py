@@ -0,0 +1,214 @@
+"""
+Museum message sources
+Feed the consume loops from a live Kafka consumer or from a recorded file of kiosk
+messages, replayed at wall-clock pace, N times faster or as fast as possible.
+A source provides the consumer methods the loops use: poll, consume, commit and close.
+"""
+
+from datetime import datetime
+import json
+import logging
+import mmap
+from os import path
+from struct import Struct
+from time import monotonic, sleep
+
+REPLAY_FORMATS = ('ndjson', 'length_prefixed')
+LENGTH_PREFIX = Struct('>I')
+
+
+class FileMessage:
+    """A recorded kiosk message, shaped like a Kafka message with its index as offset"""
+
+    def __init__(self, raw: bytes, topic: str, offset: int):
+        self.raw = raw
+        self.source = topic
+        self.index = offset
+
+    def value(self) -> bytes:
+        """Get the raw payload"""
+        return self.raw
+
+    def error(self) -> None:
+        """Recorded messages never carry a Kafka error"""
+        return None
+
+    def topic(self) -> str:
+        """Get the file the message was read from"""
+        return self.source
+
+    def partition(self) -> int:
+        """Recorded files have a single partition"""
+        return 0
+
+    def offset(self) -> int:
+        """Get the index of the message in its file"""
+        return self.index
+
+
+def read_ndjson(reader):
+    """Yield the non-empty lines of a newline delimited file"""
+    while line := reader.readline():
+        line = line.strip()
+        if line:
+            yield line
+
+
+def read_length_prefixed(reader):
+    """Yield the payloads of a file of 4-byte big-endian lengths, each followed by its payload"""
+    while header := reader.read(LENGTH_PREFIX.size):
+        if len(header) < LENGTH_PREFIX.size:
+            logging.warning('Ignoring a truncated length prefix at the end of the file.')
+            return
+        (length,) = LENGTH_PREFIX.unpack(header)
+        payload = reader.read(length)
+        if len(payload) < length:
+            logging.warning('Ignoring a truncated message at the end of the file.')
+            return
+        yield payload
+
+
+def write_messages(file_path: str, values: list[bytes], replay_format: str = 'ndjson'):
+    """Record raw kiosk messages to a file that a FileSource can replay"""
+    with open(file_path, 'wb') as file:
+        for value in values:
+            if replay_format == 'length_prefixed':
+                file.write(LENGTH_PREFIX.pack(len(value)) + value)
+            else:
+                file.write(value.rstrip(b'\n') + b'\n')
+
+
+def get_event_seconds(raw: bytes) -> float | None:
+    """Get the time a recorded kiosk event happened, or None if it cannot be read"""
+    try:
+        return datetime.fromisoformat(json.loads(raw)['at']).timestamp()
+    except (ValueError, TypeError, KeyError):
+        return None
+
+
+class FileSource:
+    """
+    Replay recorded kiosk messages through the consume loops in place of a Kafka consumer.
+    A speed of 1 replays them at the pace their events happened, a speed of N
+    replays them N times faster and no speed replays them as fast as possible.
+    Once the file is exhausted the optional stop_event is set, so the loops finish.
+    """
+
+    def __init__(self, file_path: str, replay_format: str = 'ndjson',
+                 speed: float | None = None, use_mmap: bool = False, stop_event=None,
+                 clock=monotonic, wait=sleep):
+        self.file_path = file_path
+        self.speed = speed
+        self.stop_event = stop_event
+        self.clock = clock
+        self.wait = wait
+        self.file = open(file_path, 'rb')
+        self.mapped = None
+        if use_mmap and path.getsize(file_path):
+            self.mapped = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        reader = self.mapped or self.file
+        self.payloads = (read_length_prefixed(reader) if replay_format == 'length_prefixed'
+                         else read_ndjson(reader))
+        self.num_read = 0
+        self.committed = 0
+        self.pending = None
+        self.pending_due = None
+        self.start = None
+        self.exhausted = False
+
+    def next_message(self) -> FileMessage | None:
+        """Read the next message and when it is due, or None once the file is exhausted"""
+        if self.pending is None:
+            raw = next(self.payloads, None)
+            if raw is None:
+                self.exhausted = True
+                if self.stop_event is not None and not self.stop_event.is_set():
+                    logging.info('Replayed %s messages from %s.', self.num_read, self.file_path)
+                    self.stop_event.set()
+                return None
+            self.pending = FileMessage(raw, self.file_path, self.num_read)
+            self.num_read += 1
+            self.pending_due = self.get_due(raw)
+        return self.pending
+
+    def get_due(self, raw: bytes) -> float:
+        """Get the clock time a message is due at, pacing by its event time"""
+        if not self.speed:
+            return float('-inf')
+        now = self.clock()
+        seconds = get_event_seconds(raw)
+        if seconds is None:
+            return self.pending_due or now
+        if self.start is None:
+            self.start = (now, seconds)
+        started, first_seconds = self.start
+        return started + (seconds - first_seconds) / self.speed
+
+    def take(self, deadline: float) -> FileMessage | None:
+        """Take the next message if it is due by the deadline, waiting until it is due"""
+        msg = self.next_message()
+        if msg is None or self.pending_due > deadline:
+            return None
+        delay = self.pending_due - self.clock()
+        if delay > 0:
+            self.wait(delay)
+        self.pending = None
+        return msg
+
+    def wait_until(self, deadline: float):
+        """
+        Wait until a finite deadline, as an idle consumer would,
+        unless the file is exhausted and the loops are being stopped
+        """
+        if self.exhausted and self.stop_event is not None:
+            return
+        delay = deadline - self.clock()
+        if 0 < delay < float('inf'):
+            self.wait(delay)
+
+    def get_deadline(self, timeout: float | None) -> float:
+        """Get the clock time a poll with a timeout ends, which is never without one"""
+        return float('inf') if timeout is None else self.clock() + timeout
+
+    def poll(self, timeout: float | None = None) -> FileMessage | None:
+        """Get the next message once it is due, waiting at most timeout seconds"""
+        deadline = self.get_deadline(timeout)
+        msg = self.take(deadline)
+        if msg is None:
+            self.wait_until(deadline)
+        return msg
+
+    def consume(self, num_messages: int = 1, timeout: float | None = None) -> list[FileMessage]:
+        """Get up to num_messages messages due within timeout seconds, waiting out the timeout for fewer"""
+        deadline = self.get_deadline(timeout)
+        messages = []
+        while len(messages) < num_messages and (msg := self.take(deadline)) is not None:
+            messages.append(msg)
+        if len(messages) < num_messages:
+            self.wait_until(deadline)
+        return messages
+
+    def commit(self, message: FileMessage | None = None, offsets=None, asynchronous: bool = True):
+        """Record the offset after the given message, the given offsets or the last message read"""
+        if message is not None:
+            self.committed = message.offset() + 1
+        elif offsets:
+            self.committed = max(partition.offset for partition in offsets)
+        else:
+            self.committed = self.num_read - (self.pending is not None)
+
+    def assignment(self) -> list:
+        """Recorded files are not assigned partitions, so they report no lag"""
+        return []
+
+    def position(self, partitions: list) -> list:
+        """Get the positions of assigned partitions, of which there are none"""
+        return partitions
+
+    def close(self):
+        """Close the recorded file"""
+        if self.mapped is not None:
+            self.mapped.close()
+        self.file.close()
+        logging.info('Committed %s of %s messages from %s.',
+                     self.committed, self.num_read, self.file_path)
@@ -0,0 +1,83 @@
+"""Test functionality of aggregation python file"""
+
+from datetime import datetime, timezone
+import json
+from urllib.request import urlopen
+
+from aggregation import RollingAggregator
+from cleaning import KioskEvent
+from endpoints import start_endpoint_server
+
+NOW = datetime(2023, 6, 1, 12, 0, tzinfo=timezone.utc).timestamp()
+
+
+def event_at(seconds_ago: int, site: int, val: int, type: int | None = None):
+    """Build a kiosk event the given number of seconds before NOW"""
+    at = datetime.fromtimestamp(NOW - seconds_ago, timezone.utc)
+    return KioskEvent(at.isoformat(timespec="microseconds"), site, val, type)
+
+
+def test_snapshot_counts_ratings_per_window():
+    """Ratings are counted and averaged within each rolling window"""
+    aggregator = RollingAggregator(clock=lambda: NOW)
+    aggregator.add(event_at(10, 2, 4))
+    aggregator.add(event_at(20, 2, 2))
+    aggregator.add(event_at(1000, 2, 0))
+
+    windows = aggregator.snapshot()["exhibitions"][2]["windows"]
+
+    assert windows["5m"]["ratings"] == 2
+    assert windows["5m"]["average_rating"] == 3.0
+    assert windows["60m"]["ratings"] == 3
+    assert windows["60m"]["rating_counts"] == [1, 0, 1, 0, 1]
+
+
+def test_snapshot_counts_emergencies():
+    """Support requests are split into assistance and emergencies"""
+    aggregator = RollingAggregator(clock=lambda: NOW)
+    aggregator.add(event_at(5, 4, -1, 1))
+    aggregator.add(event_at(5, 4, -1, 0))
+    aggregator.add(event_at(5, 4, -1, 1))
+
+    window = aggregator.snapshot()["exhibitions"][4]["windows"]["5m"]
+
+    assert window["emergencies"] == 2
+    assert window["assistance"] == 1
+    assert window["average_rating"] is None
+
+
+def test_old_slots_are_reused():
+    """Counts older than the window expire as their slots are reused"""
+    clock = [NOW]
+    aggregator = RollingAggregator(window_seconds=60, clock=lambda: clock[0])
+    aggregator.add(event_at(0, 1, 3))
+    clock[0] = NOW + 60
+    aggregator.add(KioskEvent(
+        datetime.fromtimestamp(NOW + 60, timezone.utc).isoformat(), 1, 1, None))
+
+    assert aggregator.ratings[:, 1].sum() == 1
+    assert aggregator.snapshot()["exhibitions"][1]["windows"]["5m"]["ratings"] == 1
+
+
+def test_events_outside_window_are_ignored():
+    """Events older than the ring buffer are not counted"""
+    aggregator = RollingAggregator(window_seconds=60, clock=lambda: NOW)
+    aggregator.add(event_at(120, 0, 3))
+
+    assert aggregator.ratings.sum() == 0
+
+
+def test_snapshot_endpoint_serves_json():
+    """The snapshot is served as JSON from a local port"""
+    aggregator = RollingAggregator(clock=lambda: NOW)
+    aggregator.add(event_at(10, 0, 4))
+    server = start_endpoint_server({"/snapshot": aggregator.snapshot_route}, 0)
+    try:
+        port = server.server_address[1]
+        with urlopen(f"http://127.0.0.1:{port}/snapshot") as response:
+            snapshot = json.loads(response.read())
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert snapshot["exhibitions"][0]["windows"]["5m"]["ratings"] == 1
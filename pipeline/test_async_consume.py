@@ -0,0 +1,156 @@
+"""Test functionality of async consume python file"""
+
+import asyncio
+from threading import Event, get_ident
+from unittest.mock import MagicMock
+
+from async_consume import consume_async, get_offsets, merge_batches, run_stage
+from consume import upload_batches
+from metrics import render_metrics
+from profiling import Profiler
+
+
+INVALID = {"at": "2023-06-01T10:15:00.123456+00:00", "site": "9", "val": 3}
+
+
+def make_consumer(batches: list[list], stop_event: Event) -> MagicMock:
+    """Build a mock consumer returning each batch in turn, then setting stop_event"""
+    remaining = list(batches)
+
+    def consume(num_messages, timeout):
+        if remaining:
+            return remaining.pop(0)
+        stop_event.set()
+        return []
+
+    consumer = MagicMock()
+    consumer.consume.side_effect = consume
+    consumer.assignment.return_value = []
+    return consumer
+
+
+def get_committed(consumer: MagicMock) -> list[list[tuple]]:
+    """Get the partition offsets of each commit"""
+    return [[(tp.topic, tp.partition, tp.offset) for tp in c.kwargs["offsets"]]
+            for c in consumer.commit.call_args_list]
+
+
+def test_get_offsets_one_past_last_message(make_message):
+    """The committed offset of each partition is one past its last message"""
+    messages = [make_message(offset=4), make_message(offset=5),
+                make_message(offset=9, partition=1)]
+
+    assert get_offsets(messages) == {("lmnh", 0): 6, ("lmnh", 1): 10}
+
+
+def test_merge_batches_keeps_latest_offsets():
+    """Merged batches keep every row and the later offset of each partition"""
+    pending = [({"rating_instance": [(1,)], "support_instance": []}, {("lmnh", 0): 2}, 2, ["a"]),
+               ({"rating_instance": [(2,)], "support_instance": [(3,)]}, {("lmnh", 0): 4}, 2,
+                ["b", "c"])]
+
+    assert merge_batches(pending) == (
+        {"rating_instance": [(1,), (2,)], "support_instance": [(3,)]},
+        {("lmnh", 0): 4}, 4, ["a", "b", "c"])
+
+
+def test_consume_async_commits_offsets_after_upload(seeded_dimensions, make_message):
+    """Rows are uploaded through the pool before their offsets are committed"""
+    stop_event = Event()
+    consumer = make_consumer([[make_message(offset=0), make_message(offset=1)]], stop_event)
+    pool = MagicMock()
+    pool.run.return_value = True
+    pool.attach_mock(consumer.commit, "commit")
+
+    assert consume_async(pool, consumer, batch_size=2, max_delay=0, stop_event=stop_event,
+                         dimensions=seeded_dimensions)
+
+    pool.run.assert_called_once()
+    assert pool.run.call_args.args[0] is upload_batches
+    assert len(pool.run.call_args.args[1]["rating_instance"]) == 2
+    assert [c[0] for c in pool.mock_calls] == ["run", "commit"]
+    assert get_committed(consumer) == [[("lmnh", 0, 2)]]
+    consumer.close.assert_called_once()
+
+
+def test_consume_async_stops_on_failed_upload(seeded_dimensions, make_message):
+    """A failed upload stops polling and commits no offsets"""
+    stop_event = Event()
+    consumer = make_consumer([[make_message(offset=0)], [make_message(offset=1)]],
+                             stop_event)
+    pool = MagicMock()
+    pool.run.return_value = False
+
+    assert consume_async(pool, consumer, batch_size=1, max_delay=0,
+                         stop_event=stop_event, dimensions=seeded_dimensions) is False
+
+    consumer.commit.assert_not_called()
+    consumer.close.assert_called_once()
+
+
+def test_consume_async_dead_letters_rejected(seeded_dimensions, make_message):
+    """Rejected messages are flushed to the dead letter sink and their offsets committed"""
+    stop_event = Event()
+    rejected = make_message(INVALID, 7)
+    consumer = make_consumer([[rejected]], stop_event)
+    pool = MagicMock()
+    dead_letters = MagicMock()
+    dead_letters.attach_mock(consumer.commit, "commit")
+
+    assert consume_async(pool, consumer, batch_size=2, max_delay=0, stop_event=stop_event,
+                         dead_letters=dead_letters, dimensions=seeded_dimensions)
+
+    pool.run.assert_not_called()
+    assert dead_letters.write.call_args.args[0].reason == "invalid_site"
+    assert [c[0] for c in dead_letters.mock_calls] == ["write", "flush", "commit"]
+    assert get_committed(consumer) == [[("lmnh", 0, 8)]]
+
+
+def test_consume_async_polls_while_writing(seeded_dimensions, make_message):
+    """Polling continues while an upload is in progress"""
+    stop_event = Event()
+    writing = Event()
+    polled_while_writing = Event()
+    messages = [[make_message(offset=0)]]
+
+    def consume(num_messages, timeout):
+        if messages:
+            return messages.pop(0)
+        if writing.wait(1):
+            polled_while_writing.set()
+            stop_event.set()
+        return []
+
+    def upload(func, batches):
+        writing.set()
+        return polled_while_writing.wait(5)
+
+    consumer = MagicMock()
+    consumer.consume.side_effect = consume
+    consumer.assignment.return_value = []
+    pool = MagicMock()
+    pool.run.side_effect = upload
+
+    assert consume_async(pool, consumer, batch_size=1, max_delay=0, stop_event=stop_event,
+                         dimensions=seeded_dimensions)
+    assert polled_while_writing.is_set()
+
+
+def test_run_stage_tags_the_worker_thread_only(tmp_path):
+    """Awaited stages tag the thread doing the work, not the event loop shared by tasks"""
+    profiler = Profiler(str(tmp_path))
+    seen = {}
+
+    def poll(loop_ident):
+        seen["worker"] = profiler.stages.get(get_ident())
+        seen["loop"] = profiler.stages.get(loop_ident)
+        return []
+
+    async def run():
+        return await run_stage("poll", poll, get_ident())
+
+    with profiler:
+        assert asyncio.run(run()) == []
+
+    assert seen == {"worker": "poll", "loop": None}
+    assert 'stage_seconds_count{stage="poll"}' in render_metrics()
@@ -0,0 +1,58 @@
+"""Test functionality of benchmark python file"""
+
+import json
+from unittest.mock import patch
+
+import pytest
+
+from benchmark import compare_results, is_local_database, main, run_benchmark, save_results
+
+
+def test_run_benchmark_reports_throughput_and_memory():
+    """Results hold the item rate of the fastest run and the peak memory"""
+    calls = []
+
+    result = run_benchmark("append", lambda: calls.append([0] * 1000), 1000,
+                           repeats=2, setup=calls.clear)
+
+    assert result["name"] == "append" and result["items"] == 1000
+    assert result["items_per_second"] > 0
+    assert result["peak_memory_mb"] > 0
+    assert len(calls) == 1
+
+
+def test_save_and_compare_results(tmp_path):
+    """Saved results can be compared with a later run"""
+    file_path = tmp_path / "benchmark_results.json"
+    previous = save_results([{"name": "clean_data", "items_per_second": 100.0}],
+                            str(file_path), 100, 0)
+    current = {"results": [{"name": "clean_data", "items_per_second": 150.0},
+                           {"name": "copy_instances", "items_per_second": 10.0}]}
+
+    assert json.loads(file_path.read_text())["results"] == previous["results"]
+    assert compare_results(previous, current) == {"clean_data": 1.5}
+
+
+@pytest.mark.parametrize("host, local", [("localhost", True), ("127.0.0.1", True),
+                                         ("museum.abc123.eu-west-2.rds.amazonaws.com", False),
+                                         ("", False)])
+def test_is_local_database(host, local):
+    """Only databases on this machine may be benchmarked"""
+    with patch.dict("benchmark.environ", {"DATABASE_IP": host}), \
+            patch("benchmark.load_dotenv"):
+        assert is_local_database() is local
+
+
+@patch("benchmark.benchmark_database")
+@patch("benchmark.benchmark_csv")
+@patch("benchmark.benchmark_cleaning")
+@patch("benchmark.is_local_database", return_value=False)
+@patch("benchmark.argparse_is_my_friend", return_value=(10, 1, 0, "out.json", None, True))
+def test_main_refuses_remote_database(mock_args, mock_is_local, mock_cleaning, mock_csv,
+                                      mock_database):
+    """The database benchmark refuses to run, and truncate, anything but a local database"""
+    with pytest.raises(SystemExit):
+        main()
+
+    mock_cleaning.assert_not_called()
+    mock_database.assert_not_called()
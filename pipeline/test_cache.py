@@ -0,0 +1,46 @@
+"""Test functionality of cache python file"""
+
+from datetime import date
+
+from cache import (cache_filter,
+                   read_kiosk_cache,
+                   stream_kiosk_cache,
+                   write_kiosk_cache)
+
+KIOSK_ROWS = [["2022-10-30 09:00:38", "1", "3", ""],
+              ["2022-10-30 09:01:38", "2", "-1", "1.0"],
+              ["2022-10-31 10:00:38", "2", "4", ""],
+              ["2022-10-31 19:00:38", "2", "4", ""]]
+
+
+def test_write_and_read_kiosk_cache(tmp_path):
+    """Valid rows are cached typed and partitioned by date and site"""
+    write_kiosk_cache([KIOSK_ROWS[:2], KIOSK_ROWS[2:]], str(tmp_path))
+
+    table = read_kiosk_cache(str(tmp_path))
+
+    assert table.num_rows == 3
+    assert (tmp_path / "date=2022-10-31" / "site=2").is_dir()
+    assert str(table.schema.field("val").type) == "int8"
+
+
+def test_read_kiosk_cache_projects_and_filters(tmp_path):
+    """Only the requested columns and partitions are read"""
+    write_kiosk_cache([KIOSK_ROWS], str(tmp_path))
+
+    table = read_kiosk_cache(str(tmp_path), columns=["val"],
+                             predicate=cache_filter(date(2022, 10, 30), sites=[2]))
+
+    assert table.column_names == ["val"]
+    assert table.column("val").to_pylist() == [-1, 4]
+
+
+def test_stream_kiosk_cache_matches_csv_rows(tmp_path):
+    """Cached rows stream back in the shape of the kiosk csv rows, with their source_id"""
+    write_kiosk_cache([[KIOSK_ROWS[0] + ["lmnh_hist_data_0.csv@17"], KIOSK_ROWS[1]]],
+                      str(tmp_path))
+
+    rows = sorted(row for chunk in stream_kiosk_cache(str(tmp_path)) for row in chunk)
+
+    assert rows == [["2022-10-30T09:00:38+00:00", "1", "3", "", "lmnh_hist_data_0.csv@17"],
+                    ["2022-10-30T09:01:38+00:00", "2", "-1", "1", None]]
@@ -0,0 +1,131 @@
+"""Test functionality of cleaning python file"""
+
+import json
+from io import StringIO
+from unittest.mock import MagicMock
+
+import pandas as pd
+import pytest
+
+from cleaning import (KIOSK_AT_FORMAT,
+                      KioskEvent,
+                      clean_data,
+                      validate_batch,
+                      validate_message)
+
+AT = "2023-06-01T10:15:00.123456+00:00"
+
+CASES = [
+    ({"at": AT, "site": "2", "val": 3}, None),
+    ({"at": AT, "site": "0", "val": 0}, None),
+    ({"at": AT, "site": "5", "val": -1, "type": 1}, None),
+    ({"at": AT, "site": "1", "val": 4, "type": 0}, None),
+    ({"at": "2023-06-01T08:45:00.000000+00:00", "site": "1", "val": 2}, None),
+    ({"at": "2023-06-01T18:15:00.000000+00:00", "site": "1", "val": 2}, None),
+    ({"site": "2", "val": 3}, "missing_at"),
+    ({"at": AT, "site": "2"}, "missing_val"),
+    ({"at": AT, "site": "2", "val": -1}, "missing_type"),
+    ({"at": AT, "val": 3}, "missing_site"),
+    ({"at": AT, "site": "2", "val": None}, "missing_val_value"),
+    ({"at": AT, "site": "", "val": 3}, "missing_site_value"),
+    ({"at": AT, "site": "2", "val": 7}, "invalid_val"),
+    ({"at": AT, "site": "2", "val": [3]}, "invalid_val"),
+    ({"at": AT, "site": 2, "val": 3}, "invalid_site"),
+    ({"at": AT, "site": "6", "val": 3}, "invalid_site"),
+    ({"at": AT, "site": "2", "val": -1, "type": 2}, "invalid_type"),
+    ({"at": AT, "site": "2", "val": -1, "type": None}, "invalid_type"),
+    ({"at": AT[:-1], "site": "2", "val": 3}, "invalid_at"),
+    ({"at": "", "site": "2", "val": 3}, "invalid_at"),
+    ({"at": "2023-06-31T10:15:00.123456+00:00", "site": "2", "val": 3},
+     "invalid_at_format"),
+    ({"at": "2023-06-01 10:15:00.123456+00:00", "site": "2", "val": 3},
+     "invalid_at_format"),
+    ({"at": "2023-06-01T10:15:00.123456+01:00", "site": "2", "val": 3},
+     "invalid_at_format"),
+    ({"at": "2023-06-01T08:44:59.999999+00:00", "site": "2", "val": 3},
+     "invalid_at_time"),
+    ({"at": "2023-06-01T18:15:00.000001+00:00", "site": "2", "val": 3},
+     "invalid_at_time"),
+]
+
+
+@pytest.mark.parametrize("data, reason", CASES)
+def test_validate_message_reason(data, reason):
+    """Each rule rejects with its own reason code"""
+    event, rejection = validate_message(json.dumps(data).encode())
+
+    assert rejection == reason
+    assert (event is None) == (reason is not None)
+
+
+def test_validate_message_types_event():
+    """Accepted messages are returned as typed events"""
+    event, _ = validate_message(
+        b'{"at": "2023-06-01T10:15:00.123456+00:00", "site": "5", "val": -1, "type": 1}')
+
+    assert event == KioskEvent(AT, 5, -1, 1)
+
+
+def test_validate_message_rejects_bad_json():
+    """Payloads that are not JSON objects are rejected"""
+    assert validate_message(b'not json') == (None, 'invalid_json')
+    assert validate_message(b'[1, 2]') == (None, 'invalid_json')
+
+
+def test_clean_data_returns_bool():
+    """clean_data keeps returning whether the message is valid"""
+    message = MagicMock()
+    message.value.return_value = json.dumps(CASES[0][0]).encode()
+
+    assert clean_data(message) is True
+
+
+def test_validate_batch_counts_first_failed_rule():
+    """Each rejected row is counted once, against the first rule it breaks"""
+    batch = {
+        "at": ["2022-10-30 09:00:38", "2022-10-30 19:00:38", "",
+               "2022-10-30 09:00:38", "2022-10-30 09:00:38", "not a date"],
+        "site": ["1", "1", "1", "7", "2", "9"],
+        "val": ["3", "3", "3", "3", "-1", "3"],
+        "type": ["", "", "", "", "", ""]}
+
+    accepted, counts = validate_batch(batch)
+
+    assert accepted.tolist() == [True, False, False, False, False, False]
+    assert counts["invalid_at_time"] == 1
+    assert counts["missing_at"] == 1
+    assert counts["invalid_site"] == 2
+    assert counts["missing_type"] == 1
+    assert sum(counts.values()) == 5
+
+
+def test_validate_batch_reads_numeric_sites():
+    """A csv site column with a missing value is read as floats and still validated"""
+    batch = pd.read_csv(StringIO(
+        "at,site,val,type\n"
+        "2022-10-30 09:00:38,1,3,\n"
+        "2022-10-30 09:00:39,,3,\n"
+        "2022-10-30 09:00:40,5,-1,0\n"
+        "2022-10-30 09:00:41,7,3,\n"))
+
+    accepted, counts = validate_batch(batch)
+
+    assert batch["site"].dtype == "float64"
+    assert accepted.tolist() == [True, False, True, False]
+    assert counts["missing_site"] == 1
+    assert counts["invalid_site"] == 1
+
+
+@pytest.mark.parametrize("data, reason", CASES)
+def test_validate_batch_matches_validate_message(data, reason):
+    """Kafka-layout batches are accepted exactly as single messages are"""
+    if not all(isinstance(data.get(name), (str, int, type(None)))
+               for name in ("at", "site", "val", "type")):
+        pytest.skip("not representable as a column value")
+    if isinstance(data.get("site"), int):
+        pytest.skip("batch sites may be read as numbers")
+    batch = {name: [data.get(name)] for name in ("at", "site", "val", "type")}
+
+    accepted, _ = validate_batch(batch, at_format=KIOSK_AT_FORMAT)
+
+    assert accepted[0] == (reason is None)
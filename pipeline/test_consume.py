@@ -0,0 +1,335 @@
+"""Test functionality of consume python file"""
+
+import json
+import logging
+from unittest.mock import patch, MagicMock
+
+import pytest
+
+from cleaning import KioskEvent
+from consume import (MessageSummary,
+                     consume_batches,
+                     consume_messages,
+                     format_instance_row,
+                     get_partition_lag,
+                     log_to_queue,
+                     upload_batches,
+                     upload_buffered,
+                     validate_timed)
+from dimensions import DimensionCache
+from metrics import render_metrics, reset_metrics
+
+
+SUPPORT = {"at": "2023-06-01T10:15:00.123456+00:00", "site": "4",
+           "val": -1, "type": 1}
+
+
+def test_format_instance_row_rating(seeded_dimensions, rating):
+    """Ratings are routed to the rating table with the ids of their codes"""
+    assert format_instance_row(KioskEvent(rating["at"], 2, 3, None), seeded_dimensions) == (
+        ("rating_instance", (rating["at"], 3, 4, None)), None)
+
+
+def test_format_instance_row_support(seeded_dimensions):
+    """Support requests are routed to the support table with the ids of their codes"""
+    assert format_instance_row(KioskEvent(SUPPORT["at"], 4, -1, 1), seeded_dimensions) == (
+        ("support_instance", (SUPPORT["at"], 5, 2, None)), None)
+
+
+def test_format_instance_row_rejects_unknown_codes(rating):
+    """Codes missing from the dimension tables are rejected before upload"""
+    dimensions = DimensionCache()
+    dimensions.set_mappings({0: 10, 2: 30}, {3: 7}, {})
+
+    assert format_instance_row(KioskEvent(rating["at"], 2, 3, None), dimensions,
+                               "lmnh:0:41") == (
+        ("rating_instance", (rating["at"], 30, 7, "lmnh:0:41")), None)
+    assert format_instance_row(KioskEvent(rating["at"], 1, 3, None), dimensions) == (
+        None, "unknown_site")
+    assert format_instance_row(KioskEvent(rating["at"], 2, 4, None), dimensions) == (
+        None, "unknown_val")
+    assert format_instance_row(KioskEvent(SUPPORT["at"], 0, -1, 1), dimensions) == (
+        None, "unknown_type")
+
+
+@patch("consume.insert_instances")
+def test_upload_batches_commits_once(mock_insert_instances):
+    """Each table gets one multi-row insert followed by a single commit"""
+    conn = MagicMock()
+    batches = {"rating_instance": [(1,), (2,)], "support_instance": [(3,)]}
+
+    assert upload_batches(conn, batches) is True
+    assert mock_insert_instances.call_count == 2
+    conn.commit.assert_called_once()
+
+
+def test_upload_buffered_empties_buffers():
+    """Buffers are emptied once the pooled upload has run"""
+    pool = MagicMock()
+    pool.run.return_value = True
+    batches = {"rating_instance": [(1,), (2,)], "support_instance": [(3,)]}
+
+    assert upload_buffered(pool, batches) is True
+    pool.run.assert_called_once_with(upload_batches, batches)
+    assert batches == {"rating_instance": [], "support_instance": []}
+
+
+@patch("consume.upload_buffered")
+def test_consume_batches_flushes_on_size(mock_upload_buffered, seeded_dimensions, make_message):
+    """A full batch is uploaded and any remainder is flushed on exit"""
+    consumer = MagicMock()
+    consumer.consume.side_effect = [
+        [make_message(), make_message(SUPPORT)],
+        [make_message()],
+        KeyboardInterrupt]
+
+    consume_batches(MagicMock(), consumer, batch_size=2, max_delay=60,
+                    dimensions=seeded_dimensions)
+
+    assert mock_upload_buffered.call_count == 2
+    consumer.close.assert_called_once()
+
+
+@patch("consume.upload_buffered", return_value=True)
+def test_consume_batches_keeps_message_positions(mock_upload_buffered, seeded_dimensions,
+                                                 make_message):
+    """Buffered rows end with their message's topic, partition and offset"""
+    consumer = MagicMock()
+    consumer.consume.side_effect = [[make_message(offset=7), make_message(offset=8)],
+                                    KeyboardInterrupt]
+
+    consume_batches(MagicMock(), consumer, batch_size=2, max_delay=60,
+                    dimensions=seeded_dimensions)
+
+    rows = mock_upload_buffered.call_args.args[1]["rating_instance"]
+    assert [row[3] for row in rows] == ["lmnh:0:7", "lmnh:0:8"]
+
+
+@patch("consume.upload_buffered")
+def test_consume_batches_skips_invalid(mock_upload_buffered, seeded_dimensions, make_message,
+                                       rating):
+    """Invalid messages are never buffered"""
+    consumer = MagicMock()
+    consumer.consume.side_effect = [
+        [make_message({"at": rating["at"], "site": "9", "val": 3})],
+        KeyboardInterrupt]
+
+    consume_batches(MagicMock(), consumer, batch_size=2, max_delay=60,
+                    dimensions=seeded_dimensions)
+
+    mock_upload_buffered.assert_not_called()
+
+
+@patch("consume.upload_buffered")
+def test_consume_batches_commits_offsets_after_upload(mock_upload_buffered, seeded_dimensions,
+                                                      make_message):
+    """Offsets are committed only once the batch upload succeeded"""
+    mock_upload_buffered.return_value = True
+    consumer = MagicMock()
+    consumer.consume.side_effect = [
+        [make_message(), make_message(SUPPORT)],
+        KeyboardInterrupt]
+
+    consume_batches(MagicMock(), consumer, batch_size=2, max_delay=60,
+                    dimensions=seeded_dimensions)
+
+    consumer.commit.assert_called_once_with(asynchronous=False)
+
+
+@patch("consume.upload_buffered")
+def test_consume_batches_commits_only_handled_messages_on_error(mock_upload_buffered,
+                                                                seeded_dimensions, make_message,
+                                                                rating):
+    """An error partway through a consumed list only commits the messages handled before it"""
+    mock_upload_buffered.return_value = True
+    consumer = MagicMock()
+    consumer.consume.return_value = [make_message(offset=offset)
+                                     for offset in range(5, 8)]
+
+    with patch("consume.validate_timed",
+               side_effect=[validate_timed(json.dumps(rating).encode()),
+                            validate_timed(json.dumps(rating).encode()),
+                            RuntimeError("unexpected")]):
+        with pytest.raises(RuntimeError):
+            consume_batches(MagicMock(), consumer, batch_size=10, max_delay=60,
+                            dimensions=seeded_dimensions)
+
+    offsets = consumer.commit.call_args.kwargs["offsets"]
+    assert [(tp.topic, tp.partition, tp.offset) for tp in offsets] == [("lmnh", 0, 7)]
+
+
+@patch("consume.upload_buffered")
+def test_consume_batches_stops_on_failed_upload(mock_upload_buffered, seeded_dimensions,
+                                                make_message):
+    """A failed upload stops consuming without committing offsets"""
+    mock_upload_buffered.return_value = False
+    consumer = MagicMock()
+    consumer.consume.side_effect = [
+        [make_message(), make_message(SUPPORT)],
+        [make_message()]]
+
+    consume_batches(MagicMock(), consumer, batch_size=2, max_delay=60,
+                    dimensions=seeded_dimensions)
+
+    assert consumer.consume.call_count == 1
+    consumer.commit.assert_not_called()
+    consumer.close.assert_called_once()
+
+
+@patch("consume.upload_buffered")
+def test_consume_batches_feeds_aggregator(mock_upload_buffered, seeded_dimensions, make_message,
+                                          rating):
+    """Valid messages are counted by the live aggregator"""
+    consumer = MagicMock()
+    consumer.consume.side_effect = [
+        [make_message(), make_message({"at": rating["at"], "site": "9", "val": 3})],
+        KeyboardInterrupt]
+    aggregator = MagicMock()
+
+    consume_batches(MagicMock(), consumer, batch_size=2, max_delay=60,
+                    aggregator=aggregator, dimensions=seeded_dimensions)
+
+    aggregator.add.assert_called_once_with(KioskEvent(rating["at"], 2, 3, None))
+
+
+@patch("consume.upload_buffered")
+def test_consume_batches_skips_aggregator_on_failed_upload(mock_upload_buffered, seeded_dimensions,
+                                                           make_message):
+    """Events are not counted until their batch is uploaded, so re-read messages count once"""
+    mock_upload_buffered.return_value = False
+    consumer = MagicMock()
+    consumer.consume.return_value = [make_message(), make_message()]
+    aggregator = MagicMock()
+
+    assert not consume_batches(MagicMock(), consumer, batch_size=2, max_delay=60,
+                               aggregator=aggregator, dimensions=seeded_dimensions)
+
+    aggregator.add.assert_not_called()
+
+
+@patch("consume.upload_buffered")
+def test_consume_batches_dead_letters_rejected(mock_upload_buffered, seeded_dimensions,
+                                               make_message, rating):
+    """Rejected messages go to the dead letter sink, flushed before offsets are committed"""
+    mock_upload_buffered.return_value = True
+    rejected = make_message({"at": rating["at"], "site": "9", "val": 3})
+    consumer = MagicMock()
+    consumer.consume.side_effect = [[make_message(), rejected], KeyboardInterrupt]
+    dead_letters = MagicMock()
+    dead_letters.attach_mock(consumer.commit, "commit")
+
+    consume_batches(MagicMock(), consumer, batch_size=2, max_delay=60,
+                    dead_letters=dead_letters, dimensions=seeded_dimensions)
+
+    dead_letter = dead_letters.write.call_args.args[0]
+    assert dead_letter.reason == "invalid_site"
+    assert dead_letter.value == rejected.value()
+    assert [c[0] for c in dead_letters.mock_calls] == ["write", "flush", "commit"]
+
+
+def test_message_summary_logs_every_n_messages(caplog):
+    """Outcomes are logged as one summary line once enough messages are counted"""
+    summary = MessageSummary(every=3, interval=60, clock=lambda: 0.0)
+
+    with caplog.at_level(logging.INFO):
+        summary.add("accepted")
+        summary.add("invalid_site")
+        assert not caplog.records
+        summary.add("accepted")
+
+    assert len(caplog.records) == 1
+    assert "{'accepted': 2, 'invalid_site': 1}" in caplog.records[0].getMessage()
+    assert summary.pending == 0
+
+
+def test_message_summary_logs_after_interval(caplog):
+    """A summary is logged once the interval passes, however few messages arrived"""
+    clock = [0.0]
+    summary = MessageSummary(every=1000, interval=1.0, clock=lambda: clock[0])
+
+    with caplog.at_level(logging.INFO):
+        summary.add("accepted")
+        clock[0] = 1.5
+        summary.add("accepted")
+
+    assert len(caplog.records) == 1
+
+
+@patch("consume.select_data_upload")
+def test_consume_messages_only_logs_messages_at_debug(mock_select_data_upload, caplog,
+                                                      seeded_dimensions, make_message):
+    """At INFO level accepted messages are counted, not logged one by one"""
+    pool = MagicMock()
+    pool.run.return_value = True
+    consumer = MagicMock()
+    consumer.poll.side_effect = [make_message(), make_message(SUPPORT),
+                                 KeyboardInterrupt]
+    summary = MessageSummary(every=1000, interval=60)
+
+    with caplog.at_level(logging.INFO):
+        consume_messages(pool, consumer, summary=summary, dimensions=seeded_dimensions)
+
+    assert not [r for r in caplog.records if "log:" in r.getMessage()]
+    assert "'accepted': 2" in caplog.records[-1].getMessage()
+
+
+@patch("consume.select_data_upload")
+def test_consume_messages_flushes_dead_letters_only_before_commits(mock_select_data_upload,
+                                                                   seeded_dimensions, make_message,
+                                                                   rating):
+    """Rejected offsets are committed with the next upload, after one flush of the sink"""
+    pool = MagicMock()
+    pool.run.return_value = True
+    consumer = MagicMock()
+    consumer.poll.side_effect = [make_message({"at": rating["at"], "site": "9", "val": 3}, 0),
+                                 make_message({"at": rating["at"], "site": "9", "val": 3}, 1),
+                                 make_message(offset=2), KeyboardInterrupt]
+    dead_letters = MagicMock()
+    dead_letters.attach_mock(consumer.commit, "commit")
+
+    consume_messages(pool, consumer, dead_letters=dead_letters, dimensions=seeded_dimensions)
+
+    assert [c[0] for c in dead_letters.mock_calls] == ["write", "write", "flush", "commit"]
+    assert consumer.commit.call_args.kwargs["offsets"][0].offset == 3
+
+
+def test_log_to_queue_appends_in_background(tmp_path):
+    """Log records are written to the file by the queue listener"""
+    root = logging.getLogger()
+    handlers, level = root.handlers, root.level
+    log_file = tmp_path / "consume_logs.txt"
+    log_file.write_text("earlier run\n")
+    try:
+        listener = log_to_queue("INFO", str(log_file))
+        logging.info("Consumed %s messages", 5)
+        listener.stop()
+    finally:
+        root.handlers, root.level = handlers, level
+
+    lines = log_file.read_text().splitlines()
+    assert lines[0] == "earlier run"
+    assert lines[1].endswith("Consumed 5 messages")
+
+
+def test_get_partition_lag_per_partition():
+    """Lag is reported for each assigned partition from cached watermarks"""
+    consumer = MagicMock()
+    consumer.position.return_value = [MagicMock(topic="lmnh", partition=0, offset=40),
+                                      MagicMock(topic="lmnh", partition=1, offset=-1001)]
+    consumer.get_watermark_offsets.side_effect = [(0, 100), (10, 25)]
+
+    assert get_partition_lag(consumer) == {("lmnh", 0): 60, ("lmnh", 1): 15}
+    assert consumer.get_watermark_offsets.call_args.kwargs["cached"] is True
+
+
+def test_validate_timed_records_parse_and_validate(rating):
+    """JSON parsing and validation are timed as separate stages"""
+    reset_metrics()
+
+    event, reason = validate_timed(json.dumps(rating).encode())
+    assert validate_timed(b"not json") == (None, "invalid_json")
+
+    text = render_metrics()
+    assert event == KioskEvent(rating["at"], 2, 3, None) and reason is None
+    assert 'stage_seconds_count{stage="parse"} 2' in text
+    assert 'stage_seconds_count{stage="validate"} 1' in text
@@ -0,0 +1,160 @@
+"""Test functionality of database python file"""
+
+from unittest.mock import patch, MagicMock
+
+from psycopg2 import OperationalError
+import pytest
+
+from database import (ConnectionPool,
+                      commit,
+                      ensure_partitions,
+                      get_db_connection,
+                      get_insert_query,
+                      insert_instances)
+from metrics import render_metrics
+
+CONFIG = {"user": "u", "password": "p", "host": "h", "port": "1", "database": "d"}
+
+
+@patch("database.RETRY_DELAY", 0)
+@patch("database.get_connection_config", return_value=CONFIG)
+@patch("database.connect")
+def test_get_db_connection_gives_up_after_retries(mock_connect, mock_config):
+    """Connection attempts are retried before returning None"""
+    mock_connect.side_effect = OperationalError("failover")
+
+    assert get_db_connection(retries=2) is None
+    assert mock_connect.call_count == 3
+
+
+@patch("database.RETRY_DELAY", 0)
+@patch("database.get_connection_config", return_value=CONFIG)
+@patch("database.connect")
+def test_pool_reconnects_after_connection_failure(mock_connect, mock_config):
+    """A broken connection is replaced and the work is retried"""
+    broken, healthy = MagicMock(closed=0), MagicMock(closed=0)
+    mock_connect.side_effect = [broken, healthy]
+    pool = ConnectionPool(size=1)
+
+    def upload(conn, value):
+        if conn is broken:
+            raise OperationalError("server closed the connection")
+        return value
+
+    assert pool.run(upload, 42) == 42
+    broken.close.assert_called_once()
+    assert pool.idle == [healthy]
+    assert 'db_query_seconds_count{query="upload"}' in render_metrics()
+
+
+@patch("database.get_connection_config", return_value=CONFIG)
+@patch("database.connect")
+def test_pool_reuses_idle_connections(mock_connect, mock_config):
+    """Connections are reused and the insert statements prepared only once"""
+    conn = MagicMock(closed=0)
+    mock_connect.return_value = conn
+    pool = ConnectionPool(size=2)
+
+    pool.run(lambda conn: None)
+    pool.run(lambda conn: None)
+
+    assert mock_connect.call_count == 1
+    assert conn.commit.call_count == 1
+
+
+@patch("database.RETRY_DELAY", 0)
+@patch("database.get_connection_config", return_value=CONFIG)
+@patch("database.connect")
+def test_pool_raises_after_retries(mock_connect, mock_config):
+    """Connection failures are raised once the retries are used up"""
+    mock_connect.side_effect = OperationalError("down")
+    pool = ConnectionPool(size=1, retries=1)
+
+    with pytest.raises(OperationalError):
+        pool.run(lambda conn: None)
+    assert pool.available.acquire(blocking=False)
+
+
+@patch("database.known_partitions", set())
+def test_ensure_partitions_creates_each_month_once():
+    """Monthly partitions are only ensured the first time a month is seen"""
+    conn = MagicMock()
+    curr = conn.cursor.return_value
+
+    ensure_partitions(conn, "rating_instance", {"2023-06", "2023-07"})
+    ensure_partitions(conn, "rating_instance", {"2023-07"})
+
+    assert [call.args[1] for call in curr.execute.call_args_list] == [
+        ("rating_instance", "rating_created_at", "2023-06-01"),
+        ("rating_instance", "rating_created_at", "2023-07-01")]
+
+
+@patch("database.known_partitions", set())
+@patch("database.get_connection_config", return_value=CONFIG)
+@patch("database.connect")
+def test_rolled_back_partitions_are_created_again(mock_connect, mock_config):
+    """A month is only remembered once its partition commits, so a rollback recreates it"""
+    conn = MagicMock(closed=0)
+    mock_connect.return_value = conn
+    curr = conn.cursor.return_value
+    pool = ConnectionPool(size=1)
+
+    def upload(conn, fail):
+        ensure_partitions(conn, "rating_instance", {"2023-06"})
+        if fail:
+            raise ValueError("bad batch")
+        commit(conn)
+
+    with pytest.raises(ValueError):
+        pool.run(upload, True)
+    conn.rollback.assert_called_once()
+    pool.run(upload, False)
+    pool.run(upload, False)
+
+    ensured = [call for call in curr.execute.call_args_list
+               if "ensure_monthly_partition" in call.args[0]]
+    assert len(ensured) == 2
+
+
+@patch("database.known_partitions", set())
+@patch("database.execute_values")
+def test_insert_instances_ensures_partitions(mock_execute_values):
+    """Partitions for the months of a batch exist before it is inserted"""
+    conn = MagicMock()
+    rows = [("2023-06-01T10:15:00.123456+00:00", 1, 2),
+            ("2023-07-01 09:00:00", 3, 1)]
+
+    insert_instances(conn, "support_instance", rows)
+
+    months = [call.args[1][2]
+              for call in conn.cursor.return_value.execute.call_args_list]
+    assert months == ["2023-06-01", "2023-07-01"]
+    mock_execute_values.assert_called_once()
+
+
+def test_insert_queries_maintain_rollups():
+    """Inserted instance rows are added to their hourly rollup in the same statement"""
+    for table, rollup in (("rating_instance", "rating_hourly_rollup"),
+                          ("support_instance", "support_hourly_rollup")):
+        sql_query = get_insert_query(table, "VALUES %s")
+        assert f"INSERT INTO {rollup}" in sql_query
+        assert "RETURNING" in sql_query
+        assert "exhibition_id, " in sql_query and "_type_id, source_id)" in sql_query
+
+
+@patch("database.get_connection_config", return_value=CONFIG)
+@patch("database.connect")
+def test_connection_released_when_rollback_fails(mock_connect, mock_config):
+    """A connection whose rollback fails is closed and its slot returned to the pool"""
+    conn = MagicMock(closed=0)
+    conn.rollback.side_effect = OperationalError("server closed the connection")
+    mock_connect.return_value = conn
+    pool = ConnectionPool(size=1)
+
+    with pytest.raises(ValueError):
+        with pool.connection():
+            raise ValueError("bad row")
+
+    conn.close.assert_called_once()
+    assert pool.idle == []
+    assert pool.available.acquire(blocking=False)
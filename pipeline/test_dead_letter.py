@@ -0,0 +1,62 @@
+"""Test functionality of dead letter python file"""
+
+from datetime import datetime
+from unittest.mock import MagicMock
+
+from dead_letter import (DeadLetter,
+                         FileDeadLetterSink,
+                         KafkaDeadLetterSink,
+                         decode_dead_letter,
+                         encode_dead_letter,
+                         read_dead_letter_file,
+                         rotate_dead_letter_file)
+
+DEAD_LETTER = DeadLetter("invalid_site", "lmnh", 2, 41, b'{"site": "9"}\xff')
+
+
+def test_encode_dead_letter_round_trips():
+    """Dead letters survive encoding, including raw bytes that are not utf-8"""
+    line = encode_dead_letter(DEAD_LETTER)
+
+    assert line.endswith("\n") and line.count("\n") == 1
+    assert decode_dead_letter(line) == DEAD_LETTER
+
+
+def test_file_sink_appends(tmp_path):
+    """Reopening the dead letter file appends instead of truncating it"""
+    file_path = str(tmp_path / "dead_letters.jsonl")
+    for _ in range(2):
+        sink = FileDeadLetterSink(file_path)
+        sink.write(DEAD_LETTER)
+        sink.close()
+
+    assert list(read_dead_letter_file(file_path)) == [DEAD_LETTER, DEAD_LETTER]
+
+
+def test_kafka_sink_keys_by_reason():
+    """Dead letters are produced with their reason as key and position as headers"""
+    producer = MagicMock()
+    producer.flush.return_value = 0
+    sink = KafkaDeadLetterSink(producer, "lmnh-dead-letters")
+
+    sink.write(DEAD_LETTER._replace(partition=None))
+    sink.flush()
+
+    producer.produce.assert_called_once_with(
+        "lmnh-dead-letters", value=DEAD_LETTER.value, key="invalid_site",
+        headers=[("topic", "lmnh"), ("offset", "41")])
+
+
+
+def test_rotate_dead_letter_file_moves_replayed_file_aside(tmp_path):
+    """A replayed file is renamed, so a second replay does not read its dead letters again"""
+    file_path = str(tmp_path / "dead_letters.jsonl")
+    sink = FileDeadLetterSink(file_path)
+    sink.write(DEAD_LETTER)
+    sink.close()
+
+    rotated = rotate_dead_letter_file(file_path, datetime(2023, 6, 1, 10, 15))
+
+    assert rotated == file_path + ".replayed-20230601T101500"
+    assert list(read_dead_letter_file(rotated)) == [DEAD_LETTER]
+    assert not (tmp_path / "dead_letters.jsonl").exists()
@@ -0,0 +1,62 @@
+"""Test functionality of dimensions python file"""
+
+from unittest.mock import MagicMock
+
+from dimensions import DimensionCache, get_id, to_lookup
+
+
+def make_conn(mappings: list[list[dict]]) -> MagicMock:
+    """Build a mock connection whose queries return each mapping's rows in turn"""
+    conn = MagicMock()
+    curr = conn.cursor.return_value.__enter__.return_value
+    curr.fetchall.side_effect = mappings
+    return conn
+
+
+def test_to_lookup_indexes_ids_by_code():
+    """Ids are held at the index of their code, with gaps for unused codes"""
+    assert to_lookup({0: 4, 2: 9}) == [4, None, 9]
+    assert to_lookup({}) == []
+
+
+def test_get_id_rejects_unknown_codes():
+    """Codes outside the lookup or without an id are unknown"""
+    lookup = [4, None, 9]
+
+    assert get_id(lookup, 2) == 9
+    assert get_id(lookup, 1) is None
+    assert get_id(lookup, 3) is None
+    assert get_id(lookup, -1) is None
+
+
+def test_load_reads_each_dimension_table():
+    """Exhibition, rating type and support type ids are loaded by code"""
+    conn = make_conn([[{"code": 0, "id": 7}, {"code": 1, "id": 3}],
+                      [{"code": value, "id": value + 10} for value in range(5)],
+                      [{"code": 0, "id": 2}, {"code": 1, "id": 1}]])
+    dimensions = DimensionCache()
+
+    dimensions.load(conn)
+
+    assert dimensions.get_exhibition_id(0) == 7
+    assert dimensions.get_exhibition_id(1) == 3
+    assert dimensions.get_exhibition_id(2) is None
+    assert dimensions.get_rating_type_id(4) == 14
+    assert dimensions.get_support_type_id(1) == 1
+
+
+def test_refresh_if_stale_reloads_after_ttl():
+    """The mappings are loaded on first use and reloaded once the TTL passes"""
+    clock = [0.0]
+    pool = MagicMock()
+    dimensions = DimensionCache(ttl=60, clock=lambda: clock[0])
+    pool.run.side_effect = lambda func: dimensions.set_mappings({0: 1}, {}, {})
+
+    dimensions.refresh_if_stale(pool)
+    clock[0] = 59.0
+    dimensions.refresh_if_stale(pool)
+    assert pool.run.call_count == 1
+
+    clock[0] = 60.0
+    dimensions.refresh_if_stale(pool)
+    assert pool.run.call_count == 2
@@ -2,9 +2,15 @@
 
 from unittest.mock import patch, MagicMock
 
-from extract import (download_specific_files,
+from botocore.exceptions import ClientError
+
+from extract import (download_objects,
+                     download_specific_files,
                      get_bucket_names,
-                     get_bucket_objects)
+                     get_bucket_objects,
+                     list_bucket_objects,
+                     position_lines,
+                     read_source_rows)
 
 
 def test_get_bucket_names():
@@ -43,3 +49,103 @@ def test_download_specific_files_creates_files(mock_get_bucket_objects):
     download_specific_files(mock_client, mock_bucket, 'lmnh', 'museum_files')
 
     mock_download_file.call_count == 1
+
+
+def test_list_bucket_objects_pages_through_listing():
+    """Objects from every page of the listing are returned"""
+    mock_client = MagicMock()
+    mock_client.get_paginator.return_value.paginate.return_value = [
+        {"Contents": [{"Key": f"lmnh_hist_data_{i}.csv"} for i in range(1000)]},
+        {"Contents": [{"Key": "lmnh_hist_data_1000.csv"}]},
+        {}]
+
+    objects = list_bucket_objects(mock_client, "museum", "lmnh")
+
+    assert len(objects) == 1001
+    mock_client.get_paginator.return_value.paginate.assert_called_once_with(
+        Bucket="museum", Prefix="lmnh")
+
+
+@patch("extract.RETRY_DELAY", 0)
+def test_download_objects_retries_failures():
+    """Failed downloads are retried and reported once they succeed"""
+    mock_client = MagicMock()
+    error = ClientError({"Error": {"Code": "SlowDown"}}, "GetObject")
+    mock_client.download_file.side_effect = [error, None, None]
+    objects = [{"Key": "a.csv", "Size": 10}, {"Key": "b.csv", "Size": 20}]
+
+    downloaded, failed = download_objects(mock_client, "museum", objects, "folder")
+
+    assert sorted(downloaded) == ["a.csv", "b.csv"]
+    assert failed == []
+    assert mock_client.download_file.call_count == 3
+
+
+@patch("extract.RETRY_DELAY", 0)
+def test_download_objects_skips_exhausted_retries():
+    """Objects that keep failing are returned as failed rather than downloaded"""
+    mock_client = MagicMock()
+    mock_client.download_file.side_effect = ClientError(
+        {"Error": {"Code": "NoSuchKey"}}, "GetObject")
+
+    downloaded, failed = download_objects(mock_client, "museum",
+                                          [{"Key": "a.csv", "Size": 10}], "folder")
+
+    assert downloaded == []
+    assert failed == ["a.csv"]
+
+
+def test_download_specific_files_uses_given_bucket():
+    """Downloads use the requested bucket rather than a hard-coded one"""
+    mock_client = MagicMock()
+    mock_client.get_paginator.return_value.paginate.return_value = [
+        {"Contents": [{"Key": "lmnh_hist_data_0.csv", "Size": 5},
+                      {"Key": "lmnh_notes.txt", "Size": 5}]}]
+
+    download_specific_files(mock_client, "my-bucket", "lmnh", "museum_files")
+
+    mock_client.download_file.assert_called_once_with(
+        "my-bucket", "lmnh_hist_data_0.csv", "museum_files/lmnh_hist_data_0.csv")
+
+
+def test_stream_csv_files_merges_without_headers(tmp_path):
+    """Rows from every file arrive as one chunked stream with headers removed"""
+    from extract import stream_csv_files
+
+    first = tmp_path / "lmnh_hist_data_0.csv"
+    second = tmp_path / "lmnh_hist_data_1.csv"
+    first.write_text("\ufeffat,site,val,type\nA,1,3,\nB,2,-1,1\n", encoding="utf-8")
+    second.write_text("at,site,val,type\nC,0,4,\n", encoding="utf-8")
+
+    chunks = list(stream_csv_files([str(first), str(second)], chunk_size=2))
+
+    assert chunks == [[["A", "1", "3", "", "lmnh_hist_data_0.csv@20"],
+                       ["B", "2", "-1", "1", "lmnh_hist_data_0.csv@27"]],
+                      [["C", "0", "4", "", "lmnh_hist_data_1.csv@17"]]]
+
+
+def test_stream_s3_csv_objects_reads_bodies():
+    """Object bodies are streamed line by line without downloading files, keeping line offsets"""
+    from extract import stream_s3_csv_objects
+
+    mock_client = MagicMock()
+    mock_client.get_object.return_value["Body"].iter_lines.side_effect = [
+        iter([b"at,site,val,type\n", b"A,1,3,\n"]),
+        iter([b"at,site,val,type\n", b"C,0,4,\n"])]
+
+    chunks = list(stream_s3_csv_objects(mock_client, "museum", ["a.csv", "b.csv"]))
+
+    assert chunks == [[["A", "1", "3", "", "a.csv@17"], ["C", "0", "4", "", "b.csv@17"]]]
+    mock_client.get_object.return_value["Body"].iter_lines.assert_called_with(keepends=True)
+
+
+def test_read_source_rows_keeps_same_second_presses_apart():
+    """Identical presses in the same second get their own source_id, so neither is dropped"""
+    lines = [b"at,site,val,type\n", b"A,1,3,\n", b"A,1,3,\n", b"\n", b"B,2\n"]
+
+    rows = list(read_source_rows(position_lines(lines), "lmnh_hist_data_0.csv"))
+
+    assert rows == [["at", "site", "val", "type", "lmnh_hist_data_0.csv@0"],
+                    ["A", "1", "3", "", "lmnh_hist_data_0.csv@17"],
+                    ["A", "1", "3", "", "lmnh_hist_data_0.csv@24"],
+                    ["B", "2", "", "", "lmnh_hist_data_0.csv@32"]]
@@ -0,0 +1,52 @@
+"""Test functionality of generator python file"""
+
+from collections import Counter
+
+from cleaning import validate_message
+from generator import generate_csv_rows, generate_messages, write_csv_rows
+from load import validate_kiosk_data
+from pipeline import load_kiosk_data
+
+
+def test_generate_messages_is_reproducible():
+    """The same seed always generates the same messages"""
+    assert generate_messages(100, seed=3) == generate_messages(100, seed=3)
+    assert generate_messages(100, seed=3) != generate_messages(100, seed=4)
+
+
+def test_generate_messages_without_errors_are_valid():
+    """With no invalid or missing rates every message passes validation"""
+    messages = generate_messages(2000, invalid_rate=0, missing_rate=0)
+
+    assert all(validate_message(raw)[1] is None for raw in messages)
+
+
+def test_generate_messages_rejection_rates():
+    """Invalid and missing fields appear at roughly the requested rates"""
+    reasons = Counter(validate_message(raw)[1]
+                      for raw in generate_messages(20000, invalid_rate=0.1, missing_rate=0.05))
+    rejected = 20000 - reasons[None]
+    missing = sum(count for reason, count in reasons.items()
+                  if reason and reason.startswith('missing'))
+
+    assert 0.12 * 20000 < rejected < 0.17 * 20000
+    assert 0.04 * 20000 < missing < 0.06 * 20000
+
+
+def test_generate_messages_mix():
+    """About a tenth of presses are support requests, mostly assistance"""
+    events = [validate_message(raw)[0]
+              for raw in generate_messages(20000, invalid_rate=0, missing_rate=0)]
+    support = [event for event in events if event.val == -1]
+
+    assert 0.08 < len(support) / len(events) < 0.12
+    assert Counter(event.type for event in support).most_common(1)[0][0] == 0
+
+
+def test_generate_csv_rows_round_trip(tmp_path):
+    """Generated csv rows load like the historical kiosk files"""
+    rows = generate_csv_rows(500, invalid_rate=0)
+    write_csv_rows(str(tmp_path / "lmnh_merged_hist_data.csv"), rows)
+
+    assert load_kiosk_data(str(tmp_path)) == rows
+    assert validate_kiosk_data(rows) == rows
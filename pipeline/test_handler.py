@@ -0,0 +1,105 @@
+"""Test functionality of handler python file"""
+
+from unittest.mock import patch, MagicMock
+
+import pytest
+
+import handler
+from handler import consume_handler, get_client, get_drain_seconds, pipeline_handler
+
+
+@pytest.fixture(autouse=True)
+def kept_clients(seeded_dimensions):
+    """Start each test without clients kept from another test"""
+    handler.clients.clear()
+    handler.clients["pool"] = MagicMock()
+    handler.clients["dimensions"] = seeded_dimensions
+    handler.clients[("dead_letters", "file", "dead_letters.jsonl")] = MagicMock()
+    yield handler.clients
+    handler.clients.clear()
+
+
+def test_get_client_reuses_clients():
+    """A client is created on the first invocation and reused by later ones"""
+    create = MagicMock()
+
+    assert get_client("s3", create) is get_client("s3", create)
+    create.assert_called_once()
+
+
+def test_get_drain_seconds_leaves_margin():
+    """Drains end before the invocation runs out of time"""
+    context = MagicMock()
+    context.get_remaining_time_in_millis.return_value = 20000
+
+    assert get_drain_seconds({}) == 60.0
+    assert get_drain_seconds({"max_seconds": 10}, context) == 10.0
+    assert get_drain_seconds({}, context) == 15.0
+
+
+@patch("consume.upload_buffered", return_value=True)
+def test_consume_handler_drains_max_messages(mock_upload_buffered, kept_clients,
+                                              make_message):
+    """At most max_messages are consumed, and the consumer is kept open for the next drain"""
+    consumer = MagicMock()
+    consumer.consume.side_effect = lambda num_messages, timeout: [
+        make_message() for _ in range(num_messages)]
+    kept_clients["consumer"] = consumer
+
+    result = consume_handler({"max_messages": 5, "batch_size": 2})
+
+    assert result["succeeded"]
+    assert result["committed"] == 5
+    assert [c.args[0] for c in consumer.consume.call_args_list] == [2, 2, 1]
+    consumer.close.assert_not_called()
+    assert handler.clients["consumer"] is consumer
+
+
+@patch("consume.upload_buffered", return_value=False)
+def test_consume_handler_discards_consumer_after_failed_upload(mock_upload_buffered,
+                                                              kept_clients, make_message):
+    """A failed upload closes the consumer, so the uncommitted batch is re-read"""
+    consumer = MagicMock()
+    consumer.consume.return_value = [make_message()]
+    kept_clients["consumer"] = consumer
+
+    result = consume_handler({"max_messages": 1})
+
+    assert not result["succeeded"]
+    consumer.commit.assert_not_called()
+    consumer.close.assert_called_once()
+    assert "consumer" not in handler.clients
+
+
+@patch("pipeline.load_incremental")
+@patch("extract.get_s3_client")
+def test_pipeline_handler_loads_incrementally(mock_get_s3_client, mock_load_incremental):
+    """The pipeline handler loads changed objects with the kept clients"""
+    mock_load_incremental.return_value = {"lmnh_hist_data_0.csv": 4,
+                                          "lmnh_hist_data_1.csv": 6}
+
+    first = pipeline_handler({"bucket": "museum"})
+    pipeline_handler({"bucket": "museum"})
+
+    assert first["objects"] == 2
+    assert first["rows"] == 10
+    mock_get_s3_client.assert_called_once()
+    assert mock_load_incremental.call_args.args[:5] == (
+        mock_get_s3_client.return_value, handler.clients["pool"], "museum", None, "insert")
+
+
+@patch("dead_letter.get_dead_letter_sink")
+@patch("consume.upload_buffered", return_value=True)
+def test_consume_handler_keeps_a_sink_per_dead_letter_setting(mock_upload_buffered,
+                                                              mock_get_sink, kept_clients):
+    """Later events with other dead letter settings get their own sink"""
+    consumer = MagicMock()
+    consumer.consume.return_value = []
+    kept_clients["consumer"] = consumer
+    event = {"max_messages": 1, "max_seconds": 0, "dead_letter_path": "other.jsonl"}
+
+    consume_handler(event)
+    consume_handler(event)
+
+    mock_get_sink.assert_called_once_with("file", "other.jsonl")
+    assert kept_clients[("dead_letters", "file", "other.jsonl")] is mock_get_sink.return_value
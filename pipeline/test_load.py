@@ -0,0 +1,85 @@
+"""Test functionality of load python file"""
+
+import logging
+from unittest.mock import patch, MagicMock
+
+from dimensions import DimensionCache
+from load import copy_instances, load_kiosk_stream
+
+KIOSK_ROWS = [["2022-10-30 09:00:38", "1", "3", ""],
+              ["2022-10-30 09:01:38", "2", "-1", "1.0"],
+              ["2022-10-30 19:00:38", "2", "4", ""],
+              ["2022-10-30 10:00:38", "0", "0", ""]]
+
+
+@patch("load.get_cursor")
+def test_copy_instances_flushes_bounded_buffers(mock_get_cursor):
+    """Rows are copied in buffers of bounded size and committed once"""
+    conn = MagicMock()
+    copied = []
+    mock_get_cursor.return_value.copy_expert.side_effect = (
+        lambda sql, buffer: copied.append(buffer.read()))
+    rows = [("2023-06-01 10:00:00", 1, 2)] * 10
+
+    uploaded = copy_instances(conn, "rating_instance", rows, None, buffer_size=50)
+
+    assert uploaded == 10
+    assert len(copied) > 1
+    assert "".join(copied).count("\n") == 10
+    conn.commit.assert_called_once()
+
+
+@patch("load.get_cursor")
+def test_copy_instances_limits_rows(mock_get_cursor):
+    """Only the requested number of rows are copied"""
+    rows = [("2023-06-01 10:00:00", 1, 2)] * 10
+
+    assert copy_instances(MagicMock(), "support_instance", rows, 3) == 3
+
+
+@patch("load.upload_instances")
+def test_load_kiosk_stream_routes_and_batches(mock_upload_instances, seeded_dimensions):
+    """Valid rows are formatted per table and uploaded in bounded batches"""
+    pool = MagicMock()
+    pool.run.side_effect = lambda func, *args: func(MagicMock(), *args)
+
+    uploaded = load_kiosk_stream(pool, [KIOSK_ROWS[:2], KIOSK_ROWS[2:]],
+                                 None, batch_size=1, dimensions=seeded_dimensions)
+
+    assert uploaded == {"rating_instance": 2, "support_instance": 1}
+    tables = [call.args[1] for call in mock_upload_instances.call_args_list]
+    assert tables.count("rating_instance") == 2
+    assert ("2022-10-30 09:01:38", 3, 2, None) in mock_upload_instances.call_args_list[1].args[2]
+
+
+@patch("load.upload_instances", return_value=0.5)
+def test_load_kiosk_stream_logs_rates_per_table(mock_upload_instances, seeded_dimensions, caplog):
+    """One rows per second line is logged per table for the whole load, not per batch"""
+    pool = MagicMock()
+    pool.run.side_effect = lambda func, *args: func(MagicMock(), *args)
+
+    with caplog.at_level(logging.INFO):
+        load_kiosk_stream(pool, [KIOSK_ROWS], None, batch_size=1, dimensions=seeded_dimensions)
+
+    rates = [r.getMessage() for r in caplog.records if "rows/s" in r.getMessage()]
+    assert rates == ["Loaded 2 rows into rating_instance in 1.00s (2 rows/s).",
+                     "Loaded 1 rows into support_instance in 0.50s (2 rows/s)."]
+
+
+@patch("load.upload_instances")
+def test_load_kiosk_stream_limits_rows(mock_upload_instances, seeded_dimensions):
+    """num_rows limits the rows uploaded to each table"""
+    uploaded = load_kiosk_stream(MagicMock(), [KIOSK_ROWS], 1, dimensions=seeded_dimensions)
+
+    assert uploaded == {"rating_instance": 1, "support_instance": 1}
+
+
+@patch("load.upload_instances")
+def test_load_kiosk_stream_drops_unknown_sites(mock_upload_instances):
+    """Rows whose site has no exhibition are dropped before they reach the database"""
+    dimensions = DimensionCache()
+    dimensions.set_mappings({1: 2, 2: 3}, {val: val + 1 for val in range(5)}, {1: 2})
+
+    uploaded = load_kiosk_stream(MagicMock(), [KIOSK_ROWS], None, dimensions=dimensions)
+
+    assert uploaded == {"rating_instance": 1, "support_instance": 1}
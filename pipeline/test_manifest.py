@@ -0,0 +1,49 @@
+"""Test functionality of manifest python file"""
+
+from datetime import datetime, timezone
+
+from manifest import (get_changed_objects,
+                      is_truncated,
+                      load_manifest,
+                      record_object,
+                      save_manifest)
+
+OBJECT = {"Key": "lmnh_hist_data_0.csv", "ETag": '"abc"', "Size": 100,
+          "LastModified": datetime(2023, 6, 1, tzinfo=timezone.utc)}
+
+
+def test_load_manifest_missing_file(tmp_path):
+    """A folder without a manifest has no processed objects"""
+    assert load_manifest(str(tmp_path)) == {}
+
+
+def test_manifest_round_trip(tmp_path):
+    """Recorded objects are saved and loaded back"""
+    manifest = {}
+    record_object(manifest, OBJECT, 42)
+    save_manifest(manifest, str(tmp_path))
+
+    loaded = load_manifest(str(tmp_path))
+
+    assert loaded["lmnh_hist_data_0.csv"] == {
+        "etag": '"abc"', "size": 100,
+        "last_modified": "2023-06-01T00:00:00+00:00", "row_count": 42}
+
+
+def test_get_changed_objects():
+    """Only new objects or objects with a different ETag or size are returned"""
+    manifest = {}
+    record_object(manifest, OBJECT, 42)
+    changed_etag = {**OBJECT, "Key": "lmnh_hist_data_0.csv", "ETag": '"def"'}
+    new_object = {**OBJECT, "Key": "lmnh_hist_data_1.csv"}
+
+    assert get_changed_objects([OBJECT], manifest) == []
+    assert get_changed_objects([changed_etag, new_object], manifest) == [
+        changed_etag, new_object]
+
+
+def test_is_truncated_only_with_a_reached_limit():
+    """Only loads that reached num_rows on a table may have been cut short"""
+    assert not is_truncated({"rating_instance": 5, "support_instance": 1}, None)
+    assert not is_truncated({"rating_instance": 5, "support_instance": 1}, 10)
+    assert is_truncated({"rating_instance": 10, "support_instance": 1}, 10)
@@ -0,0 +1,78 @@
+"""Test functionality of metrics python file"""
+
+from unittest.mock import patch
+
+import pytest
+
+from metrics import (dump_metrics,
+                     inc,
+                     observe,
+                     record_rows,
+                     render_metrics,
+                     reset_metrics,
+                     timed)
+
+
+@pytest.fixture(autouse=True)
+def clean_metrics():
+    """Start each test without recorded metrics"""
+    reset_metrics()
+    yield
+    reset_metrics()
+
+
+def test_counters_render_with_labels():
+    """Counters add up per label set and render in the Prometheus text format"""
+    inc("kiosk_messages_total", outcome="accepted")
+    inc("kiosk_messages_total", 2, outcome="accepted")
+    inc("kiosk_messages_total", outcome="invalid_site")
+
+    lines = render_metrics().splitlines()
+
+    assert lines[0] == "# TYPE kiosk_messages_total counter"
+    assert 'kiosk_messages_total{outcome="accepted"} 3' in lines
+    assert 'kiosk_messages_total{outcome="invalid_site"} 1' in lines
+
+
+def test_histogram_buckets_are_cumulative():
+    """Histogram buckets count every observation at or below their bound"""
+    observe("stage_seconds", 0.002, stage="poll")
+    observe("stage_seconds", 2.0, stage="poll")
+
+    text = render_metrics()
+
+    assert 'stage_seconds_bucket{stage="poll",le="0.001"} 0' in text
+    assert 'stage_seconds_bucket{stage="poll",le="0.005"} 1' in text
+    assert 'stage_seconds_bucket{stage="poll",le="+Inf"} 2' in text
+    assert 'stage_seconds_count{stage="poll"} 2' in text
+
+
+@patch("metrics.perf_counter", side_effect=[1.0, 1.25])
+def test_timed_records_stage(mock_perf_counter):
+    """Timed stages are recorded in the stage_seconds histogram"""
+    with timed("validate"):
+        pass
+
+    assert 'stage_seconds_sum{stage="validate"} 0.25' in render_metrics()
+
+
+def test_record_rows_sets_rate():
+    """Loaded rows are counted and their rate per second kept per table"""
+    record_rows("rating_instance", 500, 0.5)
+
+    text = render_metrics()
+
+    assert 'rows_loaded_total{table="rating_instance"} 500' in text
+    assert 'rows_per_second{table="rating_instance"} 1000.0' in text
+
+
+def test_dump_metrics_replaces_file(tmp_path):
+    """Dumps replace the previous file without leaving a temporary file"""
+    file_path = tmp_path / "metrics.prom"
+    file_path.write_text("old")
+    inc("rows_loaded_total", 5, table="support_instance")
+
+    dump_metrics(str(file_path))
+
+    assert 'rows_loaded_total{table="support_instance"} 5' in file_path.read_text()
+    assert list(tmp_path.iterdir()) == [file_path]
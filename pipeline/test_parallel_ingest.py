@@ -0,0 +1,119 @@
+"""Test functionality of parallel ingest python file"""
+
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from unittest.mock import patch, MagicMock
+
+from parallel_ingest import (IngestResult,
+                             IngestTask,
+                             get_file_tasks,
+                             get_object_rows,
+                             get_ranges,
+                             ingest_incremental,
+                             ingest_parallel,
+                             ingest_task,
+                             read_task_lines,
+                             stream_task_rows)
+
+HEADER = "at,site,val,type\n"
+
+
+def write_rows(file_path, num_rows: int) -> list[str]:
+    """Write a kiosk csv file of numbered rows, returning its lines"""
+    lines = [f"2022-10-30 10:{i // 60:02d}:{i % 60:02d},{i % 6},{i % 5},\n"
+             for i in range(num_rows)]
+    file_path.write_text(HEADER + ''.join(lines), encoding='utf-8')
+    return lines
+
+
+def test_get_ranges_splits_large_objects():
+    """Objects larger than the split size are split into contiguous ranges"""
+    assert get_ranges(100, 1000) == [(0, None)]
+    assert get_ranges(100, 40) == [(0, 33), (33, 66), (66, None)]
+
+
+def test_byte_ranges_read_each_line_once(tmp_path):
+    """Line-aligned ranges of a file cover every row exactly once, without the header"""
+    file_path = tmp_path / "lmnh_hist_data_0.csv"
+    lines = write_rows(file_path, 500)
+
+    for split_size in (1, 37, 1024, 10 ** 6):
+        tasks = get_file_tasks([str(file_path)], split_size)
+        read = [line.decode() for task in tasks for _, line in read_task_lines(task)]
+        assert read == lines
+
+
+def test_stream_task_rows_reads_s3_range():
+    """S3 tasks read from the byte before their range and stop after their last line"""
+    data = (HEADER + "a,1,2,\nb,3,4,\nc,5,0,\n").encode()
+    s3 = MagicMock()
+    s3.get_object.side_effect = lambda Bucket, Key, Range: {
+        "Body": MagicMock(iter_lines=lambda keepends: BytesIO(
+            data[int(Range[6:-1]):]).readlines())}
+    start = len(HEADER) + 3
+
+    with patch("parallel_ingest.get_s3_client", return_value=s3):
+        rows = list(stream_task_rows(IngestTask("lmnh_hist_data_0.csv", "bucket", start, None)))
+
+    s3.get_object.assert_called_once_with(Bucket="bucket", Key="lmnh_hist_data_0.csv",
+                                          Range=f"bytes={start - 1}-")
+    # source ids hold the same offsets as a read of the whole object
+    assert rows == [[["b", "3", "4", "", f"lmnh_hist_data_0.csv@{data.index(b'b,3')}"],
+                     ["c", "5", "0", "", f"lmnh_hist_data_0.csv@{data.index(b'c,5')}"]]]
+
+
+@patch("parallel_ingest.ConnectionPool")
+@patch("parallel_ingest.load_kiosk_stream")
+def test_ingest_task_returns_failures(mock_load_kiosk_stream, mock_pool):
+    """A failed task returns its error and still closes its connection"""
+    mock_load_kiosk_stream.side_effect = ValueError("bad row")
+
+    result = ingest_task(IngestTask("lmnh_hist_data_0.csv"))
+
+    assert result.rows == {}
+    assert "bad row" in result.error
+    mock_pool.return_value.close.assert_called_once()
+
+
+def test_get_object_rows_marks_failed_objects():
+    """Rows are summed over an object's ranges, and one failed range fails the object"""
+    results = [IngestResult(IngestTask("a", None, 0, 10), {"rating_instance": 3}, 1.0),
+               IngestResult(IngestTask("a", None, 10), {"support_instance": 1}, 1.0),
+               IngestResult(IngestTask("b", None, 0, 10), {}, 1.0, "ValueError()"),
+               IngestResult(IngestTask("b", None, 10), {"rating_instance": 2}, 1.0)]
+
+    assert get_object_rows(results) == {"a": 4, "b": None}
+
+
+@patch("parallel_ingest.ProcessPoolExecutor", ThreadPoolExecutor)
+@patch("parallel_ingest.ingest_task")
+def test_ingest_parallel_collects_results(mock_ingest_task):
+    """Every task is submitted and its result collected"""
+    mock_ingest_task.side_effect = lambda task, num_rows, load_mode, profile_dir: IngestResult(
+        task, {"rating_instance": 1, "support_instance": 0}, 0.1)
+    tasks = [IngestTask(f"lmnh_hist_data_{i}.csv") for i in range(3)]
+
+    results = ingest_parallel(tasks, workers=2, load_mode="copy")
+
+    assert sorted(result.task for result in results) == tasks
+    mock_ingest_task.assert_any_call(tasks[0], None, "copy", None)
+
+
+@patch("parallel_ingest.save_manifest")
+@patch("parallel_ingest.load_manifest", return_value={})
+@patch("parallel_ingest.ingest_parallel")
+@patch("parallel_ingest.list_bucket_objects")
+def test_ingest_incremental_skips_failed_objects(mock_list, mock_ingest_parallel,
+                                                 mock_load_manifest, mock_save_manifest):
+    """Only objects whose tasks all loaded are recorded in the manifest"""
+    mock_list.return_value = [{"Key": "lmnh_hist_data_0.csv", "ETag": "a", "Size": 10},
+                              {"Key": "lmnh_hist_data_1.csv", "ETag": "b", "Size": 10}]
+    mock_ingest_parallel.return_value = [
+        IngestResult(IngestTask("lmnh_hist_data_0.csv", "bucket"), {"rating_instance": 5}, 1.0),
+        IngestResult(IngestTask("lmnh_hist_data_1.csv", "bucket"), {}, 1.0, "OSError()")]
+
+    ingest_incremental(MagicMock(), "bucket", workers=2)
+
+    manifest = mock_save_manifest.call_args.args[0]
+    assert list(manifest) == ["lmnh_hist_data_0.csv"]
+    assert manifest["lmnh_hist_data_0.csv"]["row_count"] == 5
@@ -1,6 +1,8 @@
 """Test functionality of extract python file"""
 
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, mock_open
+
+import pytest
 
 from pipeline import (load_kiosk_data)
 
@@ -33,3 +35,117 @@ def test_load_kiosk_data(mock_file, mock_logging):
     mock_logging.assert_called_with('Kiosk data successfully acquired.')
     mock_file.assert_called_with(
         'museum_files/lmnh_merged_hist_data.csv', 'r', encoding='utf-8')
+
+
+KIOSK_ROWS = [["2022-10-30 09:00:38", "1", "3", ""],
+              ["2022-10-30 09:01:38", "2", "-1", "1.0"],
+              ["2022-10-30 19:00:38", "2", "4", ""],
+              ["2022-10-30 10:00:38", "0", "0", ""]]
+
+
+def test_stream_kiosk_data_chunks(tmp_path):
+    """The merged file is yielded in chunks without its header"""
+    from pipeline import stream_kiosk_data
+
+    lines = ["at,site,val,type"] + [",".join(row) for row in KIOSK_ROWS]
+    (tmp_path / "lmnh_merged_hist_data.csv").write_text("\n".join(lines))
+
+    chunks = list(stream_kiosk_data(str(tmp_path), chunk_size=3))
+
+    assert [[row[:4] for row in chunk] for chunk in chunks] == [KIOSK_ROWS[:3], KIOSK_ROWS[3:]]
+    assert chunks[0][0][4] == f"lmnh_merged_hist_data.csv@{len(lines[0]) + 1}"
+
+
+@patch("pipeline.load_kiosk_stream")
+@patch("pipeline.download_objects")
+@patch("pipeline.list_bucket_objects")
+def test_load_incremental_skips_loaded_objects(mock_list, mock_download,
+                                               mock_load_kiosk_stream, tmp_path):
+    """Only changed objects are loaded and then recorded in the manifest"""
+    from manifest import load_manifest, record_object, save_manifest
+    from pipeline import load_incremental
+
+    loaded = {"Key": "lmnh_hist_data_0.csv", "ETag": "a", "Size": 1}
+    new = {"Key": "lmnh_hist_data_1.csv", "ETag": "b", "Size": 1}
+    manifest = {}
+    record_object(manifest, loaded, 1)
+    save_manifest(manifest, str(tmp_path))
+    (tmp_path / new["Key"]).write_text("at,site,val,type\n")
+    mock_list.return_value = [loaded, new]
+    mock_download.return_value = ([new["Key"]], [])
+    mock_load_kiosk_stream.return_value = {"rating_instance": 3,
+                                           "support_instance": 1}
+
+    assert load_incremental(MagicMock(), MagicMock(), "museum", None, "insert",
+                            str(tmp_path)) == {new["Key"]: 4}
+    assert mock_download.call_args.args[2] == [new]
+    assert load_manifest(str(tmp_path))[new["Key"]]["row_count"] == 4
+    assert not (tmp_path / new["Key"]).exists()
+
+
+@patch("pipeline.load_kiosk_stream")
+@patch("pipeline.download_objects")
+@patch("pipeline.list_bucket_objects")
+def test_load_incremental_skips_truncated_objects(mock_list, mock_download,
+                                                  mock_load_kiosk_stream, tmp_path):
+    """Objects that num_rows cut short are not recorded, so a later run loads them in full"""
+    from manifest import load_manifest
+    from pipeline import load_incremental
+
+    new = {"Key": "lmnh_hist_data_0.csv", "ETag": "a", "Size": 1}
+    (tmp_path / new["Key"]).write_text("at,site,val,type\n")
+    mock_list.return_value = [new]
+    mock_download.return_value = ([new["Key"]], [])
+    mock_load_kiosk_stream.return_value = {"rating_instance": 2, "support_instance": 1}
+
+    load_incremental(MagicMock(), MagicMock(), "museum", 2, "insert", str(tmp_path))
+
+    assert load_manifest(str(tmp_path)) == {}
+
+
+@patch("pipeline.ingest_parallel")
+@patch("pipeline.download_specific_files")
+def test_load_parallel_stops_on_failed_downloads(mock_download, mock_ingest_parallel):
+    """Files are not loaded when any of them failed to download"""
+    from pipeline import load_parallel
+
+    mock_download.return_value = (["lmnh_hist_data_0.csv"], ["lmnh_hist_data_1.csv"])
+
+    assert not load_parallel(MagicMock(), "museum", 2, None, "copy", False, "files")
+    mock_ingest_parallel.assert_not_called()
+
+
+@patch("pipeline.ingest_incremental")
+@patch("pipeline.ingest_parallel")
+@patch("pipeline.list_bucket_objects")
+@pytest.mark.parametrize("incremental", [False, True])
+def test_load_parallel_fails_on_failed_tasks(mock_list, mock_ingest_parallel,
+                                             mock_ingest_incremental, incremental, caplog):
+    """A task that failed to load fails the run and is logged"""
+    from parallel_ingest import IngestResult, IngestTask
+    from pipeline import load_parallel
+
+    mock_list.return_value = [{"Key": "lmnh_hist_data_0.csv", "Size": 10}]
+    results = [IngestResult(IngestTask("lmnh_hist_data_0.csv", "museum"), {}, 0.1),
+               IngestResult(IngestTask("lmnh_hist_data_1.csv", "museum", 64), {}, 0.1,
+                            "connection lost")]
+    mock_ingest_parallel.return_value = results
+    mock_ingest_incremental.return_value = results
+
+    assert not load_parallel(MagicMock(), "museum", 2, None, "copy", incremental, "s3")
+    assert "lmnh_hist_data_1.csv from byte 64" in caplog.text
+    assert "lmnh_hist_data_0.csv" not in caplog.text
+
+
+@patch("pipeline.ingest_parallel")
+@patch("pipeline.list_bucket_objects")
+def test_load_parallel_succeeds_when_every_task_loads(mock_list, mock_ingest_parallel):
+    """The run succeeds when no task failed"""
+    from parallel_ingest import IngestResult, IngestTask
+    from pipeline import load_parallel
+
+    mock_list.return_value = []
+    mock_ingest_parallel.return_value = [
+        IngestResult(IngestTask("lmnh_hist_data_0.csv", "museum"), {"rating_instance": 3}, 0.1)]
+
+    assert load_parallel(MagicMock(), "museum", 2, None, "copy", False, "s3")
@@ -0,0 +1,64 @@
+"""Test functionality of profiling python file"""
+
+import sys
+from time import sleep
+
+import profiling
+from metrics import timed
+from profiling import Profiler, collapse_stack, compare_snapshots
+
+
+def test_collapse_stack_lists_frames_outermost_first():
+    """Collapsed stacks start at their root and end at the current function"""
+    stack = collapse_stack(sys._getframe(), ("MainThread", "[poll]"))
+
+    names = stack.split(";")
+    assert names[:2] == ["MainThread", "[poll]"]
+    assert names[-1].startswith("test_collapse_stack_lists_frames_outermost_first (test_profiling.py:")
+
+
+def test_stages_nest_and_snapshot_when_due(tmp_path):
+    """Stages restore the enclosing stage and snapshot at most once per interval"""
+    clock = [0.0]
+    profiler = Profiler(str(tmp_path), snapshot_interval=60, clock=lambda: clock[0])
+
+    with profiler:
+        with timed("extract"):
+            with timed("validate"):
+                assert profiler.stages.get(profiling.get_ident()) == "validate"
+            assert profiler.stages.get(profiling.get_ident()) == "extract"
+        with timed("extract"):
+            pass
+        clock[0] = 60.0
+        with timed("extract"):
+            pass
+
+    assert profiling.active_profiler is None
+    assert profiler.snapshot_counts == {"validate": 1, "extract": 2, "final": 1}
+    assert (tmp_path / "extract_2.tracemalloc").exists()
+
+
+def test_profiler_writes_collapsed_stacks_by_stage(tmp_path):
+    """Sampled stacks are written in the collapsed format, rooted at thread and stage"""
+    with Profiler(str(tmp_path), interval=0.001):
+        with timed("upload"):
+            sleep(0.05)
+
+    lines = (tmp_path / "cpu.collapsed").read_text(encoding="utf-8").splitlines()
+    stacks = {line.rsplit(" ", 1)[0]: int(line.rsplit(" ", 1)[1]) for line in lines}
+    assert any(stack.startswith("MainThread;[upload];") and "test_profiling.py" in stack
+               for stack in stacks)
+    assert all(count > 0 for count in stacks.values())
+
+
+def test_compare_snapshots_reports_growth(tmp_path):
+    """Snapshots can be diffed to find where memory grew"""
+    with Profiler(str(tmp_path)) as profiler:
+        old = profiler.dump_snapshot("before")
+        kept = [bytearray(1024) for _ in range(1000)]
+        new = profiler.dump_snapshot("after")
+
+    lines = compare_snapshots(old, new)
+
+    assert kept
+    assert any("test_profiling.py" in line for line in lines)
@@ -0,0 +1,62 @@
+"""Test functionality of replay dead letters python file"""
+
+import json
+from unittest.mock import patch, MagicMock
+
+from dead_letter import DeadLetter
+from replay_dead_letters import main, replay_dead_letters
+
+AT = "2023-06-01T10:15:00.123456+00:00"
+
+
+def make_dead_letter(data: dict) -> DeadLetter:
+    """Build a dead letter holding the given payload"""
+    return DeadLetter("invalid_site", "lmnh", 0, 1, json.dumps(data).encode())
+
+
+@patch("replay_dead_letters.upload_buffered")
+def test_replay_uploads_valid_and_keeps_rejected(mock_upload_buffered, seeded_dimensions):
+    """Dead letters that now pass are uploaded, the rest keep their new reason"""
+    mock_upload_buffered.return_value = True
+    rejected = MagicMock()
+    dead_letters = [make_dead_letter({"at": AT, "site": "2", "val": 3}),
+                    make_dead_letter({"at": AT, "site": "2", "val": 9})]
+
+    assert replay_dead_letters(MagicMock(), dead_letters, rejected,
+                               dimensions=seeded_dimensions) == (1, 1, True)
+    rejected.write.assert_called_once_with(dead_letters[1]._replace(reason="invalid_val"))
+    mock_upload_buffered.assert_called_once()
+    # the original message position keeps a second replay from loading it again
+    assert mock_upload_buffered.call_args.args[1]["rating_instance"][0][3] == "lmnh:0:1"
+
+
+@patch("replay_dead_letters.upload_buffered")
+def test_replay_stops_on_failed_upload(mock_upload_buffered, seeded_dimensions):
+    """A failed upload stops the replay without committing topic offsets"""
+    mock_upload_buffered.return_value = False
+    consumer = MagicMock()
+    dead_letters = [make_dead_letter({"at": AT, "site": "2", "val": 3})] * 3
+
+    assert replay_dead_letters(MagicMock(), dead_letters, MagicMock(),
+                               batch_size=2, consumer=consumer,
+                               dimensions=seeded_dimensions) == (0, 0, False)
+    consumer.commit.assert_not_called()
+
+
+@patch("replay_dead_letters.rotate_dead_letter_file")
+@patch("replay_dead_letters.replay_dead_letters")
+@patch("replay_dead_letters.ConnectionPool")
+@patch("replay_dead_letters.argparse_is_my_friend")
+def test_main_rotates_file_only_after_complete_replay(mock_args, mock_pool, mock_replay,
+                                                      mock_rotate, tmp_path):
+    """The dead letter file is rotated after a complete replay and kept after a failed one"""
+    mock_args.return_value = ("file", "dead_letters.jsonl",
+                              str(tmp_path / "rejected.jsonl"), 500)
+
+    mock_replay.return_value = (0, 0, False)
+    main()
+    mock_rotate.assert_not_called()
+
+    mock_replay.return_value = (1, 0, True)
+    main()
+    mock_rotate.assert_called_once_with("dead_letters.jsonl")
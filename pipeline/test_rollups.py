@@ -0,0 +1,44 @@
+"""Test functionality of rollups python file"""
+
+from datetime import datetime
+from unittest.mock import MagicMock
+
+from rollups import (AVERAGE_RATING_QUERY,
+                     get_average_ratings,
+                     get_most_visited_exhibitions,
+                     run_rollup_query)
+
+
+def test_run_rollup_query_defaults_to_all_hours():
+    """Without bounds the query covers every hour in the rollup"""
+    conn = MagicMock()
+    curr = conn.cursor.return_value.__enter__.return_value
+    curr.fetchall.return_value = [{"hour": 10, "num_ratings": 4}]
+
+    assert run_rollup_query(conn, "SELECT 1;") == [{"hour": 10, "num_ratings": 4}]
+    curr.execute.assert_called_once_with(
+        "SELECT 1;", {"start": datetime.min, "end": datetime.max})
+
+
+def test_get_average_ratings_passes_bounds():
+    """The requested hours are passed through as query parameters"""
+    conn = MagicMock()
+    curr = conn.cursor.return_value.__enter__.return_value
+    start, end = datetime(2023, 6, 1), datetime(2023, 7, 1)
+
+    get_average_ratings(conn, start, end)
+
+    curr.execute.assert_called_once_with(
+        AVERAGE_RATING_QUERY, {"start": start, "end": end})
+
+
+def test_rollup_queries_never_scan_instances():
+    """Dashboard queries read the rollup tables, not the instance tables"""
+    conn = MagicMock()
+    curr = conn.cursor.return_value.__enter__.return_value
+
+    get_most_visited_exhibitions(conn)
+
+    sql_query = curr.execute.call_args.args[0]
+    assert "rating_hourly_rollup" in sql_query
+    assert "rating_instance" not in sql_query
@@ -0,0 +1,21 @@
+"""Test functionality of runner python file"""
+
+from unittest.mock import MagicMock
+
+from runner import get_consumer_lag, report_workers
+
+
+def test_get_consumer_lag_sums_partitions():
+    """Lag is the gap to the high watermark summed over assigned partitions"""
+    consumer = MagicMock()
+    consumer.position.return_value = [MagicMock(offset=40), MagicMock(offset=-1001)]
+    consumer.get_watermark_offsets.side_effect = [(0, 100), (10, 25)]
+
+    assert get_consumer_lag(consumer) == 60 + 15
+
+
+def test_report_workers_returns_totals():
+    """Reports return the running totals used for the next report"""
+    stats = [30, 5, 10, 0]
+
+    assert report_workers(stats, [10, 10], 2.0) == [30, 10]
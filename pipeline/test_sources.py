@@ -0,0 +1,118 @@
+"""Test functionality of sources python file"""
+
+import json
+from threading import Event
+from unittest.mock import patch, MagicMock
+
+import pytest
+
+from cleaning import clean_data
+from consume import consume_batches
+from sources import FileSource, get_event_seconds, write_messages
+
+
+def make_values(num_messages: int, seconds_apart: int = 10) -> list[bytes]:
+    """Build raw kiosk messages some seconds apart"""
+    return [json.dumps({"at": f"2023-06-01T10:{i * seconds_apart // 60:02d}:"
+                              f"{i * seconds_apart % 60:02d}.000000+00:00",
+                        "site": "2", "val": 3}).encode()
+            for i in range(num_messages)]
+
+
+class FakeClock:
+    """A clock that only moves when waited on"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def wait(self, seconds: float):
+        """Move the clock on instead of sleeping"""
+        self.now += seconds
+
+
+@pytest.mark.parametrize("replay_format", ["ndjson", "length_prefixed"])
+@pytest.mark.parametrize("use_mmap", [False, True])
+def test_file_source_replays_recorded_messages(tmp_path, replay_format, use_mmap):
+    """Every recorded message is replayed in order with its index as offset"""
+    file_path = str(tmp_path / "kiosk.rec")
+    values = make_values(5) + [b'{"at": "not json"']
+    write_messages(file_path, values, replay_format)
+    source = FileSource(file_path, replay_format, use_mmap=use_mmap)
+
+    messages = source.consume(10, 0)
+
+    assert [msg.value() for msg in messages] == values
+    assert [msg.offset() for msg in messages] == list(range(6))
+    assert all(clean_data(msg) for msg in messages[:5])
+    source.close()
+
+
+def test_file_source_sets_stop_event_when_exhausted(tmp_path):
+    """The stop event is set once the file has been read to the end"""
+    file_path = str(tmp_path / "kiosk.ndjson")
+    write_messages(file_path, make_values(2))
+    stop_event = Event()
+    source = FileSource(file_path, stop_event=stop_event)
+
+    assert source.poll(0) is not None
+    assert source.poll(0) is not None
+    assert not stop_event.is_set()
+    assert source.poll(0) is None
+    assert stop_event.is_set()
+
+
+def test_file_source_paces_by_event_time(tmp_path):
+    """Messages are released at the pace their events happened, divided by the speed"""
+    file_path = str(tmp_path / "kiosk.ndjson")
+    write_messages(file_path, make_values(4, seconds_apart=10))
+    clock = FakeClock()
+    source = FileSource(file_path, speed=2, clock=clock, wait=clock.wait)
+
+    assert len(source.consume(10, 1.0)) == 1
+    assert clock.now == 1.0
+    assert len(source.consume(10, 11.0)) == 2
+    assert clock.now == 12.0
+    assert len(source.consume(1, 5.0)) == 1
+    assert clock.now == 15.0
+
+
+def test_file_source_commits_offsets(tmp_path):
+    """Commits record the offset after a message, given offsets or the last message read"""
+    file_path = str(tmp_path / "kiosk.ndjson")
+    write_messages(file_path, make_values(3))
+    source = FileSource(file_path)
+    messages = source.consume(2, 0)
+
+    source.commit(message=messages[0])
+    assert source.committed == 1
+    source.commit(offsets=[MagicMock(offset=2)])
+    assert source.committed == 2
+    source.poll(0)
+    source.commit(asynchronous=False)
+    assert source.committed == 3
+
+
+def test_get_event_seconds_ignores_unreadable_events():
+    """Events without a readable time are not paced"""
+    assert get_event_seconds(b'{"at": "yesterday"}') is None
+    assert get_event_seconds(b'[]') is None
+
+
+@patch("consume.upload_buffered")
+def test_consume_batches_replays_file_to_the_end(mock_upload_buffered, tmp_path,
+                                                 seeded_dimensions):
+    """A replayed file is uploaded in batches and consuming stops once it is exhausted"""
+    mock_upload_buffered.return_value = True
+    file_path = str(tmp_path / "kiosk.ndjson")
+    write_messages(file_path, make_values(5))
+    stop_event = Event()
+    source = FileSource(file_path, stop_event=stop_event)
+
+    assert consume_batches(MagicMock(), source, batch_size=2, max_delay=60,
+                           stop_event=stop_event, dimensions=seeded_dimensions)
+
+    assert mock_upload_buffered.call_count == 3
+    assert source.committed == 5
@@ -0,0 +1,40 @@
+"""Test the start up time of the handler and pipeline entry points"""
+
+from os import environ, path
+import json
+import subprocess
+import sys
+
+import pytest
+
+HEAVY_MODULES = ("pandas", "numpy", "pyarrow", "boto3")
+# generous enough for a slow CI runner, entry points import in about 0.1 seconds
+STARTUP_BUDGET = float(environ.get("STARTUP_BUDGET", 2.0))
+IMPORT_SCRIPT = """
+import json, sys
+from time import perf_counter
+start = perf_counter()
+import {module}
+print(json.dumps({{"seconds": perf_counter() - start,
+                  "loaded": [name for name in {heavy!r} if name in sys.modules]}}))
+"""
+
+
+def time_import(module: str) -> dict:
+    """Import a module in a fresh interpreter, returning the seconds taken and heavy modules loaded"""
+    result = subprocess.run(
+        [sys.executable, "-c", IMPORT_SCRIPT.format(module=module, heavy=HEAVY_MODULES)],
+        cwd=path.dirname(path.abspath(__file__)), capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+@pytest.mark.parametrize("module", ["handler", "consume", "pipeline"])
+def test_entry_points_skip_heavy_imports(module):
+    """Entry points import without pandas, numpy, pyarrow or boto3"""
+    assert time_import(module)["loaded"] == []
+
+
+@pytest.mark.parametrize("module", ["handler", "consume", "pipeline"])
+def test_entry_points_start_within_budget(module):
+    """Entry points import within STARTUP_BUDGET seconds, which the environment can override"""
+    assert time_import(module)["seconds"] < STARTUP_BUDGET